@@ -0,0 +1,286 @@
+"""
+A standalone benchmark runner, measuring how building, serializing and
+serving policies scale as they grow.
+
+Each benchmark is run for policies of several sizes, recording its
+wall time, the memory it allocates (as traced by tracemalloc) and the
+peak resident set size of the process so far. Results are written as
+JSON, so that runs on different commits can be compared:
+
+    python runbenchmarks.py --output before.json
+    # ...make changes...
+    python runbenchmarks.py --output after.json --compare before.json
+
+Run "python runbenchmarks.py --help" for all options.
+
+"""
+
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from django.test import RequestFactory
+
+from flashpolicies import policies, views
+from runtests import SETTINGS_DICT
+
+
+try:
+    import resource
+except ImportError:  # Windows.
+    resource = None
+
+
+APP_DIR = os.path.abspath(os.path.dirname(__file__))
+
+SIZES = (1, 10, 100, 1000, 10000, 100000)
+
+# The number of requests made in each run of the view benchmarks, so
+# that each run takes long enough to time reliably.
+REQUESTS = 1000
+
+FINGERPRINT = "{:040x}"
+
+
+class Benchmark(NamedTuple):
+    """
+    A benchmark: ``setup`` builds the state for a policy of a given
+    size, and ``run`` does the work being measured on that state,
+    returning the number of operations it performed.
+
+    """
+
+    name: str
+    setup: Callable[[int], Any]
+    run: Callable[[Any], int]
+
+
+def make_domains(size: int) -> List[str]:
+    return ["host{}.example.com".format(i) for i in range(size)]
+
+
+def make_policy(size: int) -> policies.Policy:
+    """
+    Returns a policy with ``size`` domains, header domains and
+    identities.
+
+    """
+    domains = make_domains(size)
+    policy = policies.Policy()
+    policy.allow_domains(domains, to_ports=["80", "8000-9000"])
+    policy.allow_headers_many({domain: ["X-Requested-With"] for domain in domains})
+    policy.allow_identities(FINGERPRINT.format(i) for i in range(size))
+    return policy
+
+
+def construct(domains: List[str]) -> int:
+    policies.Policy(*domains)
+    return 1
+
+
+def add_headers(domains: List[str]) -> int:
+    policies.Policy().allow_headers_many(
+        {domain: ["X-Requested-With"] for domain in domains}
+    )
+    return 1
+
+
+def add_identities(size: int) -> int:
+    policies.Policy().allow_identities(FINGERPRINT.format(i) for i in range(size))
+    return 1
+
+
+def serialize(compact: bool) -> Callable[[Any], int]:
+    def run(policy: policies.Policy) -> int:
+        policy.invalidate()
+        policy.serialize(compact)
+        return 1
+
+    return run
+
+
+def xml_dom(policy: policies.Policy) -> int:
+    policy._get_xml_dom()
+    return 1
+
+
+def serve_cold(policy: policies.Policy) -> int:
+    policy.invalidate()
+    views.serve(RequestFactory().get("/crossdomain.xml"), policy)
+    return 1
+
+
+def serve(policy: policies.Policy) -> int:
+    request = RequestFactory().get("/crossdomain.xml")
+    for _ in range(REQUESTS):
+        views.serve(request, policy)
+    return REQUESTS
+
+
+def frozen_policy(size: int) -> policies.FrozenPolicy:
+    return make_policy(size).freeze()
+
+
+BENCHMARKS = (
+    Benchmark("construct", make_domains, construct),
+    Benchmark("allow_headers_many", make_domains, add_headers),
+    Benchmark("allow_identities", int, add_identities),
+    Benchmark("serialize", make_policy, serialize(False)),
+    Benchmark("serialize-compact", make_policy, serialize(True)),
+    Benchmark("xml_dom", make_policy, xml_dom),
+    Benchmark("serve-cold", make_policy, serve_cold),
+    Benchmark("serve", frozen_policy, serve),
+)
+
+
+def peak_rss() -> Optional[int]:
+    """
+    Returns the peak resident set size of this process so far, in
+    bytes, or ``None`` if it cannot be determined.
+
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def measure(benchmark: Benchmark, size: int, repeat: int) -> Dict[str, Any]:
+    times = []
+    for _ in range(repeat):
+        state = benchmark.setup(size)
+        gc.collect()
+        start = time.perf_counter()
+        operations = benchmark.run(state)
+        times.append((time.perf_counter() - start) / operations)
+    # Allocations are measured in a separate run, since tracing them
+    # slows everything down.
+    state = benchmark.setup(size)
+    gc.collect()
+    tracemalloc.start()
+    benchmark.run(state)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "benchmark": benchmark.name,
+        "size": size,
+        "best": min(times),
+        "mean": sum(times) / len(times),
+        "peak_allocated": peak,
+        "retained": retained,
+        "peak_rss": peak_rss(),
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=APP_DIR,
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: List[Dict[str, Any]], path: str):
+    """
+    Prints the ratio of each result's best time to that of the same
+    benchmark in the results saved at ``path``.
+
+    """
+    with open(path) as f:
+        previous = {
+            (result["benchmark"], result["size"]): result
+            for result in json.load(f)["results"]
+        }
+    print("\nCompared with {}:".format(path))
+    for result in results:
+        old = previous.get((result["benchmark"], result["size"]))
+        if old is not None:
+            print(
+                "{:<20} {:>7} {:>8.2f}x".format(
+                    result["benchmark"], result["size"], result["best"] / old["best"]
+                )
+            )
+
+
+def run_benchmarks():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        type=lambda value: [int(size) for size in value.split(",")],
+        default=SIZES,
+        help="Comma-separated policy sizes to benchmark.",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Timed runs of each benchmark."
+    )
+    parser.add_argument(
+        "--benchmark",
+        action="append",
+        choices=[benchmark.name for benchmark in BENCHMARKS],
+        help="Benchmark to run (may be repeated). Defaults to all of them.",
+    )
+    parser.add_argument(
+        "--output", default="benchmarks.json", help="File to write results to."
+    )
+    parser.add_argument("--compare", help="Earlier results file to compare against.")
+    args = parser.parse_args()
+
+    # As with the test runner, configure settings and initialize
+    # Django before doing anything else.
+    from django.conf import settings
+
+    settings.configure(**SETTINGS_DICT)
+
+    import django
+
+    django.setup()
+
+    results = []
+    for benchmark in BENCHMARKS:
+        if args.benchmark and benchmark.name not in args.benchmark:
+            continue
+        for size in args.sizes:
+            result = measure(benchmark, size, args.repeat)
+            results.append(result)
+            print(
+                "{:<20} {:>7} {:>12.1f}us {:>12,}B".format(
+                    benchmark.name,
+                    size,
+                    result["best"] * 1e6,
+                    result["peak_allocated"],
+                )
+            )
+
+    with open(args.output, "w") as f:
+        json.dump(
+            {
+                "commit": git_commit(),
+                "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "platform": platform.platform(),
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    run_benchmarks()
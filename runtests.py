@@ -25,6 +25,7 @@ SETTINGS_DICT = {
         "django.contrib.sessions",
         "django.contrib.sites",
         "flashpolicies",
+        "flashpolicies.db",
     ),
     # Test cases will override this liberally.
     "ROOT_URLCONF": "tests.urls",
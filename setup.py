@@ -35,4 +35,9 @@ setup(
     ],
     python_requires=">=3.7",
     install_requires=["Django>=3.2"],
+    extras_require={
+        "brotli": ["brotli"],
+        "toml": ['tomli; python_version < "3.11"'],
+        "yaml": ["PyYAML"],
+    },
 )
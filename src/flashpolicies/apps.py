@@ -0,0 +1,16 @@
+from django.apps import AppConfig
+from django.conf import settings
+
+
+class FlashPoliciesConfig(AppConfig):
+    name = "flashpolicies"
+    verbose_name = "Flash cross-domain policies"
+
+    def ready(self):
+        # Preloading in ready() means that, under a server which loads
+        # the application before forking its workers, the serialized
+        # policies are produced once and shared by every worker.
+        if getattr(settings, "FLASHPOLICIES_PRELOAD", False):
+            from .discovery import preload
+
+            preload()
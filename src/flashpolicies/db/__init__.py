@@ -0,0 +1,6 @@
+"""
+Optional database storage for cross-domain policies.
+
+Add ``flashpolicies.db`` to ``INSTALLED_APPS`` to use it.
+
+"""
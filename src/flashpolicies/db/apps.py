@@ -0,0 +1,11 @@
+from django.apps import AppConfig
+
+
+class FlashPoliciesDBConfig(AppConfig):
+    name = "flashpolicies.db"
+    label = "flashpolicies_db"
+    verbose_name = "Flash cross-domain policies"
+    default_auto_field = "django.db.models.AutoField"
+
+    def ready(self):
+        from . import signals  # noqa: F401
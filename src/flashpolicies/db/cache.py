@@ -0,0 +1,228 @@
+"""
+Loading stored policies, with caching.
+
+Each stored policy is kept in Django's cache framework already
+serialized (and compressed with each supported encoding), under a key
+which includes a digest of its content, and each process also keeps
+the most recent version of each policy it has seen. Serving a policy
+therefore costs one small cache lookup to check the current version,
+and never touches the database, or serializes anything, unless the
+cache is cold.
+
+When a stored policy changes, the cached copy is regenerated right
+away (see ``flashpolicies.db.signals``) rather than simply deleted, so
+that readers never see a miss. Regeneration takes a lock, and reads
+the database only once it holds it, so that when several changes are
+regenerated at once, the last to store its copy always stores the
+latest version. When a miss does happen, only one process regenerates
+the policy; the others keep serving the version they already have, or
+wait briefly for the new one.
+
+"""
+
+import time
+from typing import Dict, NamedTuple, Optional, Tuple, Union
+
+from django.conf import settings
+from django.core.cache import caches
+
+from flashpolicies import policies
+
+from .models import StoredPolicy
+
+
+KEY_PREFIX = "flashpolicies"
+
+# How long the lock taken while regenerating a policy may be held.
+LOCK_TIMEOUT = 30
+
+# How long to wait for another process to regenerate a policy before
+# giving up and loading it ourselves.
+LOCK_WAIT = 2.0
+
+# Recorded as the version of names which have no stored policy, so
+# that requests for them don't reach the database either.
+MISSING = ""
+
+
+class CachedPolicy(NamedTuple):
+    """
+    One form (pretty-printed or compact) of a stored policy, as kept in
+    the cache: the SHA-256 hash of its serialized form (as returned by
+    ``Policy.digest()``), the time it was cached, and its body, keyed
+    by compression encoding, with ``None`` for the uncompressed body.
+
+    """
+
+    digest: str
+    last_modified: int
+    bodies: Dict[Optional[str], bytes]
+
+
+# The version of a stored policy recorded in the cache: the digest of
+# its serialized form and its ``compact`` setting, or ``MISSING``.
+Version = Union[Tuple[str, bool], str]
+
+# The most recent version of each policy this process has seen, by
+# name and requested ``compact`` argument.
+_local = {}  # type: Dict[Tuple[str, Optional[bool]], Tuple[Version, CachedPolicy]]
+
+
+def _get_cache():
+    return caches[getattr(settings, "FLASHPOLICIES_CACHE", "default")]
+
+
+def _version_key(name: str) -> str:
+    return "{}:version:{}".format(KEY_PREFIX, name)
+
+
+def _policy_key(name: str, digest: str, compact: bool) -> str:
+    return "{}:policy:{}:{}:{}".format(KEY_PREFIX, name, digest, compact)
+
+
+def _lock_key(name: str) -> str:
+    return "{}:lock:{}".format(KEY_PREFIX, name)
+
+
+def load_policy(name: str) -> Optional[policies.Policy]:
+    """
+    Loads the stored policy named ``name`` from the database, or
+    returns ``None`` if there is none.
+
+    """
+    try:
+        stored = StoredPolicy.objects.prefetch_related(
+            "domains", "header_domains", "identities"
+        ).get(name=name)
+    except StoredPolicy.DoesNotExist:
+        return None
+    return stored.to_policy()
+
+
+def _cached_form(policy: policies.Policy, compact: bool) -> CachedPolicy:
+    bodies = {None: policy.serialize(compact)}  # type: Dict[Optional[str], bytes]
+    for encoding in policies.COMPRESSORS:
+        bodies[encoding] = policy.compress(encoding, compact)
+    return CachedPolicy(policy.digest(compact), int(time.time()), bodies)
+
+
+def _refresh(name: str, compact: Optional[bool]) -> Optional[CachedPolicy]:
+    """
+    Does the work of ``refresh()``, which the caller must hold the
+    lock for.
+
+    """
+    cache = _get_cache()
+    policy = load_policy(name)
+    old_version = cache.get(_version_key(name))
+    if policy is None:
+        version = MISSING  # type: Version
+        cached = None
+        for requested in (None, False, True):
+            _local.pop((name, requested), None)
+    else:
+        version = (policy.digest(), policy.compact)
+        if compact is None:
+            compact = policy.compact
+        cached = _cached_form(policy, compact)
+        # The default form is always cached, so that requests which
+        # don't ask for a particular form never miss.
+        forms = {compact: cached}
+        if compact != policy.compact:
+            forms[policy.compact] = _cached_form(policy, policy.compact)
+        for form_compact, form in forms.items():
+            cache.set(_policy_key(name, version[0], form_compact), form, None)
+    cache.set(_version_key(name), version, None)
+    if old_version and old_version != version:
+        cache.delete_many(
+            [
+                _policy_key(name, old_version[0], False),
+                _policy_key(name, old_version[0], True),
+            ]
+        )
+    return cached
+
+
+def refresh(name: str, compact: Optional[bool] = None) -> Optional[CachedPolicy]:
+    """
+    Loads the stored policy named ``name`` from the database, replaces
+    the cached copy with it, and returns it in the form given by
+    ``compact`` (by default, the policy's own ``compact`` setting), or
+    returns ``None`` if there is no such stored policy.
+
+    Waits for any other process regenerating the same policy to finish
+    first, so that the database is read only once it has.
+
+    """
+    cache = _get_cache()
+    # The lock expires after LOCK_TIMEOUT, so this can't wait forever.
+    while not cache.add(_lock_key(name), 1, LOCK_TIMEOUT):
+        time.sleep(0.05)
+    try:
+        return _refresh(name, compact)
+    finally:
+        cache.delete(_lock_key(name))
+
+
+def _cached_policy(
+    name: str, compact: Optional[bool]
+) -> Tuple[bool, Optional[CachedPolicy]]:
+    """
+    Looks up the current version of the policy named ``name`` in the
+    cache, returning whether it was found, and if so the policy in the
+    form given by ``compact`` (or ``None`` if there is no stored policy
+    of that name).
+
+    """
+    cache = _get_cache()
+    version = cache.get(_version_key(name))
+    if version is None:
+        return False, None
+    if version == MISSING:
+        return True, None
+    local = _local.get((name, compact))
+    if local is not None and local[0] == version:
+        return True, local[1]
+    digest, default_compact = version
+    cached = cache.get(
+        _policy_key(name, digest, default_compact if compact is None else compact)
+    )
+    if cached is None:
+        return False, None
+    _local[(name, compact)] = (version, cached)
+    return True, cached
+
+
+def get_policy(name: str, compact: Optional[bool] = None) -> Optional[CachedPolicy]:
+    """
+    Returns the stored policy named ``name``, serialized in the form
+    given by ``compact`` (by default, the policy's own ``compact``
+    setting), or ``None`` if there is none, from the cache if possible.
+
+    """
+    found, cached = _cached_policy(name, compact)
+    if found:
+        return cached
+    cache = _get_cache()
+    if cache.add(_lock_key(name), 1, LOCK_TIMEOUT):
+        try:
+            return _refresh(name, compact)
+        finally:
+            cache.delete(_lock_key(name))
+    # Another process is regenerating the policy. Serve the version
+    # we already have if there is one, otherwise wait for the new one.
+    local = _local.get((name, compact))
+    if local is not None:
+        return local[1]
+    deadline = time.monotonic() + LOCK_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        found, cached = _cached_policy(name, compact)
+        if found:
+            return cached
+    # Load the policy without caching it, since the process holding
+    # the lock may be storing a newer version.
+    policy = load_policy(name)
+    if policy is None:
+        return None
+    return _cached_form(policy, policy.compact if compact is None else compact)
@@ -0,0 +1,149 @@
+# Generated by Django 4.2.30 on 2026-10-17 14:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = []
+
+    operations = [
+        migrations.CreateModel(
+            name="StoredPolicy",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.SlugField(unique=True)),
+                (
+                    "site_control",
+                    models.CharField(
+                        blank=True,
+                        choices=[
+                            ("all", "all"),
+                            ("by-content-type", "by-content-type"),
+                            ("by-ftp-filename", "by-ftp-filename"),
+                            ("master-only", "master-only"),
+                            ("none", "none"),
+                        ],
+                        max_length=20,
+                        verbose_name="metapolicy",
+                    ),
+                ),
+                ("compact", models.BooleanField(default=False)),
+            ],
+            options={
+                "verbose_name": "policy",
+                "verbose_name_plural": "policies",
+                "ordering": ["name"],
+            },
+        ),
+        migrations.CreateModel(
+            name="AllowedIdentity",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("fingerprint", models.CharField(max_length=255)),
+                (
+                    "policy",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="identities",
+                        to="flashpolicies_db.storedpolicy",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name_plural": "allowed identities",
+                "ordering": ["pk"],
+                "unique_together": {("policy", "fingerprint")},
+            },
+        ),
+        migrations.CreateModel(
+            name="AllowedHeaders",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("domain", models.CharField(max_length=255)),
+                (
+                    "headers",
+                    models.CharField(
+                        help_text="Comma-separated header names.", max_length=1000
+                    ),
+                ),
+                ("secure", models.BooleanField(default=True)),
+                (
+                    "policy",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="header_domains",
+                        to="flashpolicies_db.storedpolicy",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name_plural": "allowed headers",
+                "ordering": ["pk"],
+                "unique_together": {("policy", "domain")},
+            },
+        ),
+        migrations.CreateModel(
+            name="AllowedDomain",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("domain", models.CharField(max_length=255)),
+                (
+                    "to_ports",
+                    models.CharField(
+                        blank=True,
+                        help_text="Comma-separated ports, for socket policies.",
+                        max_length=255,
+                    ),
+                ),
+                ("secure", models.BooleanField(default=True)),
+                (
+                    "policy",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="domains",
+                        to="flashpolicies_db.storedpolicy",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["pk"],
+                "unique_together": {("policy", "domain")},
+            },
+        ),
+    ]
@@ -0,0 +1,142 @@
+"""
+Models for storing cross-domain policies in the database.
+
+"""
+
+import itertools
+
+from django.db import models
+
+from flashpolicies import policies
+
+
+def _split(value: str):
+    """
+    Splits a comma-separated field value into a list, ignoring
+    surrounding whitespace and empty items.
+
+    """
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+class StoredPolicy(models.Model):
+    """
+    A cross-domain policy, identified by name.
+
+    """
+
+    name = models.SlugField(unique=True)
+    site_control = models.CharField(
+        "metapolicy",
+        max_length=20,
+        blank=True,
+        choices=[(value, value) for value in policies.VALID_SITE_CONTROL],
+    )
+    compact = models.BooleanField(default=False)
+
+    class Meta:
+        ordering = ["name"]
+        verbose_name = "policy"
+        verbose_name_plural = "policies"
+
+    def __str__(self):
+        return self.name
+
+    def to_policy(self) -> policies.Policy:
+        """
+        Builds the ``flashpolicies.policies.Policy`` this stores.
+
+        """
+        policy = policies.Policy(compact=self.compact)
+        # Consecutive rules with the same options are added together,
+        # which keeps their order and is much faster for long lists.
+        for (to_ports, secure), domains in itertools.groupby(
+            self.domains.all(), lambda domain: (domain.to_ports, domain.secure)
+        ):
+            policy.allow_domains(
+                [domain.domain for domain in domains],
+                to_ports=_split(to_ports) or None,
+                secure=secure,
+            )
+        for secure, rules in itertools.groupby(
+            self.header_domains.all(), lambda rule: rule.secure
+        ):
+            policy.allow_headers_many(
+                [(rule.domain, _split(rule.headers)) for rule in rules], secure=secure
+            )
+        policy.allow_identities(
+            [identity.fingerprint for identity in self.identities.all()]
+        )
+        if self.site_control:
+            policy.metapolicy(self.site_control)
+        return policy
+
+
+class AllowedDomain(models.Model):
+    """
+    A domain from which a stored policy allows access.
+
+    """
+
+    policy = models.ForeignKey(
+        StoredPolicy, on_delete=models.CASCADE, related_name="domains"
+    )
+    domain = models.CharField(max_length=255)
+    to_ports = models.CharField(
+        max_length=255,
+        blank=True,
+        help_text="Comma-separated ports, for socket policies.",
+    )
+    secure = models.BooleanField(default=True)
+
+    class Meta:
+        ordering = ["pk"]
+        unique_together = [("policy", "domain")]
+
+    def __str__(self):
+        return self.domain
+
+
+class AllowedHeaders(models.Model):
+    """
+    A domain which a stored policy allows to send HTTP headers.
+
+    """
+
+    policy = models.ForeignKey(
+        StoredPolicy, on_delete=models.CASCADE, related_name="header_domains"
+    )
+    domain = models.CharField(max_length=255)
+    headers = models.CharField(
+        max_length=1000, help_text="Comma-separated header names."
+    )
+    secure = models.BooleanField(default=True)
+
+    class Meta:
+        ordering = ["pk"]
+        unique_together = [("policy", "domain")]
+        verbose_name_plural = "allowed headers"
+
+    def __str__(self):
+        return self.domain
+
+
+class AllowedIdentity(models.Model):
+    """
+    The fingerprint of a signing key whose documents a stored policy
+    allows access from.
+
+    """
+
+    policy = models.ForeignKey(
+        StoredPolicy, on_delete=models.CASCADE, related_name="identities"
+    )
+    fingerprint = models.CharField(max_length=255)
+
+    class Meta:
+        ordering = ["pk"]
+        unique_together = [("policy", "fingerprint")]
+        verbose_name_plural = "allowed identities"
+
+    def __str__(self):
+        return self.fingerprint
@@ -0,0 +1,113 @@
+"""
+Signal handlers which regenerate cached policies when stored policies
+change.
+
+"""
+
+from typing import Dict, Optional
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import cache
+from .models import AllowedDomain, AllowedHeaders, AllowedIdentity, StoredPolicy
+
+
+class _PendingRefresh:
+    """
+    The names of the policies to regenerate once a transaction
+    commits, registered with ``transaction.on_commit()`` when the
+    first of them changes.
+
+    """
+
+    def __init__(self):
+        # A dictionary rather than a set, to refresh in a stable order.
+        self.names = {}  # type: Dict[str, None]
+        self.done = False
+
+    def __call__(self):
+        self.done = True
+        for name in self.names:
+            cache.refresh(name)
+
+
+def _pending_refresh(using: Optional[str]) -> Optional[_PendingRefresh]:
+    """
+    Returns the ``_PendingRefresh`` which will run when the current
+    transaction on the database ``using`` commits, if there is one.
+
+    """
+    connection = transaction.get_connection(using)
+    # Callbacks registered in a transaction, or savepoint, which is
+    # rolled back are removed from this list.
+    for entry in connection.run_on_commit:
+        func = entry[1]
+        if isinstance(func, _PendingRefresh) and not func.done:
+            return func
+    return None
+
+
+def schedule_refresh(name: str, using: Optional[str] = None):
+    """
+    Regenerates the cached copy of the policy named ``name`` once the
+    current transaction (if any) commits.
+
+    Each policy is regenerated only once per transaction, however many
+    of its rules change.
+
+    """
+    pending = _pending_refresh(using)
+    if pending is not None:
+        pending.names[name] = None
+        return
+    pending = _PendingRefresh()
+    pending.names[name] = None
+    transaction.on_commit(pending, using)
+
+
+@receiver(pre_save, sender=StoredPolicy)
+def policy_renamed(sender, instance, using, **kwargs):
+    if instance.pk is None:
+        return
+    old_name = (
+        StoredPolicy.objects.using(using)
+        .filter(pk=instance.pk)
+        .values_list("name", flat=True)
+        .first()
+    )
+    if old_name is not None and old_name != instance.name:
+        schedule_refresh(old_name, using)
+
+
+@receiver(post_save, sender=StoredPolicy)
+@receiver(post_delete, sender=StoredPolicy)
+def policy_changed(sender, instance, using, **kwargs):
+    schedule_refresh(instance.name, using)
+
+
+@receiver(post_save, sender=AllowedDomain)
+@receiver(post_delete, sender=AllowedDomain)
+@receiver(post_save, sender=AllowedHeaders)
+@receiver(post_delete, sender=AllowedHeaders)
+@receiver(post_save, sender=AllowedIdentity)
+@receiver(post_delete, sender=AllowedIdentity)
+def rule_changed(sender, instance, using, **kwargs):
+    # Rules deleted along with their policy are left to
+    # policy_changed(). Before Django 4.1, signals don't say what
+    # started a deletion, so each rule's policy is looked up anyway,
+    # though it is still only refreshed once.
+    origin = kwargs.get("origin")
+    if isinstance(origin, StoredPolicy):
+        return
+    if getattr(origin, "model", None) is StoredPolicy:
+        return
+    name = (
+        StoredPolicy.objects.using(using)
+        .filter(pk=instance.policy_id)
+        .values_list("name", flat=True)
+        .first()
+    )
+    if name is not None:
+        schedule_refresh(name, using)
@@ -0,0 +1,55 @@
+"""
+Views for serving stored policies.
+
+"""
+
+from typing import Any, Dict, Optional, Tuple
+
+from django.http import HttpRequest, HttpResponse
+
+from flashpolicies import views
+from flashpolicies.middleware import policy_exempt
+
+from .cache import get_policy
+
+
+@policy_exempt
+def serve_stored(
+    request: HttpRequest,
+    name: str,
+    cache_control: Optional[Dict[str, Any]] = None,
+    compress: Optional[bool] = None,
+    compact: Optional[bool] = None,
+) -> HttpResponse:
+    """
+    Serves the stored policy named ``name``, from the cache, which
+    holds it already serialized and compressed.
+
+    **Required arguments:**
+
+    ``name``
+        The name of the ``flashpolicies.db.models.StoredPolicy`` to
+        serve. If there is no stored policy of that name, a 404 is
+        returned.
+
+    **Optional arguments:**
+
+    ``cache_control``, ``compress``, ``compact``
+        As accepted by ``flashpolicies.views.serve()``.
+
+    """
+    cached = get_policy(name, compact)
+
+    def lookup(encoding: Optional[str]) -> Optional[Tuple[str, bytes]]:
+        if cached is None or encoding not in cached.bodies:
+            return None
+        return cached.digest, cached.bodies[encoding]
+
+    return views._stored_response(
+        request,
+        lookup,
+        "No stored policy named '{}'.".format(name),
+        cache_control,
+        compress,
+        None if cached is None else cached.last_modified,
+    )
@@ -0,0 +1,139 @@
+"""
+Finding the policies a project's URLconf serves.
+
+"""
+
+import inspect
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from django.conf import settings
+from django.urls import URLResolver, get_resolver
+from django.utils.regex_helper import normalize
+
+from . import policies, views
+
+
+class RoutedPolicy(NamedTuple):
+    """
+    A policy served by a URL pattern, together with the (static) path
+    it is served from and the ``compact`` and ``compress`` arguments
+    passed to the view.
+
+    """
+
+    path: str
+    policy: policies.Policy
+    compact: Optional[bool]
+    compress: Optional[bool] = None
+
+
+def _allowed_domains(kwargs: Dict[str, Any]) -> policies.Policy:
+    return views._build_policy(tuple(kwargs["domains"]))
+
+
+def _metapolicy(kwargs: Dict[str, Any]) -> policies.Policy:
+    return views._build_policy(tuple(kwargs.get("domains") or ()), kwargs["permitted"])
+
+
+def _no_access(kwargs: Dict[str, Any]) -> policies.Policy:
+    return views._build_policy((), policies.SITE_CONTROL_NONE)
+
+
+# For each view whose policy is determined entirely by the arguments
+# in its URL pattern, a function building that policy from the
+# arguments. The per-host views are absent, since what they serve
+# depends on the request.
+BUILDERS = {
+    views.serve: lambda kwargs: kwargs["policy"],
+    views.aserve: lambda kwargs: kwargs["policy"],
+    views.allow_domains: _allowed_domains,
+    views.aallow_domains: _allowed_domains,
+    views.simple: _allowed_domains,
+    views.metapolicy: _metapolicy,
+    views.ametapolicy: _metapolicy,
+    views.no_access: _no_access,
+    views.ano_access: _no_access,
+}  # type: Dict[Callable, Callable[[Dict[str, Any]], policies.Policy]]
+
+
+def _walk(
+    patterns: List[Any], prefix: str, kwargs: Dict[str, Any]
+) -> Iterator[Tuple[str, Callable[[Dict[str, Any]], policies.Policy], Dict[str, Any]]]:
+    """
+    Yields the regular expression, policy builder and arguments of
+    each URL pattern in ``patterns`` which serves a policy through one
+    of the views in ``BUILDERS``.
+
+    """
+    for pattern in patterns:
+        regex = prefix + pattern.pattern.regex.pattern.lstrip("^")
+        if isinstance(pattern, URLResolver):
+            yield from _walk(
+                pattern.url_patterns, regex, {**kwargs, **pattern.default_kwargs}
+            )
+            continue
+        builder = BUILDERS.get(inspect.unwrap(pattern.callback))
+        if builder is not None:
+            yield regex, builder, {**kwargs, **pattern.default_args}
+
+
+def find_policies(urlconf: Optional[str] = None) -> List[RoutedPolicy]:
+    """
+    Returns the policies served by the URLconf ``urlconf`` (by
+    default, the project's root URLconf) through the views in
+    ``flashpolicies.views``, in the order the URL patterns are
+    tried.
+
+    Patterns which capture arguments from the URL, the per-host views
+    and the views serving from a shared store are skipped. If more
+    than one pattern serves the same path, only the first is
+    returned, since it is the one Django would use.
+
+    """
+    found = {}  # type: Dict[str, RoutedPolicy]
+    for regex, builder, args in _walk(get_resolver(urlconf).url_patterns, "", {}):
+        possibilities = normalize(regex)
+        # Only patterns matching exactly one path, without any
+        # captured arguments, can be exported.
+        if len(possibilities) != 1 or possibilities[0][1]:
+            continue
+        path = possibilities[0][0]
+        if path not in found:
+            found[path] = RoutedPolicy(
+                path, builder(args), args.get("compact"), args.get("compress")
+            )
+    return list(found.values())
+
+
+def preload(urlconf: Optional[str] = None) -> int:
+    """
+    Serializes the policy served by each URL pattern in ``urlconf``
+    (by default, the project's root URLconf) through the views in
+    ``flashpolicies.views``, computes the validators the views send
+    with it and, if it is served compressed (as the view's
+    ``compress`` argument, or failing that the setting
+    ``FLASHPOLICIES_COMPRESS``, says), compresses it, so that the
+    first request for it does none of that work. Returns the number
+    of patterns whose policies were preloaded.
+
+    Unlike ``find_policies()``, this includes patterns which capture
+    arguments from the URL, and patterns serving a path another
+    pattern also serves, since preloading needs no single path to
+    write the policy to.
+
+    """
+    default_compress = getattr(settings, "FLASHPOLICIES_COMPRESS", False)
+    count = 0
+    for _, builder, args in _walk(get_resolver(urlconf).url_patterns, "", {}):
+        policy = builder(args)
+        compact = policy._compact(args.get("compact"))
+        policy.serialize(compact)
+        views._validators(policy, compact)
+        compress = args.get("compress")
+        if compress is None:
+            compress = default_compress
+        if compress:
+            for encoding in policies.COMPRESSORS:
+                policy.compress(encoding, compact)
+        count += 1
+    return count
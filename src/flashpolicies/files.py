@@ -0,0 +1,34 @@
+"""
+Writing files which other processes may be reading.
+
+"""
+
+import os
+import tempfile
+
+
+def write_atomic(path: str, *chunks: bytes) -> None:
+    """
+    Writes ``chunks``, one after another, to ``path`` such that
+    anything reading ``path`` sees either its old content or its new
+    content, never a partial write. The directory containing ``path``
+    is created if need be, and the file's permissions follow the
+    umask, as for any other new file.
+
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as temp_file:
+            for chunk in chunks:
+                temp_file.write(chunk)
+        # mkstemp() creates files readable only by their owner, but
+        # whatever reads the file may run as another user.
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(temp_path, 0o666 & ~umask)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
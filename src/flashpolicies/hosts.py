@@ -0,0 +1,84 @@
+"""
+A registry of policies keyed by hostname, for sites which serve a
+different policy on each of many hosts from one deployment.
+
+"""
+
+from typing import Dict, Optional
+
+from . import policies
+
+
+class HostPolicyRegistry:
+    """
+    Maps hostnames to the ``flashpolicies.policies.Policy`` to serve
+    for them.
+
+    A host may be registered either exactly (``media.example.com``) or
+    as a wildcard suffix (``*.example.com``, which matches any
+    subdomain of ``example.com`` but not ``example.com`` itself). When
+    more than one wildcard matches a host, the longest one wins. Exact
+    lookups take constant time, and wildcard lookups take time
+    proportional to the number of labels in the hostname, regardless of
+    how many hosts are registered.
+
+    Policies are serialized as they are registered, so that the first
+    request for each doesn't pay that cost.
+
+    """
+
+    def __init__(
+        self,
+        hosts: Optional[Dict[str, policies.Policy]] = None,
+        default: Optional[policies.Policy] = None,
+    ):
+        self.exact = {}  # type: Dict[str, policies.Policy]
+        self.wildcards = {}  # type: Dict[str, policies.Policy]
+        self.default = default
+        if default is not None:
+            default.serialize()
+        if hosts is not None:
+            for host, policy in hosts.items():
+                self.register(host, policy)
+
+    def register(self, host: str, policy: policies.Policy):
+        """
+        Registers ``policy`` to be served for ``host``, which may be a
+        hostname or a wildcard of the form ``*.example.com``.
+
+        """
+        host = host.lower().rstrip(".")
+        policy.serialize()
+        if host.startswith("*."):
+            self.wildcards[host[2:]] = policy
+        else:
+            self.exact[host] = policy
+
+    def lookup(self, host: str) -> Optional[policies.Policy]:
+        """
+        Returns the policy registered for ``host`` (which may include
+        a port, as returned by ``HttpRequest.get_host()``), or the
+        default policy if none is.
+
+        """
+        host = host.lower()
+        if host.startswith("["):
+            # IPv6 literal, possibly with a port.
+            host = host[: host.find("]") + 1]
+        else:
+            host = host.rpartition(":")[0] or host
+        host = host.rstrip(".")
+        try:
+            return self.exact[host]
+        except KeyError:
+            pass
+        if self.wildcards:
+            suffix = host
+            while True:
+                _, dot, suffix = suffix.partition(".")
+                if not dot:
+                    break
+                policy = self.wildcards.get(suffix)
+                if policy is not None:
+                    return policy
+        return self.default
@@ -0,0 +1,267 @@
+"""
+Building policies from declarative files.
+
+"""
+
+import hashlib
+import json
+import os
+import pickle
+from typing import Any, Callable, Dict, Optional
+
+from django.conf import settings
+
+from . import policies
+from .files import write_atomic
+
+
+try:
+    import tomllib
+except ImportError:  # pragma: no cover
+    try:
+        import tomli as tomllib
+    except ImportError:
+        tomllib = None
+
+try:
+    import yaml
+except ImportError:  # pragma: no cover
+    yaml = None
+
+
+FORMAT_ERROR = "'{}' is not a supported policy file format."
+MISSING_PARSER_ERROR = "Loading {} policy files requires the '{}' package."
+KEY_ERROR = "Unknown key '{}' in policy file."
+RULE_ERROR = "Invalid {} entry in policy file: {!r}."
+
+# Changing the layout of Policy objects, or the way files are
+# interpreted, must change this, so that stale cached policies are
+# not used.
+CACHE_VERSION = "5"
+
+# The format used for each file extension; files with other extensions
+# are read as plain-text domain lists.
+EXTENSIONS = {
+    ".json": "json",
+    ".toml": "toml",
+    ".yaml": "yaml",
+    ".yml": "yaml",
+}
+
+KEYS = ("site_control", "compact", "domains", "headers", "identities")
+
+# The keys each kind of rule may have, and the type of each one's
+# value, where ``list`` means a list of strings.
+RULE_KEYS = {
+    "domains": {"domain": str, "to_ports": list, "secure": bool},
+    "headers": {"domain": str, "headers": list, "secure": bool},
+    "identities": {"fingerprint": str},
+}  # type: Dict[str, Dict[str, type]]
+
+
+def _parse_text(data: bytes) -> Dict[str, Any]:
+    domains = []
+    for line in data.decode("utf-8").splitlines():
+        line = line.split("#", 1)[0].strip()
+        if line:
+            domains.append(line)
+    return {"domains": domains}
+
+
+def _parse_json(data: bytes) -> Dict[str, Any]:
+    return json.loads(data.decode("utf-8"))
+
+
+def _parse_toml(data: bytes) -> Dict[str, Any]:
+    if tomllib is None:  # pragma: no cover
+        raise TypeError(MISSING_PARSER_ERROR.format("TOML", "tomli"))
+    return tomllib.loads(data.decode("utf-8"))
+
+
+def _parse_yaml(data: bytes) -> Dict[str, Any]:
+    if yaml is None:  # pragma: no cover
+        raise TypeError(MISSING_PARSER_ERROR.format("YAML", "PyYAML"))
+    return yaml.load(data, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
+
+
+PARSERS = {
+    "json": _parse_json,
+    "text": _parse_text,
+    "toml": _parse_toml,
+    "yaml": _parse_yaml,
+}  # type: Dict[str, Callable[[bytes], Dict[str, Any]]]
+
+
+def _valid(value: Any, expected: type) -> bool:
+    if expected is list:
+        return isinstance(value, list) and all(isinstance(item, str) for item in value)
+    return isinstance(value, expected)
+
+
+def _rule(kind: str, entry: Any, key: str, *required: str) -> Dict[str, Any]:
+    """
+    Returns the mapping form of a rule of ``kind``, which has the
+    string ``key`` and the other ``required`` keys, and which may be
+    given as just the string if it has no other required keys.
+
+    Every key must be one ``RULE_KEYS`` allows for ``kind``, with a
+    value of the type it gives; in particular, scalars are not
+    accepted in place of lists, since they would be read one
+    character at a time.
+
+    """
+    if isinstance(entry, str) and not required:
+        entry = {key: entry}
+    keys = RULE_KEYS[kind]
+    if (
+        not isinstance(entry, dict)
+        or any(name not in entry for name in (key,) + required)
+        or any(
+            name not in keys or not _valid(value, keys[name])
+            for name, value in entry.items()
+        )
+    ):
+        raise TypeError(RULE_ERROR.format(kind, entry))
+    return entry
+
+
+def _check_config(config: Dict[str, Any]):
+    """
+    Raises ``TypeError`` if ``config`` has unknown keys, or its
+    top-level values are of the wrong type.
+
+    """
+    for key in config:
+        if key not in KEYS:
+            raise TypeError(KEY_ERROR.format(key))
+    for key, expected in (("compact", bool), *((kind, list) for kind in RULE_KEYS)):
+        if key in config and not isinstance(config[key], expected):
+            raise TypeError(RULE_ERROR.format(key, config[key]))
+
+
+def policy_from_dict(config: Dict[str, Any]) -> policies.Policy:
+    """
+    Builds a ``Policy`` from a dictionary in the structure of a
+    policy file.
+
+    The keys ``domains``, ``headers`` and ``identities`` hold lists
+    of rules, each a dictionary of the arguments to the corresponding
+    ``Policy`` method; a domain or identity may instead be given as
+    just a string. The keys ``site_control`` and ``compact`` set the
+    metapolicy and the ``compact`` attribute. Values of the wrong type,
+    and unknown keys, raise ``TypeError``.
+
+    """
+    _check_config(config)
+    policy = policies.Policy(compact=config.get("compact", False))
+    # Rules are gathered first and assigned in one go, rather than
+    # through one method call (and cache invalidation) per rule.
+    domains = {}
+    for entry in config.get("domains", ()):
+        entry = _rule("domains", entry, "domain")
+        domains[entry["domain"]] = policies.domain_rule(
+            entry.get("to_ports"), entry.get("secure", True)
+        )
+    header_domains = {}
+    for entry in config.get("headers", ()):
+        entry = _rule("headers", entry, "domain", "headers")
+        header_domains[entry["domain"]] = policies.header_rule(
+            entry["headers"], entry.get("secure", True)
+        )
+    identities = {}  # type: Dict[str, None]
+    for entry in config.get("identities", ()):
+        identities[_rule("identities", entry, "fingerprint")["fingerprint"]] = None
+    if config.get("site_control") is not None:
+        policy.metapolicy(config["site_control"])
+    if domains or header_domains or identities:
+        if policy.site_control == policies.SITE_CONTROL_NONE:
+            raise TypeError(policies.BAD_POLICY)
+        policy.domains = domains
+        policy.header_domains = header_domains
+        policy.identities = list(identities)
+        policy.invalidate()
+    return policy
+
+
+def parse(data: bytes, format: str) -> policies.Policy:
+    """
+    Builds a ``Policy`` from the contents of a policy file in
+    ``format`` (one of ``"json"``, ``"toml"``, ``"yaml"`` or
+    ``"text"``).
+
+    """
+    try:
+        parser = PARSERS[format]
+    except KeyError:
+        raise TypeError(FORMAT_ERROR.format(format))
+    config = parser(data)
+    if not isinstance(config, dict):
+        raise TypeError(RULE_ERROR.format("top-level", config))
+    return policy_from_dict(config)
+
+
+def _get_cache_dir() -> Optional[str]:
+    if not settings.configured:
+        return None
+    return getattr(settings, "FLASHPOLICIES_LOADER_CACHE_DIR", None)
+
+
+def _read_cached(path: str) -> Optional[policies.Policy]:
+    try:
+        with open(path, "rb") as f:
+            policy = pickle.load(f)
+    except Exception:
+        # A missing, damaged or incompatible cache file is simply
+        # (re)created.
+        return None
+    return policy if isinstance(policy, policies.Policy) else None
+
+
+def _write_cached(path: str, policy: policies.Policy):
+    try:
+        write_atomic(path, pickle.dumps(policy, protocol=pickle.HIGHEST_PROTOCOL))
+    except OSError:
+        # Caching is an optimization; failing to cache is not an error.
+        pass
+
+
+def load(
+    path: str, format: Optional[str] = None, cache_dir: Optional[str] = None
+) -> policies.Policy:
+    """
+    Builds a ``Policy`` from the policy file at ``path``.
+
+    The format is chosen by the file's extension unless given as
+    ``format``; files with unrecognized extensions are read as
+    plain-text lists of domains, one per line, with ``#`` starting a
+    comment.
+
+    If ``cache_dir`` is given (or the setting
+    ``FLASHPOLICIES_LOADER_CACHE_DIR`` is), the built policy, with its
+    serialized form, is stored there keyed by a hash of the file's
+    contents, and later loads of an unchanged file read it back
+    without parsing the file again. Since the cache is unpickled, the
+    directory must be writable only by trusted users.
+
+    """
+    if format is None:
+        format = EXTENSIONS.get(os.path.splitext(path)[1].lower(), "text")
+    with open(path, "rb") as f:
+        data = f.read()
+    if cache_dir is None:
+        cache_dir = _get_cache_dir()
+    if cache_dir is None:
+        return parse(data, format)
+    key = hashlib.sha256(
+        "{}:{}:".format(CACHE_VERSION, format).encode("utf-8") + data
+    ).hexdigest()
+    cache_path = os.path.join(cache_dir, "{}.pickle".format(key))
+    policy = _read_cached(cache_path)
+    if policy is None:
+        policy = parse(data, format)
+        # Serialize before caching, so the cached copy carries its
+        # serialized form and digest too.
+        policy.serialize()
+        policy.digest()
+        _write_cached(cache_path, policy)
+    return policy
@@ -0,0 +1,115 @@
+"""
+Management command which writes the policies served by the URLconf to
+static files.
+
+"""
+
+import hashlib
+import json
+import os
+from typing import Dict
+
+from django.core.management.base import BaseCommand, CommandError
+
+from flashpolicies import policies
+from flashpolicies.discovery import find_policies
+from flashpolicies.files import write_atomic
+
+
+MANIFEST = "manifest.json"
+
+# The file extension used for each compression encoding.
+SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+
+def file_digest(path: str) -> str:
+    """
+    Returns the SHA-256 hash of the file at ``path``, or an empty
+    string if there is no such file.
+
+    """
+    try:
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except FileNotFoundError:
+        return ""
+
+
+class Command(BaseCommand):
+    help = (
+        "Writes the policies served through flashpolicies views in the URLconf "
+        "to a directory, for serving as static files."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("directory", help="Directory to write the policies to.")
+        parser.add_argument(
+            "--compress",
+            action="store_true",
+            help=(
+                "Also write a precompressed copy of each policy for each supported "
+                "encoding (.gz, and .br if brotli is installed)."
+            ),
+        )
+        parser.add_argument(
+            "--urlconf",
+            default=None,
+            help="Dotted path of the URLconf to export. Defaults to ROOT_URLCONF.",
+        )
+
+    def handle(self, *args, **options):
+        directory = os.path.abspath(options["directory"])
+        files = {}  # type: Dict[str, bytes]
+        for routed in find_policies(options["urlconf"]):
+            name = routed.path
+            if not name or name.endswith("/") or ".." in name.split("/"):
+                raise CommandError(
+                    "Cannot export a policy to the path '{}'.".format(name)
+                )
+            files[name] = routed.policy.serialize(routed.compact)
+            if options["compress"]:
+                for encoding in policies.COMPRESSORS:
+                    files[name + SUFFIXES[encoding]] = routed.policy.compress(
+                        encoding, routed.compact
+                    )
+        manifest = {}  # type: Dict[str, str]
+        written = 0
+        for name, content in files.items():
+            digest = hashlib.sha256(content).hexdigest()
+            manifest[name] = digest
+            path = os.path.join(directory, *name.split("/"))
+            if file_digest(path) != digest:
+                write_atomic(path, content)
+                written += 1
+                if options["verbosity"] > 1:
+                    self.stdout.write("Wrote {}".format(name))
+        self.remove_stale(directory, manifest, options["verbosity"])
+        write_atomic(
+            os.path.join(directory, MANIFEST),
+            json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8"),
+        )
+        self.stdout.write(
+            "Exported {} files ({} changed) to {}.".format(
+                len(manifest), written, directory
+            )
+        )
+
+    def remove_stale(self, directory, manifest, verbosity):
+        """
+        Removes files recorded in the previous manifest which are no
+        longer exported.
+
+        """
+        try:
+            with open(os.path.join(directory, MANIFEST), "rb") as f:
+                previous = json.loads(f.read().decode("utf-8"))
+        except FileNotFoundError:
+            return
+        for name in previous:
+            if name not in manifest:
+                try:
+                    os.unlink(os.path.join(directory, *name.split("/")))
+                except FileNotFoundError:
+                    pass
+                if verbosity > 1:
+                    self.stdout.write("Removed {}".format(name))
@@ -0,0 +1,109 @@
+"""
+Management command which runs a Flash socket policy server.
+
+"""
+
+import asyncio
+import importlib
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+
+from flashpolicies import policies
+from flashpolicies.server import DEFAULT_PORT, PolicyServer, PreforkPolicyServer
+
+
+def load_policy(path: str, reload: bool = False) -> policies.Policy:
+    """
+    Imports the policy named by the dotted ``path``, which may refer
+    either to a ``Policy`` instance or to a callable returning one.
+
+    If ``reload`` is ``True``, the module containing the policy is
+    re-imported first, so that changes made to it since it was first
+    imported take effect.
+
+    """
+    try:
+        if reload:
+            importlib.reload(importlib.import_module(path.rpartition(".")[0]))
+        policy = import_string(path)
+    except ImportError as e:
+        raise CommandError("Could not import policy '{}': {}".format(path, e))
+    if callable(policy):
+        policy = policy()
+    if not isinstance(policy, policies.Policy):
+        raise CommandError("'{}' is not a Policy.".format(path))
+    return policy
+
+
+class Command(BaseCommand):
+    help = "Runs a Flash socket policy server."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "policy",
+            help="Dotted path to the Policy to serve, or to a callable returning it.",
+        )
+        parser.add_argument("--host", default=None, help="Address to listen on.")
+        parser.add_argument(
+            "--port", type=int, default=DEFAULT_PORT, help="Port to listen on."
+        )
+        parser.add_argument(
+            "--timeout",
+            type=float,
+            default=5.0,
+            help="Seconds to wait for each client's policy request.",
+        )
+        parser.add_argument(
+            "--max-connections",
+            type=int,
+            default=1000,
+            help="Maximum number of simultaneous connections (per worker).",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help=(
+                "Number of worker processes to run, sharing the port via "
+                "SO_REUSEPORT. Sending SIGHUP re-imports the policy's module "
+                "in each."
+            ),
+        )
+
+    def handle(self, *args, **options):
+        path = options["policy"]
+        policy = load_policy(path)
+        self.stdout.write("Serving socket policy on port {}.".format(options["port"]))
+        if options["workers"] > 1:
+            self.run_prefork(path, options)
+            return
+        server = PolicyServer(
+            policy,
+            host=options["host"],
+            port=options["port"],
+            timeout=options["timeout"],
+            max_connections=options["max_connections"],
+        )
+        try:
+            asyncio.run(server.serve_forever())
+        except KeyboardInterrupt:
+            pass
+
+    def run_prefork(self, path, options):
+        server = PreforkPolicyServer(
+            lambda: load_policy(path, reload=True),
+            workers=options["workers"],
+            host=options["host"],
+            port=options["port"],
+            timeout=options["timeout"],
+            max_connections=options["max_connections"],
+        )
+        server.run(self.report_counts if options["verbosity"] > 1 else None)
+
+    def report_counts(self, counts):
+        self.stdout.write(
+            "Connections per worker: {}".format(
+                ", ".join(str(count) for count in counts)
+            )
+        )
@@ -0,0 +1,226 @@
+"""
+Answering, quickly, whether a policy allows access from a given
+origin.
+
+"""
+
+import bisect
+import functools
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+# The highest valid port number, which the port wildcard ``*`` allows
+# access up to.
+MAX_PORT = 65535
+
+
+class _Node:
+    """
+    A node of a domain trie: the rule for the domain ending at this
+    node, the rule for the wildcard of its subdomains (``*.`` followed
+    by that domain), and the nodes for its subdomains, keyed by their
+    next label.
+
+    """
+
+    __slots__ = ("children", "exact", "wildcard")
+
+    def __init__(self):
+        self.children = {}  # type: Dict[str, _Node]
+        self.exact = None  # type: Any
+        self.wildcard = None  # type: Any
+
+
+class DomainTrie:
+    """
+    Maps domains, and wildcards of the form ``*.example.com`` or
+    ``*``, to values, stored by their labels from last to first so
+    that all the entries matching a domain are found by following a
+    single path.
+
+    Following Flash Player, ``*.example.com`` matches ``example.com``
+    itself as well as all of its subdomains. Matching ignores case and
+    any trailing dot.
+
+    """
+
+    def __init__(self, entries: Iterable[Tuple[str, Any]] = ()):
+        self.root = _Node()
+        for domain, value in entries:
+            self.add(domain, value)
+
+    def add(self, domain: str, value: Any):
+        """
+        Stores ``value`` for the domain or wildcard ``domain``.
+
+        """
+        labels = domain.lower().rstrip(".").split(".")
+        wildcard = labels[0] == "*"
+        if wildcard:
+            labels = labels[1:]
+        node = self.root
+        for label in reversed(labels):
+            child = node.children.get(label)
+            if child is None:
+                child = node.children[label] = _Node()
+            node = child
+        if wildcard:
+            node.wildcard = value
+        else:
+            node.exact = value
+
+    def match(self, domain: str) -> Iterator[Any]:
+        """
+        Yields the value of each entry matching ``domain``, from the
+        least to the most specific.
+
+        """
+        node = self.root  # type: Optional[_Node]
+        for label in reversed(domain.lower().rstrip(".").split(".")):
+            if node.wildcard is not None:
+                yield node.wildcard
+            node = node.children.get(label)
+            if node is None:
+                return
+        if node.wildcard is not None:
+            yield node.wildcard
+        if node.exact is not None:
+            yield node.exact
+
+
+def _parse_ports(value: str) -> Optional[Tuple[int, int]]:
+    if value == "*":
+        return (0, MAX_PORT)
+    first, _, last = value.partition("-")
+    try:
+        return (int(first), int(last or first))
+    except ValueError:
+        # Flash Player ignores entries it cannot understand, and so
+        # allows nothing for them.
+        return None
+
+
+@functools.lru_cache(maxsize=1024)
+def port_ranges(to_ports: Tuple[str, ...]) -> Tuple[Tuple[int, ...], Tuple[int, ...]]:
+    """
+    Returns the ports allowed by the ``to_ports`` of a rule, as a
+    tuple of the first ports of disjoint, sorted ranges and a tuple of
+    their last ports.
+
+    """
+    ranges = sorted(filter(None, map(_parse_ports, to_ports)))
+    firsts = []  # type: List[int]
+    lasts = []  # type: List[int]
+    for first, last in ranges:
+        if lasts and first <= lasts[-1] + 1:
+            lasts[-1] = max(lasts[-1], last)
+        else:
+            firsts.append(first)
+            lasts.append(last)
+    return tuple(firsts), tuple(lasts)
+
+
+def port_allowed(to_ports: Optional[Tuple[str, ...]], port: int) -> bool:
+    """
+    Returns whether the ``to_ports`` of a rule include ``port``. A
+    rule without ``to_ports`` allows no socket connections.
+
+    """
+    if to_ports is None:
+        return False
+    firsts, lasts = port_ranges(to_ports)
+    index = bisect.bisect_right(firsts, port) - 1
+    return index >= 0 and port <= lasts[index]
+
+
+def _header_allowed(allowed: Tuple[str, ...], header: str) -> bool:
+    for name in allowed:
+        if name == "*" or name == header:
+            return True
+        if name.endswith("*") and header.startswith(name[:-1]):
+            return True
+    return False
+
+
+def _compile(
+    rules: Dict[str, Any], compile_rule: Callable[[Any], Tuple[Any, bool]]
+) -> Iterator[Tuple[str, Tuple[Any, bool]]]:
+    """
+    Yields each domain in ``rules`` with its rule compiled by
+    ``compile_rule``, compiling each distinct rule once, since many
+    domains usually share one.
+
+    """
+    compiled = {}  # type: Dict[int, Tuple[Any, bool]]
+    for domain, rule in rules.items():
+        value = compiled.get(id(rule))
+        if value is None:
+            value = compiled[id(rule)] = compile_rule(rule)
+        yield domain, value
+
+
+def _compile_domain_rule(rule: Any) -> Tuple[Optional[Tuple[str, ...]], bool]:
+    # Rules are read as mappings, since policies changed by hand may
+    # hold dictionaries rather than rule objects.
+    to_ports = rule["to_ports"]
+    return (None if to_ports is None else tuple(to_ports)), bool(rule["secure"])
+
+
+def _compile_header_rule(rule: Any) -> Tuple[Tuple[str, ...], bool]:
+    return tuple(header.lower() for header in rule["headers"]), bool(rule["secure"])
+
+
+class Matcher:
+    """
+    The rules of a policy, compiled for evaluating requests against
+    them, as returned by ``Policy.matcher()``.
+
+    Each query costs time proportional to the number of labels in the
+    domain asked about, however many rules the policy has.
+
+    """
+
+    def __init__(self, policy: Any):
+        self.domains = DomainTrie(_compile(policy._domains, _compile_domain_rule))
+        self.header_domains = DomainTrie(
+            _compile(policy._header_domains, _compile_header_rule)
+        )
+
+    def allows(
+        self, domain: str, port: Optional[int] = None, secure: bool = True
+    ) -> bool:
+        """
+        Returns whether content from ``domain`` is allowed access.
+
+        For socket connections, pass the port being connected to as
+        ``port``; only rules with ``to_ports`` including it allow
+        access. Pass ``secure=False`` if the content was not loaded
+        over HTTPS, in which case only rules with ``secure=False``
+        allow access.
+
+        """
+        for to_ports, rule_secure in self.domains.match(domain):
+            if not secure and rule_secure:
+                continue
+            if port is None or port_allowed(to_ports, port):
+                return True
+        return False
+
+    def allows_headers(
+        self, domain: str, headers: Iterable[str], secure: bool = True
+    ) -> bool:
+        """
+        Returns whether content from ``domain`` is allowed to send each
+        of the HTTP headers named in ``headers``, by any of the rules
+        matching it. ``secure`` is as for ``allows()``.
+
+        """
+        rules = [
+            allowed
+            for allowed, rule_secure in self.header_domains.match(domain)
+            if secure or not rule_secure
+        ]
+        return all(
+            any(_header_allowed(allowed, header.lower()) for allowed in rules)
+            for header in headers
+        )
@@ -0,0 +1,318 @@
+"""
+Optional instrumentation of policy serving.
+
+When the setting ``FLASHPOLICIES_METRICS`` names a metrics backend
+class, the views record, for each policy (identified by the start of
+its digest) and each URL pattern it is served through:
+
+``flashpolicies_served_total`` (counter, also labelled by ``status``)
+    Responses served.
+
+``flashpolicies_bytes_sent_total`` (counter)
+    Bytes of policy sent in response bodies.
+
+``flashpolicies_cache_hits_total`` and ``flashpolicies_cache_misses_total`` (counters)
+    Responses whose body was already serialized (and compressed, if
+    need be), or had to be.
+
+``flashpolicies_serialize_seconds`` (histogram)
+    Time spent serializing (and compressing) on cache misses.
+
+When the setting is not present, serving does no work for metrics
+beyond checking for a backend.
+
+"""
+
+import bisect
+import functools
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.http import Http404, HttpRequest, HttpResponse
+from django.utils.module_loading import import_string
+
+from . import policies
+
+
+Labels = Tuple[Tuple[str, str], ...]
+
+# How many hex digits of a policy's digest identify it in labels.
+DIGEST_LENGTH = 12
+
+# The upper bounds, in seconds, of the buckets of histograms in the
+# Prometheus backend.
+DEFAULT_BUCKETS = (
+    0.0001,
+    0.0005,
+    0.001,
+    0.005,
+    0.01,
+    0.05,
+    0.1,
+    0.5,
+    1.0,
+    5.0,
+)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class MetricsBackend:
+    """
+    Base class for metrics backends, which receive measurements from
+    the views.
+
+    """
+
+    def increment(self, name: str, value: float = 1, labels: Labels = ()):
+        """
+        Adds ``value`` to the counter ``name``.
+
+        """
+        raise NotImplementedError
+
+    def observe(self, name: str, value: float, labels: Labels = ()):
+        """
+        Records one observation of ``value`` for the histogram or timer
+        ``name``.
+
+        """
+        raise NotImplementedError
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{{{}}}".format(
+        ",".join('{}="{}"'.format(name, _escape_label(value)) for name, value in labels)
+    )
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class PrometheusBackend(MetricsBackend):
+    """
+    Metrics backend keeping counters and histograms in memory, for
+    exposition in the Prometheus text format by ``render()`` (which
+    ``prometheus_metrics()`` serves).
+
+    Metrics are kept per process, so with several worker processes,
+    each must be scraped separately.
+
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.lock = threading.Lock()
+        self.counters = {}  # type: Dict[Tuple[str, Labels], float]
+        # For each histogram, the count of observations in each bucket
+        # (not cumulative, with a final bucket for those above the
+        # largest bound), and their sum.
+        self.histograms = {}  # type: Dict[Tuple[str, Labels], List[Any]]
+
+    def increment(self, name: str, value: float = 1, labels: Labels = ()):
+        key = (name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, labels: Labels = ()):
+        key = (name, labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [[0] * (len(self.buckets) + 1), 0]
+            histogram[0][index] += 1
+            histogram[1] += value
+
+    def render(self) -> str:
+        """
+        Returns the metrics in the Prometheus text exposition format.
+
+        """
+        lines = []  # type: List[str]
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(
+                (key, (list(counts), total))
+                for key, (counts, total) in self.histograms.items()
+            )
+        last_name = None
+        for (name, labels), value in counters:
+            if name != last_name:
+                lines.append("# TYPE {} counter".format(name))
+                last_name = name
+            lines.append(
+                "{}{} {}".format(name, _format_labels(labels), _format_value(value))
+            )
+        for (name, labels), (counts, total) in histograms:
+            if name != last_name:
+                lines.append("# TYPE {} histogram".format(name))
+                last_name = name
+            cumulative = 0
+            bounds = [_format_value(bound) for bound in self.buckets] + ["+Inf"]
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                lines.append(
+                    "{}_bucket{} {}".format(
+                        name, _format_labels(labels + (("le", bound),)), cumulative
+                    )
+                )
+            lines.append(
+                "{}_sum{} {}".format(name, _format_labels(labels), _format_value(total))
+            )
+            lines.append(
+                "{}_count{} {}".format(name, _format_labels(labels), cumulative)
+            )
+        return "".join(line + "\n" for line in lines)
+
+
+class StatsdBackend(MetricsBackend):
+    """
+    Metrics backend aggregating counters and timers in memory, as a
+    statsd daemon would, until they are collected with ``flush()``.
+
+    Timers are recorded in milliseconds, as statsd expects.
+
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}  # type: Dict[Tuple[str, Labels], float]
+        self.timers = {}  # type: Dict[Tuple[str, Labels], List[float]]
+
+    def increment(self, name: str, value: float = 1, labels: Labels = ()):
+        key = (name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, labels: Labels = ()):
+        key = (name, labels)
+        with self.lock:
+            self.timers.setdefault(key, []).append(value * 1000)
+
+    def flush(self) -> List[str]:
+        """
+        Returns the metrics recorded since the last flush, in the
+        statsd line protocol (with labels as DogStatsD-style tags), and
+        resets them.
+
+        """
+        with self.lock:
+            counters, self.counters = self.counters, {}
+            timers, self.timers = self.timers, {}
+        lines = []
+        for (name, labels), value in sorted(counters.items()):
+            lines.append(
+                "{}:{}|c{}".format(name, _format_value(value), self._tags(labels))
+            )
+        for (name, labels), values in sorted(timers.items()):
+            tags = self._tags(labels)
+            lines.extend("{}:{}|ms{}".format(name, value, tags) for value in values)
+        return lines
+
+    def _tags(self, labels: Labels) -> str:
+        if not labels:
+            return ""
+        return "|#" + ",".join("{}:{}".format(name, value) for name, value in labels)
+
+
+@functools.lru_cache(maxsize=None)
+def get_backend() -> Optional[MetricsBackend]:
+    """
+    Returns the metrics backend named by the setting
+    ``FLASHPOLICIES_METRICS``, or ``None`` if there is none. The
+    backend is created once, and shared by all threads.
+
+    """
+    path = getattr(settings, "FLASHPOLICIES_METRICS", None)
+    if path is None:
+        return None
+    return import_string(path)()
+
+
+@receiver(setting_changed)
+def _reset_backend(setting: str, **kwargs: Any):
+    if setting == "FLASHPOLICIES_METRICS":
+        get_backend.cache_clear()
+
+
+def request_labels(request: HttpRequest, digest: str) -> Labels:
+    """
+    Returns the labels of the metrics recorded for serving the policy
+    whose serialized form has the SHA-256 hash ``digest`` in answer to
+    ``request``: the start of the digest, identifying the policy, and
+    the URL pattern the request was routed through (empty if it was
+    not routed), rather than its path, so that the number of distinct
+    labels stays bounded.
+
+    """
+    match = request.resolver_match
+    route = "" if match is None else str(match.route)
+    return (("policy", digest[:DIGEST_LENGTH]), ("route", route))
+
+
+def record_body(
+    backend: MetricsBackend,
+    request: HttpRequest,
+    policy: policies.Policy,
+    encoding: Optional[str],
+    compact: bool,
+) -> bytes:
+    """
+    Returns the body of the response serving ``policy`` in answer to
+    ``request``, compressed with ``encoding`` unless it is ``None``,
+    recording whether it was cached, and if not, how long it took to
+    produce.
+
+    """
+    start = time.perf_counter()
+    body, hit = policy._body(encoding, compact)
+    elapsed = time.perf_counter() - start
+    # The digest is computed from the body, so only once it exists.
+    labels = request_labels(request, policy.digest(compact))
+    if hit:
+        backend.increment("flashpolicies_cache_hits_total", labels=labels)
+    else:
+        backend.increment("flashpolicies_cache_misses_total", labels=labels)
+        backend.observe("flashpolicies_serialize_seconds", elapsed, labels)
+    return body
+
+
+def record_response(
+    backend: MetricsBackend, request: HttpRequest, digest: str, response: HttpResponse
+):
+    """
+    Records the serving of ``response``, for the policy whose digest
+    is ``digest``, in answer to ``request``.
+
+    """
+    labels = request_labels(request, digest)
+    backend.increment(
+        "flashpolicies_served_total",
+        labels=labels + (("status", str(response.status_code)),),
+    )
+    backend.increment("flashpolicies_bytes_sent_total", len(response.content), labels)
+
+
+def prometheus_metrics(request: HttpRequest) -> HttpResponse:
+    """
+    Serves the metrics recorded by the ``PrometheusBackend``, for
+    scraping by Prometheus. Returns a 404 if that is not the metrics
+    backend in use.
+
+    """
+    backend = get_backend()
+    if not isinstance(backend, PrometheusBackend):
+        raise Http404("Prometheus metrics are not enabled.")
+    return HttpResponse(backend.render(), content_type=PROMETHEUS_CONTENT_TYPE)
@@ -0,0 +1,225 @@
+"""
+Middleware enforcing a policy's rules on the requests a site receives.
+
+"""
+
+import functools
+from typing import Any, Callable, FrozenSet, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.http import HttpRequest, HttpResponse, HttpResponseForbidden
+from django.utils.module_loading import import_string
+
+from . import policies
+
+
+# Headers which are sent by browsers, Flash Player, proxies or CDNs on
+# their own account, and so need no permission from a policy; any
+# others a request carries must be allowed by the policy's
+# allow_headers() rules, unless named in the setting
+# FLASHPOLICIES_IGNORED_HEADERS.
+STANDARD_HEADERS = frozenset(
+    (
+        "accept",
+        "accept-charset",
+        "accept-encoding",
+        "accept-language",
+        "b3",
+        "baggage",
+        "cache-control",
+        "cdn-loop",
+        "connection",
+        "content-length",
+        "content-type",
+        "cookie",
+        "dnt",
+        "expect",
+        "forwarded",
+        "host",
+        "if-match",
+        "if-modified-since",
+        "if-none-match",
+        "if-range",
+        "if-unmodified-since",
+        "keep-alive",
+        "origin",
+        "pragma",
+        "priority",
+        "proxy-connection",
+        "purpose",
+        "range",
+        "referer",
+        "save-data",
+        "te",
+        "traceparent",
+        "tracestate",
+        "true-client-ip",
+        "upgrade",
+        "upgrade-insecure-requests",
+        "user-agent",
+        "via",
+        "x-amzn-trace-id",
+        "x-cloud-trace-context",
+        "x-correlation-id",
+        "x-flash-version",
+        "x-real-ip",
+        "x-request-id",
+        "x-requested-with",
+    )
+)
+
+# Prefixes of the names of headers which are likewise never checked:
+# those browsers reserve for themselves, and those added by proxies,
+# CDNs and tracing systems.
+STANDARD_HEADER_PREFIXES = (
+    "akamai-",
+    "cf-",
+    "cloudfront-",
+    "fastly-",
+    "sec-",
+    "x-amz-cf-",
+    "x-b3-",
+    "x-forwarded-",
+)
+
+EXEMPT_ATTRIBUTE = "flashpolicies_exempt"
+
+
+@functools.lru_cache(maxsize=1024)
+def _parse_origin(value: str) -> Tuple[Optional[str], bool]:
+    """
+    Returns the hostname of the ``Origin`` or ``Referer`` header value
+    ``value`` (or ``None`` if it has none), and whether its scheme is
+    HTTPS.
+
+    """
+    try:
+        parts = urlsplit(value)
+        hostname = parts.hostname
+    except ValueError:
+        return None, False
+    return hostname, parts.scheme == "https"
+
+
+@functools.lru_cache(maxsize=None)
+def ignored_headers() -> Tuple[FrozenSet[str], Tuple[str, ...]]:
+    """
+    Returns the lower-case names, and name prefixes, of the headers
+    requests may carry without the policy allowing them: those in
+    ``STANDARD_HEADERS`` and ``STANDARD_HEADER_PREFIXES``, and those
+    in the setting ``FLASHPOLICIES_IGNORED_HEADERS``, where names
+    ending in ``*`` are prefixes.
+
+    """
+    names = set(STANDARD_HEADERS)
+    prefixes = list(STANDARD_HEADER_PREFIXES)
+    for name in getattr(settings, "FLASHPOLICIES_IGNORED_HEADERS", ()):
+        name = name.lower()
+        if name.endswith("*"):
+            prefixes.append(name[:-1])
+        else:
+            names.add(name)
+    return frozenset(names), tuple(prefixes)
+
+
+@receiver(setting_changed)
+def _reset_ignored_headers(setting: str, **kwargs: Any):
+    if setting == "FLASHPOLICIES_IGNORED_HEADERS":
+        ignored_headers.cache_clear()
+
+
+def _custom_headers(request: HttpRequest) -> List[str]:
+    names, prefixes = ignored_headers()
+    return [
+        name
+        for name in request.headers
+        if name.lower() not in names and not name.lower().startswith(prefixes)
+    ]
+
+
+def request_allowed(policy: policies.Policy, request: HttpRequest) -> bool:
+    """
+    Returns whether ``policy`` allows ``request``.
+
+    A request is checked against the policy only if it comes from
+    content served from another host, as given by its ``Origin`` or,
+    failing that, its ``Referer`` header; the policy must then allow
+    access from that host, and allow it to send each header the
+    request carries other than those ``ignored_headers()`` exempts. As in
+    Flash Player, a rule's ``secure`` option only matters for requests
+    made to this site over HTTPS.
+
+    """
+    origin = request.META.get("HTTP_ORIGIN") or request.META.get("HTTP_REFERER")
+    if not origin:
+        return True
+    hostname, secure = _parse_origin(origin)
+    if hostname is None:
+        return False
+    if hostname == _parse_origin("//" + request.get_host())[0]:
+        return True
+    # Content served over HTTP may only be refused for that reason
+    # when the request is to a site served over HTTPS.
+    secure = secure or not request.is_secure()
+    if not policy.allows(hostname, secure=secure):
+        return False
+    headers = _custom_headers(request)
+    return not headers or policy.allows_headers(hostname, headers, secure)
+
+
+def policy_exempt(view: Callable) -> Callable:
+    """
+    Marks ``view`` as exempt from the policy enforced by
+    ``PolicyMiddleware``.
+
+    """
+    setattr(view, EXEMPT_ATTRIBUTE, True)
+    return view
+
+
+class PolicyMiddleware:
+    """
+    Middleware refusing, with a 403 response, requests from content
+    served from other hosts which the policy in the setting
+    ``FLASHPOLICIES_ENFORCE`` does not allow.
+
+    The setting may be a ``Policy`` or the dotted path of one. Views
+    marked with ``policy_exempt()`` -- including the views serving
+    policy files -- are not checked, nor are views enforcing their own
+    policy with ``flashpolicies.decorators.enforce_policy()``.
+
+    """
+
+    sync_capable = True
+    async_capable = False
+
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]):
+        policy = getattr(settings, "FLASHPOLICIES_ENFORCE", None)
+        if policy is None:
+            raise MiddlewareNotUsed
+        if isinstance(policy, str):
+            policy = import_string(policy)
+        self.policy = policy.freeze()
+        # Compile the rules now, rather than during a request.
+        self.policy.matcher()
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        return self.get_response(request)
+
+    def process_view(
+        self,
+        request: HttpRequest,
+        view_func: Callable,
+        view_args: Tuple[Any, ...],
+        view_kwargs: Any,
+    ) -> Optional[HttpResponse]:
+        if getattr(view_func, EXEMPT_ATTRIBUTE, False):
+            return None
+        if request_allowed(self.policy, request):
+            return None
+        return HttpResponseForbidden()
@@ -0,0 +1,226 @@
+"""
+Parsing cross-domain policy files back into ``Policy`` objects.
+
+The parser is built directly on expat, so that large policies are read
+incrementally rather than into a DOM, and refuses the constructs which
+make XML parsing dangerous: a document type declaration with an
+internal subset (and so any entity declarations, which could expand
+enormously or refer to external resources), and nesting deeper than
+any valid policy needs.
+
+"""
+
+import io
+from typing import IO, Any, Dict, Iterator, List, Optional, Tuple, Union
+from xml.parsers import expat
+
+from . import policies
+
+
+PARSE_ERROR = "Could not parse policy: {}"
+FORBIDDEN_ERROR = "Could not parse policy: {} are not allowed."
+ROOT_ERROR = "Could not parse policy: '{}' is not a cross-domain-policy element."
+ELEMENT_ERROR = "Could not parse policy: '{}' element has no '{}' attribute."
+ALGORITHM_ERROR = "Could not parse policy: unknown fingerprint algorithm '{}'."
+
+# The deepest nesting of elements a policy file may contain. Valid
+# policies need only four levels (for signed-document identities).
+MAX_DEPTH = 8
+
+CHUNK_SIZE = 64 * 1024
+
+Event = Tuple[str, str, Dict[str, str]]
+
+
+class _EventCollector:
+    """
+    Receives callbacks from an expat parser, and records them as
+    events.
+
+    """
+
+    def __init__(self, parser: Any):
+        self.events = []  # type: List[Event]
+        self.depth = 0
+        parser.StartElementHandler = self.start_element
+        parser.EndElementHandler = self.end_element
+        parser.CharacterDataHandler = self.text
+        # Outside the root element, text (only ever whitespace, in a
+        # well-formed document) goes to the default handler, which
+        # also receives the XML declaration.
+        parser.DefaultHandlerExpand = self.default
+        # Entities can only be declared in an internal subset, since
+        # external DTDs are never read, so refusing internal subsets
+        # rules out entity expansion attacks.
+        parser.StartDoctypeDeclHandler = self.start_doctype
+
+    def start_element(self, name: str, attributes: Dict[str, str]):
+        self.depth += 1
+        if self.depth > MAX_DEPTH:
+            raise TypeError(FORBIDDEN_ERROR.format("deeply nested elements"))
+        self.events.append(("start", name, attributes))
+
+    def end_element(self, name: str):
+        self.depth -= 1
+        self.events.append(("end", name, {}))
+
+    def text(self, data: str):
+        self.events.append(("text", "", {}))
+
+    def default(self, data: str):
+        if data.isspace():
+            self.text(data)
+
+    def start_doctype(self, name: str, system_id: str, public_id: str, internal: int):
+        if internal:
+            raise TypeError(FORBIDDEN_ERROR.format("internal DTD subsets"))
+
+
+def iterparse(
+    source: Union[bytes, str, IO[bytes]], chunk_size: int = CHUNK_SIZE
+) -> Iterator[Event]:
+    """
+    Parses a policy document incrementally, yielding a ``("start",
+    name, attributes)`` event as each element begins, and an
+    ``("end", name, {})`` event as it ends. Text, including
+    whitespace between elements and around the root element, is
+    reported as ``("text", "", {})`` events.
+
+    ``source`` may be the document itself, as ``bytes`` or ``str``,
+    or a binary file object, which is read ``chunk_size`` bytes at a
+    time.
+
+    Raises ``TypeError`` if the document is not well-formed, or
+    contains a document type declaration with an internal subset or
+    elements nested more than ``MAX_DEPTH`` deep.
+
+    """
+    if isinstance(source, str):
+        source = source.encode("utf-8")
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    parser = expat.ParserCreate()
+    parser.SetParamEntityParsing(expat.XML_PARAM_ENTITY_PARSING_NEVER)
+    collector = _EventCollector(parser)
+    while True:
+        chunk = source.read(chunk_size)
+        try:
+            parser.Parse(chunk, not chunk)
+        except expat.ExpatError as e:
+            raise TypeError(PARSE_ERROR.format(e))
+        yield from collector.events
+        collector.events.clear()
+        if not chunk:
+            return
+
+
+def _required(name: str, attributes: Dict[str, str], attribute: str) -> str:
+    try:
+        return attributes[attribute]
+    except KeyError:
+        raise TypeError(ELEMENT_ERROR.format(name, attribute))
+
+
+def _secure(attributes: Dict[str, str]) -> bool:
+    return attributes.get("secure", "true") != "false"
+
+
+class _PolicyBuilder:
+    """
+    Collects the rules of a policy from the elements of a policy
+    document.
+
+    """
+
+    def __init__(self):
+        self.site_control = None  # type: Optional[str]
+        self.domains = {}  # type: Dict[str, policies.DomainRule]
+        self.header_domains = {}  # type: Dict[str, policies.HeaderRule]
+        self.identities = []  # type: List[str]
+
+    def site_control_element(self, attributes: Dict[str, str]):
+        self.site_control = _required(
+            "site-control", attributes, "permitted-cross-domain-policies"
+        )
+
+    def domain_element(self, attributes: Dict[str, str]):
+        to_ports = attributes.get("to-ports")
+        domain = _required("allow-access-from", attributes, "domain")
+        self.domains[domain] = policies.domain_rule(
+            None if to_ports is None else to_ports.split(","), _secure(attributes)
+        )
+
+    def header_element(self, attributes: Dict[str, str]):
+        name = "allow-http-request-headers-from"
+        self.header_domains[_required(name, attributes, "domain")] = (
+            policies.header_rule(
+                _required(name, attributes, "headers").split(","),
+                _secure(attributes),
+            )
+        )
+
+    def certificate_element(self, attributes: Dict[str, str]):
+        algorithm = attributes.get("fingerprint-algorithm", "sha-1")
+        if algorithm != "sha-1":
+            raise TypeError(ALGORITHM_ERROR.format(algorithm))
+        self.identities.append(_required("certificate", attributes, "fingerprint"))
+
+    def build(self, compact: bool) -> policies.Policy:
+        policy = policies.Policy(compact=compact)
+        if self.site_control is not None:
+            policy.metapolicy(self.site_control)
+        if self.domains or self.header_domains or self.identities:
+            if policy.site_control == policies.SITE_CONTROL_NONE:
+                raise TypeError(policies.BAD_POLICY)
+            policy.domains = self.domains
+            policy.header_domains = self.header_domains
+            policy.allow_identities(self.identities)
+            policy.invalidate()
+        return policy
+
+
+# The method of _PolicyBuilder handling the element at each path from
+# the root of a policy document.
+HANDLERS = {
+    ("cross-domain-policy", "site-control"): "site_control_element",
+    ("cross-domain-policy", "allow-access-from"): "domain_element",
+    ("cross-domain-policy", "allow-http-request-headers-from"): "header_element",
+    (
+        "cross-domain-policy",
+        "allow-access-from-identity",
+        "signatory",
+        "certificate",
+    ): "certificate_element",
+}
+
+
+def parse(
+    source: Union[bytes, str, IO[bytes]], compact: Optional[bool] = None
+) -> policies.Policy:
+    """
+    Builds a ``Policy`` from a cross-domain policy document, as
+    accepted by ``iterparse()``.
+
+    Elements the ``Policy`` class does not support are ignored. By
+    default, the policy's ``compact`` attribute is set according to
+    whether the document has any whitespace between its tags, so that
+    serializing the result of parsing a serialized policy reproduces
+    it exactly.
+
+    """
+    builder = _PolicyBuilder()
+    path = []  # type: List[str]
+    whitespace = False
+    for event, name, attributes in iterparse(source):
+        if event == "start":
+            if not path and name != "cross-domain-policy":
+                raise TypeError(ROOT_ERROR.format(name))
+            path.append(name)
+            handler = HANDLERS.get(tuple(path))
+            if handler is not None:
+                getattr(builder, handler)(attributes)
+        elif event == "end":
+            path.pop()
+        else:
+            whitespace = True
+    return builder.build(not whitespace if compact is None else compact)
@@ -3,11 +3,35 @@ Utilities for generating Flash cross-domain policy files.
 
 """
 
+import collections.abc
+import functools
+import gzip
+import hashlib
+import io
+import types
 import xml.dom
-from typing import Dict, Iterable, List, Optional
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+
+from .matcher import MAX_PORT, Matcher, port_ranges
 
 
-minidom = xml.dom.getDOMImplementation("minidom")
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
 
 
 METAPOLICY_ERROR = (
@@ -22,6 +46,13 @@ BAD_POLICY = (
     "but policy attempted to allow access anyway)."
 )
 
+COMPRESSION_ERROR = "'{}' is not a supported compression encoding."
+ITERABLE_ERROR = "'{}' must be an iterable of strings, not a single string."
+RULE_ERROR = "Rules cannot be changed; replace the rule instead."
+FROZEN_ERROR = "Frozen policies cannot be changed; change a copy() instead."
+
+POLICY_DTD = "http://www.adobe.com/xml/dtds/cross-domain-policy.dtd"
+
 
 #
 # Acceptable values for the "permitted-cross-domain-policies"
@@ -53,6 +84,330 @@ VALID_SITE_CONTROL = (
 )
 
 
+@functools.lru_cache(maxsize=None)
+def _get_minidom() -> "xml.dom.minidom.DOMImplementation":
+    """
+    Returns the minidom DOM implementation, importing it on first use
+    rather than when this module is imported, since only ``xml_dom``
+    needs it.
+
+    """
+    return xml.dom.getDOMImplementation("minidom")
+
+
+def __getattr__(name: str) -> Any:
+    # The module attribute ``minidom`` predates the lazy import above.
+    if name == "minidom":
+        return _get_minidom()
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def _gzip(data: bytes) -> bytes:
+    """
+    Gzip-compresses ``data`` with a fixed timestamp, so that the same
+    input always produces the same output.
+
+    """
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode="wb", mtime=0) as gzip_file:
+        gzip_file.write(data)
+    return buffer.getvalue()
+
+
+#
+# Compression encodings which policies can be served with, keyed by
+# their HTTP Content-Encoding name, in order of preference. Brotli is
+# only available if the 'brotli' package is installed.
+#
+
+COMPRESSORS = {}  # type: Dict[str, Callable[[bytes], bytes]]
+if brotli is not None:
+    COMPRESSORS["br"] = brotli.compress
+COMPRESSORS["gzip"] = _gzip
+
+
+class _Rule(collections.abc.Mapping):
+    """
+    Base class for the immutable objects recording the options of a
+    domain allowed by a policy.
+
+    Rules take far less memory than the dictionaries policies used to
+    store, and since they cannot be changed, one rule can be shared by
+    every domain with the same options. For compatibility, they can
+    still be read as dictionaries.
+
+    """
+
+    __slots__ = ()  # type: Tuple[str, ...]
+
+    def __init__(self, *values: Any):
+        for name, value in zip(self.__slots__, values):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name: str, value: Any):
+        raise AttributeError(RULE_ERROR)
+
+    def __reduce__(self):
+        return (type(self), tuple(getattr(self, name) for name in self.__slots__))
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.__slots__)
+
+    def __len__(self) -> int:
+        return len(self.__slots__)
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, collections.abc.Mapping):
+            return NotImplemented
+        if len(other) != len(self.__slots__):
+            return False
+        for name in self.__slots__:
+            if name not in other:
+                return False
+            value, other_value = getattr(self, name), other[name]
+            # The dictionaries rules replaced held lists where rules
+            # hold tuples, and still compare equal to rules.
+            if isinstance(value, tuple) and isinstance(other_value, list):
+                other_value = tuple(other_value)
+            if value != other_value:
+                return False
+        return True
+
+    def __repr__(self) -> str:
+        return "{}({})".format(
+            type(self).__name__,
+            ", ".join(
+                "{}={!r}".format(name, getattr(self, name)) for name in self.__slots__
+            ),
+        )
+
+
+class DomainRule(_Rule):
+    """
+    The options of a domain allowed access by a policy: the ports it
+    may access (for socket policies), and whether security levels must
+    match.
+
+    """
+
+    __slots__ = ("to_ports", "secure")
+
+    def __init__(self, to_ports: Optional[Tuple[str, ...]], secure: bool):
+        super().__init__(to_ports, secure)
+
+
+class HeaderRule(_Rule):
+    """
+    The options of a domain allowed to push data via HTTP headers: the
+    header names, and whether security levels must match.
+
+    """
+
+    __slots__ = ("headers", "secure")
+
+    def __init__(self, headers: Tuple[str, ...], secure: bool):
+        super().__init__(headers, secure)
+
+
+@functools.lru_cache(maxsize=1024)
+def _shared_rule(rule_class: type, *values: Any) -> _Rule:
+    """
+    Returns a rule of ``rule_class`` with ``values``, shared with other
+    callers asking for the same rule.
+
+    """
+    return rule_class(*values)
+
+
+def domain_rule(
+    to_ports: Optional[Iterable[str]] = None, secure: bool = True
+) -> DomainRule:
+    """
+    Returns a ``DomainRule`` with the given options, reusing an
+    existing one where possible.
+
+    """
+    if to_ports is not None:
+        to_ports = tuple(to_ports)
+    return _shared_rule(DomainRule, to_ports, bool(secure))
+
+
+def header_rule(headers: Iterable[str], secure: bool = True) -> HeaderRule:
+    """
+    Returns a ``HeaderRule`` with the given options, reusing an
+    existing one where possible.
+
+    """
+    return _shared_rule(HeaderRule, tuple(headers), bool(secure))
+
+
+def _format_ports(first: int, last: int) -> str:
+    """
+    Returns the ``to_ports`` entry for the ports ``first`` to
+    ``last``.
+
+    """
+    if (first, last) == (0, MAX_PORT):
+        return "*"
+    if first == last:
+        return str(first)
+    return "{}-{}".format(first, last)
+
+
+def _intersect_ports(to_ports: Iterable[str], other: Iterable[str]) -> Tuple[str, ...]:
+    """
+    Returns the ``to_ports`` allowing only the ports both ``to_ports``
+    and ``other`` allow.
+
+    """
+    to_ports, other = tuple(to_ports), tuple(other)
+    if to_ports == other:
+        return to_ports
+    firsts, lasts = port_ranges(to_ports)
+    other_firsts, other_lasts = port_ranges(other)
+    common = []  # type: List[str]
+    index = other_index = 0
+    while index < len(firsts) and other_index < len(other_firsts):
+        first = max(firsts[index], other_firsts[other_index])
+        last = min(lasts[index], other_lasts[other_index])
+        if first <= last:
+            common.append(_format_ports(first, last))
+        if lasts[index] < other_lasts[other_index]:
+            index += 1
+        else:
+            other_index += 1
+    return tuple(common)
+
+
+def _common_header(name: str, other: str) -> Optional[str]:
+    """
+    Returns the header name, or wildcard, matching only the headers
+    both ``name`` and ``other`` match, or ``None`` if there are none.
+
+    """
+    lower, other_lower = name.lower(), other.lower()
+    if lower == other_lower or other_lower == "*":
+        return name
+    if lower == "*":
+        return other
+    if lower.endswith("*") and other_lower.startswith(lower[:-1]):
+        return other
+    if other_lower.endswith("*") and lower.startswith(other_lower[:-1]):
+        return name
+    return None
+
+
+def _intersect_domain_rules(rule: Mapping, other: Mapping) -> Optional[DomainRule]:
+    """
+    Returns the ``DomainRule`` allowing only what both ``rule`` and
+    ``other`` allow, or ``None`` if they allow no ports in common.
+
+    """
+    to_ports = None  # type: Optional[Tuple[str, ...]]
+    if rule["to_ports"] is not None and other["to_ports"] is not None:
+        to_ports = _intersect_ports(rule["to_ports"], other["to_ports"])
+        if not to_ports:
+            return None
+    return domain_rule(to_ports, rule["secure"] or other["secure"])
+
+
+def _intersect_header_rules(rule: Mapping, other: Mapping) -> Optional[HeaderRule]:
+    """
+    Returns the ``HeaderRule`` allowing only what both ``rule`` and
+    ``other`` allow, or ``None`` if they allow no headers in common.
+
+    """
+    headers = []  # type: List[str]
+    for name in rule["headers"]:
+        for other_name in other["headers"]:
+            common = _common_header(name, other_name)
+            if common is not None and common not in headers:
+                headers.append(common)
+    if not headers:
+        return None
+    return header_rule(headers, rule["secure"] or other["secure"])
+
+
+def _intersect_rules(
+    rules: Mapping[str, Any],
+    other: Mapping[str, Any],
+    intersect: Callable[[Any, Any], Optional[_Rule]],
+) -> Dict[str, Any]:
+    """
+    Returns the domains in both ``rules`` and ``other``, mapped to
+    rules narrowed by ``intersect`` to allow only what both allow.
+
+    """
+    common = {}  # type: Dict[str, Any]
+    for domain, rule in rules.items():
+        other_rule = other.get(domain)
+        if other_rule is None:
+            continue
+        if other_rule is not rule:
+            rule = intersect(rule, other_rule)
+            if rule is None:
+                continue
+        common[domain] = rule
+    return common
+
+
+class PolicyDiff(NamedTuple):
+    """
+    The differences between two policies, as returned by
+    ``Policy.diff()``: what would have to change to turn the first
+    policy into the second. A diff is false if there are no
+    differences.
+
+    """
+
+    site_control: Optional[Tuple[Optional[str], Optional[str]]]
+    compact: Optional[Tuple[bool, bool]]
+    added_domains: Dict[str, DomainRule]
+    removed_domains: Dict[str, DomainRule]
+    changed_domains: Dict[str, Tuple[DomainRule, DomainRule]]
+    added_header_domains: Dict[str, HeaderRule]
+    removed_header_domains: Dict[str, HeaderRule]
+    changed_header_domains: Dict[str, Tuple[HeaderRule, HeaderRule]]
+    added_identities: List[str]
+    removed_identities: List[str]
+
+    def __bool__(self) -> bool:
+        return any(self)
+
+
+def _diff_rules(old: Dict[str, Any], new: Dict[str, Any]) -> Tuple[dict, dict, dict]:
+    """
+    Returns the rules added, removed and changed between ``old`` and
+    ``new``.
+
+    """
+    if old is new:
+        # Policies copied from one another share their rules until one
+        # of them changes, which makes this case common.
+        return {}, {}, {}
+    added = {domain: rule for domain, rule in new.items() if domain not in old}
+    removed = {domain: rule for domain, rule in old.items() if domain not in new}
+    changed = {
+        domain: (old[domain], rule)
+        for domain, rule in new.items()
+        if domain in old and old[domain] is not rule and old[domain] != rule
+    }
+    return added, removed, changed
+
+
+def _changed(old: Any, new: Any) -> Optional[Tuple[Any, Any]]:
+    """
+    Returns ``(old, new)`` if they differ, or ``None`` if not.
+
+    """
+    return None if old == new else (old, new)
+
+
 class Policy:
     """
     Wrapper object for creating and manipulating a Flash cross-domain
@@ -75,15 +430,223 @@ class Policy:
     Consult the documentation for the various methods of this class
     for more advanced uses.
 
+    Passing ``compact=True`` when initializing causes the policy to be
+    serialized without any indentation or line breaks, which produces
+    a smaller file; this can also be chosen each time the policy is
+    serialized.
+
+    The serialized forms of the policy are cached after they are first
+    produced, and the cache is cleared whenever the policy is changed
+    through ``allow_domain()``, ``allow_headers()``,
+    ``allow_identity()``, their bulk counterparts ``allow_domains()``,
+    ``allow_headers_many()`` and ``allow_identities()``, or
+    ``metapolicy()``. Directly modifying the
+    ``domains``, ``header_domains`` or ``identities`` attributes
+    bypasses this, so if you do that, call ``invalidate()`` afterward.
+
+    Policies can be combined with the operators ``|`` (allowing
+    everything either policy allows), ``&`` (allowing only what both
+    allow) and ``-`` (allowing what the first allows and the second
+    does not), and compared with ``diff()``. ``copy()`` is cheap, so
+    these make it inexpensive to build many policies from a common
+    base.
+
     """
 
-    def __init__(self, *domains: str):
+    def __init__(self, *domains: str, compact: bool = False):
+        self.compact = compact
         self.site_control = None  # type: Optional[str]
-        self.domains = {}  # type: Dict[str, dict]
-        self.header_domains = {}  # type: Dict[str, dict]
-        self.identities = []  # type: List[str]
-        for domain in domains:
-            self.allow_domain(domain)
+        self._domains = {}  # type: Dict[str, DomainRule]
+        self._header_domains = {}  # type: Dict[str, HeaderRule]
+        self._identities = []  # type: List[str]
+        # Whether the three containers above may be shared with a copy
+        # of this policy, and so must be copied before being changed.
+        self._shared = False
+        # The contents of ``identities`` as a set, for constant-time
+        # duplicate checks, and the list it was built from, or ``None``
+        # if the set may be out of date.
+        self._identity_set = set()  # type: Set[str]
+        self._indexed_identities = self._identities  # type: Optional[List[str]]
+        self._cache = {}  # type: Dict[str, Any]
+        if domains:
+            self.allow_domains(domains)
+
+    @property
+    def domains(self) -> Dict[str, DomainRule]:
+        """
+        The domains allowed access, mapped to their ``DomainRule``.
+
+        """
+        self._own()
+        return self._domains
+
+    @domains.setter
+    def domains(self, value: Dict[str, DomainRule]):
+        self._domains = value
+
+    @property
+    def header_domains(self) -> Dict[str, HeaderRule]:
+        """
+        The domains allowed to push data via HTTP headers, mapped to
+        their ``HeaderRule``.
+
+        """
+        self._own()
+        return self._header_domains
+
+    @header_domains.setter
+    def header_domains(self, value: Dict[str, HeaderRule]):
+        self._header_domains = value
+
+    @property
+    def identities(self) -> List[str]:
+        """
+        The fingerprints of the signing keys allowed access.
+
+        """
+        self._own()
+        return self._identities
+
+    @identities.setter
+    def identities(self, value: List[str]):
+        self._identities = value
+
+    def _own(self):
+        """
+        Ensures this policy has its own copies of its rules, rather than
+        ones shared with a copy of it, before they are changed.
+
+        """
+        if not self._shared:
+            return
+        in_sync = self._indexed_identities is self._identities
+        self._domains = dict(self._domains)
+        self._header_domains = dict(self._header_domains)
+        self._identities = list(self._identities)
+        if in_sync:
+            self._identity_set = set(self._identity_set)
+            self._indexed_identities = self._identities
+        self._shared = False
+
+    def copy(self) -> "Policy":
+        """
+        Returns a copy of this policy.
+
+        Copying is cheap: the copy shares this policy's rules, and
+        its cached serializations, until either policy is changed.
+
+        """
+        clone = object.__new__(type(self))
+        clone.__dict__.update(self.__dict__)
+        clone._cache = dict(self._cache)
+        clone._shared = self._shared = True
+        return clone
+
+    __copy__ = copy
+
+    def __or__(self, other: "Policy") -> "Policy":
+        """
+        Returns a policy allowing everything either this policy or
+        ``other`` allows. Where both have options for the same domain,
+        or both set a metapolicy, those of ``other`` are used.
+
+        """
+        if not isinstance(other, Policy):
+            return NotImplemented
+        merged = self.copy()
+        if other.site_control is not None:
+            merged.metapolicy(other.site_control)
+        if other._domains or other._header_domains or other._identities:
+            if merged.site_control == SITE_CONTROL_NONE:
+                raise TypeError(METAPOLICY_ERROR.format("merge policies"))
+            merged._own()
+            merged._domains.update(other._domains)
+            merged._header_domains.update(other._header_domains)
+            merged.allow_identities(other._identities)
+            merged._changed()
+        return merged
+
+    def _select(self, other: "Policy", in_other: bool) -> "Policy":
+        """
+        Returns a copy of this policy keeping only the domains and
+        identities which either are, or are not, allowed by ``other``.
+        Domains kept because ``other`` allows them are narrowed to
+        allow only what both policies allow.
+
+        """
+        if not isinstance(other, Policy):
+            return NotImplemented
+        selected = self.copy()
+        if in_other:
+            selected._domains = _intersect_rules(
+                self._domains, other._domains, _intersect_domain_rules
+            )
+            selected._header_domains = _intersect_rules(
+                self._header_domains, other._header_domains, _intersect_header_rules
+            )
+        else:
+            selected._domains = {
+                domain: rule
+                for domain, rule in self._domains.items()
+                if domain not in other._domains
+            }
+            selected._header_domains = {
+                domain: rule
+                for domain, rule in self._header_domains.items()
+                if domain not in other._header_domains
+            }
+        other_identities = set(other._identities)
+        selected._identities = [
+            fingerprint
+            for fingerprint in self._identities
+            if (fingerprint in other_identities) is in_other
+        ]
+        selected._shared = False
+        selected.invalidate()
+        return selected
+
+    def __and__(self, other: "Policy") -> "Policy":
+        """
+        Returns a copy of this policy, allowing only the domains,
+        header domains and identities ``other`` also allows. Where the
+        two have different options for the same domain, it is allowed
+        only the ports and headers both allow, and security levels
+        must match if either requires it.
+
+        """
+        return self._select(other, True)
+
+    def __sub__(self, other: "Policy") -> "Policy":
+        """
+        Returns a copy of this policy, without the domains, header
+        domains and identities ``other`` allows.
+
+        """
+        return self._select(other, False)
+
+    def diff(self, other: "Policy") -> PolicyDiff:
+        """
+        Returns a ``PolicyDiff`` describing what would have to change
+        to turn this policy into ``other``. The order of rules is not
+        compared.
+
+        """
+        domains = _diff_rules(self._domains, other._domains)
+        header_domains = _diff_rules(self._header_domains, other._header_domains)
+        if self._identities is other._identities:
+            added_identities, removed_identities = [], []
+        else:
+            old, new = set(self._identities), set(other._identities)
+            added_identities = [f for f in other._identities if f not in old]
+            removed_identities = [f for f in self._identities if f not in new]
+        return PolicyDiff(
+            _changed(self.site_control, other.site_control),
+            _changed(self.compact, other.compact),
+            *domains,
+            *header_domains,
+            added_identities,
+            removed_identities,
+        )
 
     def allow_domain(
         self, domain: str, to_ports: Optional[Iterable[str]] = None, secure: bool = True
@@ -107,7 +670,33 @@ class Policy:
         """
         if self.site_control == SITE_CONTROL_NONE:
             raise TypeError(METAPOLICY_ERROR.format("allow a domain"))
-        self.domains[domain] = {"to_ports": to_ports, "secure": secure}
+        self._own()
+        self._domains[domain] = domain_rule(to_ports, secure)
+        self._changed()
+
+    def allow_domains(
+        self,
+        domains: Iterable[str],
+        to_ports: Optional[Iterable[str]] = None,
+        secure: bool = True,
+    ):
+        """
+        Allows access from each of ``domains``, with the same
+        ``to_ports`` and ``secure`` arguments as ``allow_domain()``.
+
+        This is equivalent to calling ``allow_domain()`` for each
+        domain, but much faster for long lists of domains.
+
+        """
+        if isinstance(domains, str):
+            raise TypeError(ITERABLE_ERROR.format("domains"))
+        if self.site_control == SITE_CONTROL_NONE:
+            raise TypeError(METAPOLICY_ERROR.format("allow a domain"))
+        # Built before anything is changed, in case iterating fails.
+        added = dict.fromkeys(domains, domain_rule(to_ports, secure))
+        self._own()
+        self._domains.update(added)
+        self._changed()
 
     def metapolicy(self, permitted: str):
         """
@@ -135,10 +724,12 @@ class Policy:
             raise TypeError(SITE_CONTROL_ERROR.format(permitted))
         if permitted == SITE_CONTROL_NONE:
             # Metapolicy 'none' means no access is permitted.
-            self.domains = {}
-            self.header_domains = {}
-            self.identities = []
+            self._domains = {}
+            self._header_domains = {}
+            self._identities = []
+            self._shared = False
         self.site_control = permitted
+        self._changed()
 
     def allow_headers(self, domain: str, headers: Iterable[str], secure: bool = True):
         """
@@ -160,7 +751,36 @@ class Policy:
         """
         if self.site_control == SITE_CONTROL_NONE:
             raise TypeError(METAPOLICY_ERROR.format("allow headers from a domain"))
-        self.header_domains[domain] = {"headers": headers, "secure": secure}
+        self._own()
+        self._header_domains[domain] = header_rule(headers, secure)
+        self._changed()
+
+    def allow_headers_many(
+        self,
+        rules: Union[Mapping[str, Iterable[str]], Iterable[Tuple[str, Iterable[str]]]],
+        secure: bool = True,
+    ):
+        """
+        Allows each domain in ``rules`` to push data via HTTP headers,
+        with the same ``secure`` argument as ``allow_headers()``.
+
+        ``rules`` may be either a mapping of domains to lists of header
+        names, or an iterable of ``(domain, headers)`` pairs. This is
+        equivalent to calling ``allow_headers()`` for each domain, but
+        much faster for long lists of domains.
+
+        """
+        if isinstance(rules, str):
+            raise TypeError(ITERABLE_ERROR.format("rules"))
+        if self.site_control == SITE_CONTROL_NONE:
+            raise TypeError(METAPOLICY_ERROR.format("allow headers from a domain"))
+        if isinstance(rules, collections.abc.Mapping):
+            rules = rules.items()
+        # Built before anything is changed, in case iterating fails.
+        added = [(domain, header_rule(headers, secure)) for domain, headers in rules]
+        self._own()
+        self._header_domains.update(added)
+        self._changed()
 
     def allow_identity(self, fingerprint: str):
         """
@@ -177,15 +797,92 @@ class Policy:
             raise TypeError(
                 METAPOLICY_ERROR.format("allow access from signed documents")
             )
-        if fingerprint not in self.identities:
-            self.identities.append(fingerprint)
+        self.allow_identities((fingerprint,))
+
+    def allow_identities(self, fingerprints: Iterable[str]):
+        """
+        Allows access from documents digitally signed by the keys with
+        each of ``fingerprints``, as with ``allow_identity()``.
+
+        This is equivalent to calling ``allow_identity()`` for each
+        fingerprint, but much faster for long lists of fingerprints.
+
+        """
+        if isinstance(fingerprints, str):
+            raise TypeError(ITERABLE_ERROR.format("fingerprints"))
+        if self.site_control == SITE_CONTROL_NONE:
+            raise TypeError(
+                METAPOLICY_ERROR.format("allow access from signed documents")
+            )
+        # Read before anything is changed, in case iterating fails.
+        fingerprints = list(fingerprints)
+        self._own()
+        identities, seen = self._identities, self._identity_set
+        if self._indexed_identities is not identities:
+            # The list was replaced, or changed directly and
+            # invalidate() called.
+            seen = self._identity_set = set(identities)
+            self._indexed_identities = identities
+        added = False
+        for fingerprint in fingerprints:
+            if fingerprint not in seen:
+                seen.add(fingerprint)
+                identities.append(fingerprint)
+                added = True
+        if added:
+            self._changed()
 
-    def _add_domains_xml(self, document: xml.dom.minidom.Document):
+    def invalidate(self):
+        """
+        Discards any cached serialized forms of this policy, so that
+        they will be regenerated the next time they are requested.
+
+        This is done automatically by all of the methods which change
+        the policy, and only needs to be called manually after
+        directly modifying the policy's attributes.
+
+        """
+        # The attributes may have been changed in place, so the index
+        # of identities is rebuilt when next needed.
+        self._indexed_identities = None
+        self._changed()
+
+    def _changed(self):
+        """
+        Discards the cached serialized forms of this policy after it
+        has been changed through its own methods, which keep the index
+        of identities up to date.
+
+        """
+        self._cache.clear()
+
+    def _cached(self, key: str, producer: Callable[[], Any]) -> Any:
+        """
+        Returns the cached value stored under ``key``, calling
+        ``producer`` to generate and store it if it is not yet
+        cached.
+
+        """
+        return self._cached_hit(key, producer)[0]
+
+    def _cached_hit(self, key: str, producer: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        As ``_cached()``, but also returns whether the value was
+        already cached.
+
+        """
+        try:
+            return self._cache[key], True
+        except KeyError:
+            value = self._cache[key] = producer()
+            return value, False
+
+    def _add_domains_xml(self, document: "xml.dom.minidom.Document"):
         """
         Generates the XML elements for allowed domains.
 
         """
-        for domain, attrs in self.domains.items():
+        for domain, attrs in self._domains.items():
             domain_element = document.createElement("allow-access-from")
             domain_element.setAttribute("domain", domain)
             if attrs["to_ports"] is not None:
@@ -194,12 +891,12 @@ class Policy:
                 domain_element.setAttribute("secure", "false")
             document.documentElement.appendChild(domain_element)
 
-    def _add_header_domains_xml(self, document: xml.dom.minidom.Document):
+    def _add_header_domains_xml(self, document: "xml.dom.minidom.Document"):
         """
         Generates the XML elements for allowed header domains.
 
         """
-        for domain, attrs in self.header_domains.items():
+        for domain, attrs in self._header_domains.items():
             header_element = document.createElement("allow-http-request-headers-from")
             header_element.setAttribute("domain", domain)
             header_element.setAttribute("headers", ",".join(attrs["headers"]))
@@ -207,12 +904,12 @@ class Policy:
                 header_element.setAttribute("secure", "false")
             document.documentElement.appendChild(header_element)
 
-    def _add_identities_xml(self, document: xml.dom.minidom.Document):
+    def _add_identities_xml(self, document: "xml.dom.minidom.Document"):
         """
         Generates the XML elements for allowed digital signatures.
 
         """
-        for fingerprint in self.identities:
+        for fingerprint in self._identities:
             identity_element = document.createElement("allow-access-from-identity")
             signatory_element = document.createElement("signatory")
             certificate_element = document.createElement("certificate")
@@ -222,22 +919,94 @@ class Policy:
             identity_element.appendChild(signatory_element)
             document.documentElement.appendChild(identity_element)
 
-    def _get_xml_dom(self) -> xml.dom.minidom.Document:
+    def _check_valid(self):
         """
-        Collects all options set so far, and produce and return an
-        ``xml.dom.minidom.Document`` representing the corresponding
-        XML.
+        Raises ``TypeError`` if the metapolicy forbids all access but
+        the policy allows access anyway.
 
         """
         if self.site_control == SITE_CONTROL_NONE and any(
-            (self.domains, self.header_domains, self.identities)
+            (self._domains, self._header_domains, self._identities)
         ):
             raise TypeError(BAD_POLICY)
 
+    def _iter_xml(
+        self, encoding: Optional[str] = None, compact: bool = False
+    ) -> Iterator[str]:
+        """
+        Generates the XML of this policy as a sequence of strings,
+        directly from the policy's attributes and without building a
+        DOM.
+
+        The output is identical to that of ``toprettyxml()`` on the
+        document returned by ``_get_xml_dom()``, with the given
+        ``encoding`` (if any) declared in the XML prolog. If
+        ``compact`` is true, all indentation and line breaks are
+        omitted instead.
+
+        """
+        self._check_valid()
+        newline, indent = ("", "") if compact else ("\n", "\t")
+        if encoding is None:
+            yield '<?xml version="1.0" ?>' + newline
+        else:
+            yield '<?xml version="1.0" encoding="{}"?>{}'.format(encoding, newline)
+        yield "<!DOCTYPE cross-domain-policy{}SYSTEM '{}'>{}".format(
+            " " if compact else "\n  ", POLICY_DTD, newline
+        )
+        if self.site_control is None and not any(
+            (self._domains, self._header_domains, self._identities)
+        ):
+            yield "<cross-domain-policy/>" + newline
+            return
+        yield "<cross-domain-policy>" + newline
+        if self.site_control is not None:
+            yield '{}<site-control permitted-cross-domain-policies="{}"/>{}'.format(
+                indent, _escape_attr(self.site_control), newline
+            )
+        for domain, attrs in self._domains.items():
+            yield '{}<allow-access-from domain="{}"'.format(
+                indent, _escape_attr(domain)
+            )
+            if attrs["to_ports"] is not None:
+                yield ' to-ports="{}"'.format(_escape_attr(",".join(attrs["to_ports"])))
+            if not attrs["secure"]:
+                yield ' secure="false"'
+            yield "/>" + newline
+        for domain, attrs in self._header_domains.items():
+            yield '{}<allow-http-request-headers-from domain="{}" headers="{}"'.format(
+                indent, _escape_attr(domain), _escape_attr(",".join(attrs["headers"]))
+            )
+            if not attrs["secure"]:
+                yield ' secure="false"'
+            yield "/>" + newline
+        for fingerprint in self._identities:
+            yield (
+                "{indent}<allow-access-from-identity>{newline}"
+                "{indent}{indent}<signatory>{newline}"
+                '{indent}{indent}{indent}<certificate fingerprint="{fingerprint}" '
+                'fingerprint-algorithm="sha-1"/>{newline}'
+                "{indent}{indent}</signatory>{newline}"
+                "{indent}</allow-access-from-identity>{newline}"
+            ).format(
+                indent=indent, newline=newline, fingerprint=_escape_attr(fingerprint)
+            )
+        yield "</cross-domain-policy>" + newline
+
+    def _get_xml_dom(self) -> "xml.dom.minidom.Document":
+        """
+        Collects all options set so far, and produce and return an
+        ``xml.dom.minidom.Document`` representing the corresponding
+        XML.
+
+        """
+        self._check_valid()
+
+        minidom = _get_minidom()
         policy_type = minidom.createDocumentType(
             qualifiedName="cross-domain-policy",
             publicId=None,
-            systemId="http://www.adobe.com/xml/dtds/cross-domain-policy.dtd",
+            systemId=POLICY_DTD,
         )
         policy = minidom.createDocument(None, "cross-domain-policy", policy_type)
 
@@ -255,23 +1024,218 @@ class Policy:
 
     xml_dom = property(_get_xml_dom)
 
+    def _compact(self, compact: Optional[bool]) -> bool:
+        """
+        Resolves a per-call ``compact`` argument against this policy's
+        default.
+
+        """
+        return self.compact if compact is None else compact
+
     def __str__(self) -> str:
-        return self.xml_dom.toprettyxml()
+        return self._cached(
+            "str:{}".format(self.compact),
+            lambda: "".join(self._iter_xml(compact=self.compact)),
+        )
 
-    def serialize(self) -> bytes:
+    def serialize(self, compact: Optional[bool] = None) -> bytes:
         """
         Serializes this policy to a UTF-8 byte sequence.
 
         This is similar to __str__() but with one important
         difference: __str__() is required to return a Unicode string,
-        and so can't use the 'encoding' argument of
-        toprettyxml(). This method can return a bytes object, and will
-        return a UTF-8-encoded byte sequence with appropriate encoding
-        declaration in its XML prolog..
+        and so can't declare an encoding. This method can return a
+        bytes object, and will return a UTF-8-encoded byte sequence
+        with appropriate encoding declaration in its XML prolog.
+
+        The XML is written directly from the policy's attributes
+        rather than by way of ``xml_dom``, but is identical to the
+        output of ``xml_dom.toprettyxml(encoding="utf-8")``. Pass
+        ``compact=True`` (or set the policy's ``compact`` attribute)
+        to omit all indentation and line breaks instead.
 
         In general, use str() if you just want to see what would be
         produced, and use serialize() if you want to pass the result
         to something that will serve the XML, or write to a file.
 
+        The result is cached until the policy is next changed.
+
+        """
+        return self._body(None, compact)[0]
+
+    def compress(self, encoding: str, compact: Optional[bool] = None) -> bytes:
+        """
+        Returns the serialized form of this policy, compressed with
+        ``encoding``, which must be one of the keys of
+        ``COMPRESSORS``. ``compact`` is as for ``serialize()``.
+
+        The result is cached until the policy is next changed, so each
+        version of a policy is compressed only once per encoding.
+
+        """
+        if encoding not in COMPRESSORS:
+            raise TypeError(COMPRESSION_ERROR.format(encoding))
+        return self._body(encoding, compact)[0]
+
+    def _body(
+        self, encoding: Optional[str], compact: Optional[bool]
+    ) -> Tuple[bytes, bool]:
         """
-        return self.xml_dom.toprettyxml(encoding="utf-8")
+        Returns the serialized form of this policy, compressed with
+        ``encoding`` unless it is ``None``, and whether it was already
+        cached rather than produced by this call.
+
+        """
+        compact = self._compact(compact)
+        if encoding is None:
+            return self._cached_hit(
+                "serialize:{}".format(compact),
+                lambda: "".join(self._iter_xml("utf-8", compact)).encode("utf-8"),
+            )
+        return self._cached_hit(
+            "compress:{}:{}".format(encoding, compact),
+            lambda: COMPRESSORS[encoding](self.serialize(compact)),
+        )
+
+    def digest(self, compact: Optional[bool] = None) -> str:
+        """
+        Returns a hex-encoded SHA-256 hash of the serialized form of
+        this policy, suitable for use as a cache key or HTTP ``ETag``.
+        ``compact`` is as for ``serialize()``.
+
+        The result is cached until the policy is next changed.
+
+        """
+        compact = self._compact(compact)
+        return self._cached(
+            "digest:{}".format(compact),
+            lambda: hashlib.sha256(self.serialize(compact)).hexdigest(),
+        )
+
+    def matcher(self) -> Matcher:
+        """
+        Returns a ``Matcher`` for evaluating requests against this
+        policy's rules.
+
+        The result is cached until the policy is next changed.
+
+        """
+        return self._cached("matcher", lambda: Matcher(self))
+
+    def allows(
+        self, domain: str, port: Optional[int] = None, secure: bool = True
+    ) -> bool:
+        """
+        Returns whether this policy allows access from content served
+        from ``domain``, taking wildcards into account.
+
+        For socket policies, pass the port being connected to as
+        ``port``. Pass ``secure=False`` if the content was not served
+        via HTTPS, so that only domains allowed with ``secure=False``
+        are allowed.
+
+        """
+        return self.matcher().allows(domain, port, secure)
+
+    def allows_headers(
+        self, domain: str, headers: Iterable[str], secure: bool = True
+    ) -> bool:
+        """
+        Returns whether this policy allows content served from
+        ``domain`` to push data via each of the HTTP headers named in
+        ``headers``. ``secure`` is as for ``allows()``.
+
+        """
+        return self.matcher().allows_headers(domain, headers, secure)
+
+    def freeze(self) -> "FrozenPolicy":
+        """
+        Returns an immutable copy of this policy, as a
+        ``FrozenPolicy``.
+
+        """
+        return FrozenPolicy(self)
+
+
+class FrozenPolicy(Policy):
+    """
+    An immutable policy, as returned by ``Policy.freeze()``.
+
+    A frozen policy serializes, compresses and hashes itself once,
+    when it is created, so serving it never does any of that work, and
+    it can be shared between threads without locking. Frozen policies
+    are hashable, and equal when their serialized forms are.
+
+    Trying to change a frozen policy raises ``TypeError``; to derive a
+    changed policy from it, use ``copy()``, which returns an ordinary,
+    mutable ``Policy``.
+
+    """
+
+    def __init__(self, policy: Policy):
+        # The copy shares the policy's rules until the policy is
+        # changed, so freezing does not copy them.
+        self.__dict__.update(policy.copy().__dict__)
+        self.serialize()
+        self.digest()
+        for encoding in COMPRESSORS:
+            self.compress(encoding)
+
+    def __setattr__(self, name: str, value: Any):
+        raise AttributeError(FROZEN_ERROR)
+
+    def __hash__(self) -> int:
+        return hash(self.digest())
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, FrozenPolicy):
+            return NotImplemented
+        return self.digest() == other.digest()
+
+    @property
+    def domains(self) -> Mapping[str, DomainRule]:
+        return types.MappingProxyType(self._domains)
+
+    @property
+    def header_domains(self) -> Mapping[str, HeaderRule]:
+        return types.MappingProxyType(self._header_domains)
+
+    @property
+    def identities(self) -> Tuple[str, ...]:
+        return tuple(self._identities)
+
+    def _frozen(self, *args: Any, **kwargs: Any):
+        raise TypeError(FROZEN_ERROR)
+
+    allow_domain = allow_domains = allow_headers = allow_headers_many = _frozen
+    allow_identity = allow_identities = metapolicy = invalidate = _frozen
+
+    def copy(self) -> Policy:
+        """
+        Returns a mutable copy of this policy.
+
+        """
+        policy = object.__new__(Policy)
+        policy.__dict__.update(self.__dict__)
+        policy._cache = dict(self._cache)
+        policy._shared = True
+        return policy
+
+    __copy__ = copy
+
+    def freeze(self) -> "FrozenPolicy":
+        return self
+
+
+def _escape_attr(value: str) -> str:
+    """
+    Escapes ``value`` for use inside a double-quoted XML attribute,
+    the same way ``xml.dom.minidom`` does.
+
+    """
+    return (
+        value.replace("&", "&amp;")
+        .replace("<", "&lt;")
+        .replace('"', "&quot;")
+        .replace(">", "&gt;")
+    )
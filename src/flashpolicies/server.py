@@ -0,0 +1,354 @@
+"""
+A standalone asyncio server for Flash socket policy files.
+
+Before opening a socket connection to a host, Flash Player connects
+to port 843 on that host, sends the string ``<policy-file-request/>``
+followed by a NUL byte, and expects a policy file followed by a NUL
+byte in return. The ``PolicyServer`` class here implements that
+protocol, serving a single ``flashpolicies.policies.Policy``.
+
+"""
+
+import asyncio
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+from typing import Callable, List, Optional
+
+from . import policies
+
+
+POLICY_FILE_REQUEST = b"<policy-file-request/>\0"
+
+# The default port on which Flash Player requests socket policies.
+DEFAULT_PORT = 843
+
+# The signals each worker process handles itself.
+WORKER_SIGNALS = {signal.SIGHUP, signal.SIGTERM}
+
+
+class PolicyServer:
+    """
+    Serves ``policy`` to Flash socket policy requests.
+
+    The policy is serialized once, when the server is created, so
+    each connection costs only a read and a write. Connections which
+    don't send a complete policy request within ``timeout`` seconds
+    are dropped, and once ``max_connections`` connections are open,
+    further connections are closed immediately until some finish.
+
+    """
+
+    def __init__(
+        self,
+        policy: policies.Policy,
+        host: Optional[str] = None,
+        port: int = DEFAULT_PORT,
+        timeout: float = 5.0,
+        max_connections: int = 1000,
+    ):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.connections = 0
+        self.server = None  # type: Optional[asyncio.AbstractServer]
+        self.set_policy(policy)
+
+    def set_policy(self, policy: policies.Policy):
+        """
+        Changes the policy being served. Connections accepted after
+        this call will receive the new policy.
+
+        """
+        self.policy = policy
+        self.response = policy.serialize() + b"\0"
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        Handles a single connection, answering a policy request with
+        the policy.
+
+        """
+        if self.connections >= self.max_connections:
+            writer.close()
+            return
+        self.connections += 1
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\0"), self.timeout)
+            if request.strip() == POLICY_FILE_REQUEST:
+                writer.write(self.response)
+                await asyncio.wait_for(writer.drain(), self.timeout)
+        except (
+            asyncio.IncompleteReadError,
+            asyncio.LimitOverrunError,
+            asyncio.TimeoutError,
+            ConnectionError,
+        ):
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def start(self, sock: Optional[socket.socket] = None):
+        """
+        Starts listening for connections, either on ``self.host`` and
+        ``self.port`` or, if given, on the already-bound socket
+        ``sock``.
+
+        """
+        # Policy requests are tiny, so a small read buffer limit also
+        # bounds the memory a misbehaving client can make us use.
+        limit = len(POLICY_FILE_REQUEST) * 4
+        if sock is not None:
+            self.server = await asyncio.start_server(
+                self.handle, sock=sock, limit=limit
+            )
+        else:
+            self.server = await asyncio.start_server(
+                self.handle, self.host, self.port, limit=limit, reuse_address=True
+            )
+
+    async def serve_forever(self, sock: Optional[socket.socket] = None):
+        """
+        Starts the server and serves connections until cancelled.
+
+        """
+        await self.start(sock)
+        async with self.server:
+            await self.server.serve_forever()
+
+    def close(self):
+        """
+        Stops accepting new connections.
+
+        """
+        if self.server is not None:
+            self.server.close()
+
+
+def reuseport_socket(host: Optional[str], port: int) -> socket.socket:
+    """
+    Returns a TCP socket bound to ``host`` and ``port`` with
+    ``SO_REUSEPORT`` set, so that several processes can each bind
+    their own socket to the same port and have the kernel distribute
+    connections among them.
+
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host or "0.0.0.0", port))
+    return sock
+
+
+async def run_worker(
+    policy_server: PolicyServer,
+    sock: Optional[socket.socket],
+    stopping: asyncio.Event,
+    report: Callable[[int], None],
+    interval: float = 1.0,
+):
+    """
+    Runs ``policy_server`` until ``stopping`` is set, calling
+    ``report`` with its current number of connections every
+    ``interval`` seconds. Once stopped, no new connections are
+    accepted, and connections already in progress are given up to
+    the server's timeout to finish.
+
+    """
+    await policy_server.start(sock)
+    while not stopping.is_set():
+        report(policy_server.connections)
+        try:
+            await asyncio.wait_for(stopping.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+    policy_server.close()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + policy_server.timeout
+    while policy_server.connections and loop.time() < deadline:
+        await asyncio.sleep(0.01)
+    report(0)
+
+
+def _worker_main(prefork: "PreforkPolicyServer", index: int, sock: socket.socket):
+    """
+    Entry point of each worker process: serves the policy on ``sock``
+    until sent ``SIGTERM``, and reloads it when sent ``SIGHUP``.
+
+    The worker is started with both signals blocked, so that any sent
+    while it is still loading the policy wait for its own handlers,
+    rather than running the parent's.
+
+    """
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        stopping = asyncio.Event()
+        policy_server = PolicyServer(
+            prefork.policy_loader(),
+            timeout=prefork.timeout,
+            max_connections=prefork.max_connections,
+        )
+        loop.add_signal_handler(
+            signal.SIGHUP, lambda: policy_server.set_policy(prefork.policy_loader())
+        )
+        loop.add_signal_handler(signal.SIGTERM, stopping.set)
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, WORKER_SIGNALS)
+
+        def report(count):
+            prefork.counts[index] = count
+
+        await run_worker(policy_server, sock, stopping, report, prefork.report_interval)
+
+    # Interrupts are handled by the parent process, which shuts the
+    # workers down in an orderly fashion.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for signum in WORKER_SIGNALS:
+        signal.signal(signum, signal.SIG_DFL)
+    asyncio.run(main())
+
+
+class PreforkPolicyServer:
+    """
+    Runs ``workers`` processes, each serving the policy returned by
+    ``policy_loader`` on the same port.
+
+    Each worker binds its own ``SO_REUSEPORT`` socket, so the kernel
+    spreads incoming connections across them. Sending ``SIGHUP`` to the
+    parent process makes each worker call ``policy_loader`` again and
+    serve the new policy, and ``SIGTERM`` or ``SIGINT`` shuts the
+    workers down gracefully. Workers which exit unexpectedly are
+    restarted.
+
+    This relies on ``fork()``, and so is only available on Unix-like
+    systems.
+
+    """
+
+    def __init__(
+        self,
+        policy_loader: Callable[[], policies.Policy],
+        workers: int = 4,
+        host: Optional[str] = None,
+        port: int = DEFAULT_PORT,
+        timeout: float = 5.0,
+        max_connections: int = 1000,
+        report_interval: float = 1.0,
+    ):
+        self.policy_loader = policy_loader
+        self.workers = workers
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.report_interval = report_interval
+        self._context = multiprocessing.get_context("fork")
+        self.counts = self._context.RawArray("i", workers)
+        self.processes = []  # type: List[multiprocessing.Process]
+        self._stopping = threading.Event()
+
+    def _spawn(self, index: int) -> multiprocessing.Process:
+        """
+        Starts the worker process numbered ``index``.
+
+        """
+        sock = reuseport_socket(self.host, self.port)
+        process = self._context.Process(
+            target=_worker_main, args=(self, index, sock), daemon=True
+        )
+        # The worker inherits the blocked signals; see _worker_main().
+        blocked = signal.pthread_sigmask(signal.SIG_BLOCK, WORKER_SIGNALS)
+        try:
+            process.start()
+        finally:
+            signal.pthread_sigmask(signal.SIG_SETMASK, blocked)
+        # The worker has its own copy of the socket now.
+        sock.close()
+        return process
+
+    def start(self):
+        """
+        Starts all worker processes.
+
+        """
+        self._stopping.clear()
+        self.processes = [self._spawn(index) for index in range(self.workers)]
+
+    def connection_counts(self) -> List[int]:
+        """
+        Returns the number of connections each worker is currently
+        handling, as of its most recent report.
+
+        """
+        return list(self.counts)
+
+    def respawn(self):
+        """
+        Restarts any workers which have exited.
+
+        """
+        for index, process in enumerate(self.processes):
+            if not process.is_alive():
+                self.processes[index] = self._spawn(index)
+
+    def reload(self):
+        """
+        Makes each worker reload its policy from ``policy_loader``.
+
+        """
+        for process in self.processes:
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGHUP)
+
+    def shutdown(self):
+        """
+        Asks ``run()`` to stop the workers and return.
+
+        """
+        self._stopping.set()
+
+    def stop(self):
+        """
+        Stops all worker processes, waiting for each to finish the
+        connections it is handling.
+
+        """
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join()
+
+    def run(self, report: Optional[Callable[[List[int]], None]] = None):
+        """
+        Starts the workers and supervises them until ``shutdown()`` is
+        called or the process receives ``SIGTERM`` or ``SIGINT``,
+        restarting any which exit unexpectedly. If given, ``report`` is
+        called with the workers' connection counts every
+        ``report_interval`` seconds.
+
+        Must be called from the main thread.
+
+        """
+        handlers = {
+            signal.SIGHUP: lambda signum, frame: self.reload(),
+            signal.SIGINT: lambda signum, frame: self.shutdown(),
+            signal.SIGTERM: lambda signum, frame: self.shutdown(),
+        }
+        previous = {
+            signum: signal.signal(signum, handler)
+            for signum, handler in handlers.items()
+        }
+        try:
+            self.start()
+            while not self._stopping.wait(self.report_interval):
+                self.respawn()
+                if report is not None:
+                    report(self.connection_counts())
+            self.stop()
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
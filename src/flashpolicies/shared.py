@@ -0,0 +1,191 @@
+"""
+A store of serialized policies in a memory-mapped file, shared by all
+the processes serving them.
+
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Dict, List, Mapping, NamedTuple, Optional, Tuple
+
+from . import policies
+from .files import write_atomic
+
+
+FORMAT_ERROR = "'{}' is not a shared policy store."
+
+# Files start with this, followed by the length of the index as a
+# 32-bit big-endian integer, the index itself (as UTF-8 JSON) and the
+# bodies of the policies.
+MAGIC = b"FPSTORE1"
+HEADER = struct.Struct(">I")
+
+
+class _Mapping(NamedTuple):
+    """
+    A mapping of one version of a store's file: the file's identity,
+    used to notice when it is replaced, the mapped data, and its
+    index.
+
+    """
+
+    key: Tuple[int, int, int]
+    data: mmap.mmap
+    start: int
+    variants: Dict[str, Dict[str, str]]
+    bodies: Dict[str, List[int]]
+
+
+class StoredPolicy(NamedTuple):
+    """
+    A policy's body as found in a ``SharedPolicyStore``: the SHA-256
+    hash of its uncompressed form (as returned by ``Policy.digest()``)
+    and a view of the body in the shared mapping.
+
+    """
+
+    digest: str
+    body: memoryview
+
+
+def _variant(compact: bool, encoding: Optional[str] = None) -> str:
+    return "{}:{}".format(encoding or "identity", compact)
+
+
+def _file_key(stat: os.stat_result) -> Tuple[int, int, int]:
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+class SharedPolicyStore:
+    """
+    Serialized policies, stored by name in a file which every process
+    serving them maps into memory, so that however many processes
+    serve a policy, the operating system holds one copy of it.
+
+    One process publishes policies with ``publish()``, which replaces
+    the file atomically; processes reading from the store notice the
+    new file within ``check_interval`` seconds, and map it in place of
+    the old one, without any coordination between processes and
+    without a restart. Each body is
+    stored once per content hash, however many policies share it.
+
+    """
+
+    def __init__(self, path: str, check_interval: float = 1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.mapping = None  # type: Optional[_Mapping]
+        self.checked = float("-inf")
+
+    def publish(
+        self, named_policies: Mapping[str, policies.Policy], compress: bool = False
+    ):
+        """
+        Replaces the contents of the store with ``named_policies``, a
+        mapping of names to ``Policy`` objects, each stored both
+        pretty-printed and compact and, if ``compress`` is ``True``,
+        compressed with each supported encoding.
+
+        """
+        variants = {}  # type: Dict[str, Dict[str, str]]
+        bodies = {}  # type: Dict[str, bytes]
+        for name, policy in named_policies.items():
+            variants[name] = {}
+            for compact in (False, True):
+                digest = policy.digest(compact)
+                variants[name][_variant(compact)] = digest
+                bodies[digest] = policy.serialize(compact)
+                if compress:
+                    for encoding in policies.COMPRESSORS:
+                        body = policy.compress(encoding, compact)
+                        digest = hashlib.sha256(body).hexdigest()
+                        variants[name][_variant(compact, encoding)] = digest
+                        bodies[digest] = body
+        offsets = {}  # type: Dict[str, List[int]]
+        offset = 0
+        for digest, body in bodies.items():
+            offsets[digest] = [offset, len(body)]
+            offset += len(body)
+        index = json.dumps(
+            {"variants": variants, "bodies": offsets}, sort_keys=True
+        ).encode("utf-8")
+        write_atomic(
+            self.path, MAGIC + HEADER.pack(len(index)) + index, *bodies.values()
+        )
+
+    def _load(self) -> _Mapping:
+        prefix = len(MAGIC) + HEADER.size
+        with open(self.path, "rb") as f:
+            # The key is taken from the file opened, rather than from
+            # the path, in case the file is replaced meanwhile.
+            key = _file_key(os.fstat(f.fileno()))
+            if key[2] < prefix:
+                raise TypeError(FORMAT_ERROR.format(self.path))
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if data[: len(MAGIC)] != MAGIC:
+            raise TypeError(FORMAT_ERROR.format(self.path))
+        (length,) = HEADER.unpack(data[len(MAGIC) : prefix])
+        index = json.loads(data[prefix : prefix + length].decode("utf-8"))
+        return _Mapping(key, data, prefix + length, index["variants"], index["bodies"])
+
+    def _current(self) -> Optional[_Mapping]:
+        """
+        Returns the mapping of the current version of the store's file,
+        checking for a new version at most every ``check_interval``
+        seconds, or ``None`` if nothing has been published.
+
+        """
+        mapping = self.mapping
+        now = time.monotonic()
+        if now - self.checked < self.check_interval:
+            return mapping
+        with self.lock:
+            self.checked = now
+            try:
+                key = _file_key(os.stat(self.path))
+            except FileNotFoundError:
+                self.mapping = None
+                return None
+            if self.mapping is None or self.mapping.key != key:
+                # The previous mapping is left for garbage collection,
+                # since responses may still be using its data.
+                self.mapping = self._load()
+            return self.mapping
+
+    def names(self) -> List[str]:
+        """
+        Returns the names of the policies in the store.
+
+        """
+        mapping = self._current()
+        return [] if mapping is None else sorted(mapping.variants)
+
+    def get(
+        self, name: str, compact: bool = False, encoding: Optional[str] = None
+    ) -> Optional[StoredPolicy]:
+        """
+        Returns the body of the policy ``name`` -- compact if
+        ``compact`` is ``True``, and compressed with ``encoding`` if
+        that is given -- as a ``StoredPolicy``, or ``None`` if there is
+        no such body.
+
+        """
+        mapping = self._current()
+        if mapping is None:
+            return None
+        variants = mapping.variants.get(name, {})
+        digest = variants.get(_variant(compact, encoding))
+        if digest is None:
+            return None
+        offset, length = mapping.bodies[digest]
+        start = mapping.start + offset
+        return StoredPolicy(
+            variants[_variant(compact)],
+            memoryview(mapping.data)[start : start + length],
+        )
@@ -3,15 +3,168 @@ Views for generating and serving policy files.
 
 """
 
+import functools
+import time
 import warnings
-from typing import Iterable, Optional
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
 
-from django.http import HttpRequest, HttpResponse
+from django.conf import settings
+from django.http import Http404, HttpRequest, HttpResponse
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    patch_vary_headers,
+)
+from django.utils.http import http_date, quote_etag
 
-from . import policies
+from . import hosts, metrics, policies, shared
+from .middleware import policy_exempt
 
 
-def serve(request: HttpRequest, policy: policies.Policy) -> HttpResponse:
+def _validators(policy: policies.Policy, compact: bool) -> Tuple[str, int]:
+    """
+    Returns the ``ETag`` and ``Last-Modified`` timestamp to send with
+    ``policy``, computing them only once per version of the policy.
+
+    """
+
+    def compute():
+        return quote_etag(policy.digest(compact)), int(time.time())
+
+    return policy._cached("validators:{}".format(compact), compute)
+
+
+def _patch_caching_headers(
+    response: HttpResponse, cache_control: Optional[Dict[str, Any]]
+):
+    """
+    Adds ``Cache-Control``, ``Expires`` and ``Surrogate-Control``
+    headers to ``response`` according to ``cache_control``, falling
+    back to the ``FLASHPOLICIES_CACHE_CONTROL`` setting.
+
+    """
+    if cache_control is None:
+        cache_control = getattr(settings, "FLASHPOLICIES_CACHE_CONTROL", None)
+    if not cache_control:
+        return
+    patch_cache_control(response, public=True, **cache_control)
+    if "max_age" in cache_control:
+        response["Expires"] = http_date(time.time() + cache_control["max_age"])
+    if "s_maxage" in cache_control:
+        response["Surrogate-Control"] = "max-age={}".format(cache_control["s_maxage"])
+
+
+@functools.lru_cache(maxsize=256)
+def _parse_accept_encoding(header: str) -> Dict[str, float]:
+    """
+    Parses the value of an ``Accept-Encoding`` header into a
+    dictionary mapping each coding to its quality value.
+
+    """
+    accepted = {}
+    for item in header.split(","):
+        coding, _, params = item.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[coding] = quality
+    return accepted
+
+
+def _negotiate_encoding(request: HttpRequest) -> Optional[str]:
+    """
+    Returns the preferred compression encoding, from those available,
+    which the client accepts, or ``None`` if the client accepts none
+    of them.
+
+    """
+    accepted = _parse_accept_encoding(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+    for encoding in policies.COMPRESSORS:
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+@functools.lru_cache(maxsize=128)
+def _build_policy(
+    domains: Tuple[str, ...], permitted: Optional[str] = None
+) -> policies.FrozenPolicy:
+    """
+    Builds (and remembers) the policy served by the helper views for a
+    given set of arguments. The policy is frozen, so that its
+    serialized forms are computed only once, and it cannot be changed
+    while shared between requests.
+
+    """
+    policy = policies.Policy(*domains)
+    if permitted is not None:
+        policy.metapolicy(permitted)
+    return policy.freeze()
+
+
+def _policy_response(
+    request: HttpRequest,
+    policy: policies.Policy,
+    cache_control: Optional[Dict[str, Any]],
+    compress: Optional[bool],
+    compact: Optional[bool],
+) -> HttpResponse:
+    """
+    Builds the response for ``policy``. This is shared by ``serve()``
+    and ``aserve()``, and does no I/O, so it is safe to call from
+    either a synchronous or an asynchronous view.
+
+    """
+    if compress is None:
+        compress = getattr(settings, "FLASHPOLICIES_COMPRESS", False)
+    if compact is None:
+        compact = policy.compact
+    encoding = _negotiate_encoding(request) if compress else None
+    backend = metrics.get_backend()
+    if backend is None:
+        if encoding is None:
+            body = policy.serialize(compact)
+        else:
+            body = policy.compress(encoding, compact)
+    else:
+        body = metrics.record_body(backend, request, policy, encoding, compact)
+    etag, last_modified = _validators(policy, compact)
+    if encoding is not None:
+        etag = quote_etag("{}-{}".format(policy.digest(compact), encoding))
+    response = HttpResponse(
+        body, content_type="text/x-cross-domain-policy; charset=utf-8"
+    )
+    if compress:
+        patch_vary_headers(response, ("Accept-Encoding",))
+    if encoding is not None:
+        response["Content-Encoding"] = encoding
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    _patch_caching_headers(response, cache_control)
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified, response=response
+    )
+    if backend is not None:
+        metrics.record_response(backend, request, policy.digest(compact), response)
+    return response
+
+
+@policy_exempt
+def serve(
+    request: HttpRequest,
+    policy: policies.Policy,
+    cache_control: Optional[Dict[str, Any]] = None,
+    compress: Optional[bool] = None,
+    compact: Optional[bool] = None,
+) -> HttpResponse:
     """
     Given a ``flashpolicies.policies.Policy`` instance, serializes it
     to XML and serve it.
@@ -19,6 +172,11 @@ def serve(request: HttpRequest, policy: policies.Policy) -> HttpResponse:
     Internally, this is used by all other views as the mechanism which
     actually serves the policy file.
 
+    The response carries an ``ETag`` (a hash of the serialized policy)
+    and a ``Last-Modified`` header, and conditional requests using
+    ``If-None-Match`` or ``If-Modified-Since`` receive a 304 response
+    with no body when the policy has not changed.
+
     **Required arguments:**
 
     ``policy``
@@ -26,15 +184,41 @@ def serve(request: HttpRequest, policy: policies.Policy) -> HttpResponse:
 
     **Optional arguments:**
 
-    None.
+    ``cache_control``
+        A dictionary of ``Cache-Control`` directives, as accepted by
+        ``django.utils.cache.patch_cache_control()`` (for example,
+        ``{"max_age": 86400, "s_maxage": 604800,
+        "stale_while_revalidate": 3600, "immutable": True}``). The
+        response is marked ``public``, ``max_age`` also sets
+        ``Expires`` and ``s_maxage`` also sets ``Surrogate-Control``.
+        Defaults to the ``FLASHPOLICIES_CACHE_CONTROL`` setting; if
+        neither is given, no caching headers are sent.
+
+    ``compress``
+        If ``True``, serves a compressed copy of the policy to clients
+        whose ``Accept-Encoding`` header allows it, preferring Brotli
+        (when the ``brotli`` package is installed) over gzip. Each
+        version of the policy is compressed only once. Defaults to the
+        ``FLASHPOLICIES_COMPRESS`` setting, or ``False`` if that is not
+        set.
+
+    ``compact``
+        If ``True``, serves the policy without indentation or line
+        breaks; if ``False``, serves it pretty-printed. Defaults to
+        the ``compact`` attribute of the policy.
 
     """
-    return HttpResponse(
-        policy.serialize(), content_type="text/x-cross-domain-policy; charset=utf-8"
-    )
+    return _policy_response(request, policy, cache_control, compress, compact)
 
 
-def allow_domains(request: HttpRequest, domains: Iterable[str]) -> HttpResponse:
+@policy_exempt
+def allow_domains(
+    request: HttpRequest,
+    domains: Iterable[str],
+    cache_control: Optional[Dict[str, Any]] = None,
+    compress: Optional[bool] = None,
+    compact: Optional[bool] = None,
+) -> HttpResponse:
     """
     Serves a cross-domain access policy allowing a list of domains.
 
@@ -55,12 +239,25 @@ def allow_domains(request: HttpRequest, domains: Iterable[str]) -> HttpResponse:
 
     **Optional arguments:**
 
-    None.
+    ``cache_control``
+        Caching directives for the response, as accepted by
+        ``serve()``.
+
+    ``compress``
+        Whether to serve a compressed policy when the client accepts
+        one, as accepted by ``serve()``.
+
+    ``compact``
+        Whether to serve the policy without indentation or line
+        breaks, as accepted by ``serve()``.
 
     """
-    return serve(request, policies.Policy(*domains))
+    return serve(
+        request, _build_policy(tuple(domains)), cache_control, compress, compact
+    )
 
 
+@policy_exempt
 def simple(request: HttpRequest, domains: Iterable[str]) -> HttpResponse:
     """
     Deprecated name for the ``allow_domains`` view.
@@ -76,8 +273,14 @@ def simple(request: HttpRequest, domains: Iterable[str]) -> HttpResponse:
     return allow_domains(request, domains)
 
 
+@policy_exempt
 def metapolicy(
-    request: HttpRequest, permitted: str, domains: Optional[Iterable[str]] = None
+    request: HttpRequest,
+    permitted: str,
+    domains: Optional[Iterable[str]] = None,
+    cache_control: Optional[Dict[str, Any]] = None,
+    compress: Optional[bool] = None,
+    compact: Optional[bool] = None,
 ) -> HttpResponse:
     """
     Serves a cross-domain policy which can allow other policies
@@ -105,15 +308,37 @@ def metapolicy(
         issues, it is strongly recommended that you not use wildcard
         domain values.
 
+    ``cache_control``
+        Caching directives for the response, as accepted by
+        ``serve()``.
+
+    ``compress``
+        Whether to serve a compressed policy when the client accepts
+        one, as accepted by ``serve()``.
+
+    ``compact``
+        Whether to serve the policy without indentation or line
+        breaks, as accepted by ``serve()``.
+
     """
     if domains is None:
         domains = []
-    policy = policies.Policy(*domains)
-    policy.metapolicy(permitted)
-    return serve(request, policy)
+    return serve(
+        request,
+        _build_policy(tuple(domains), permitted),
+        cache_control,
+        compress,
+        compact,
+    )
 
 
-def no_access(request: HttpRequest) -> HttpResponse:
+@policy_exempt
+def no_access(
+    request: HttpRequest,
+    cache_control: Optional[Dict[str, Any]] = None,
+    compress: Optional[bool] = None,
+    compact: Optional[bool] = None,
+) -> HttpResponse:
     """
     Serves a cross-domain access policy which permits no access of any
     kind, via a metapolicy declaration disallowing all policy files.
@@ -129,7 +354,309 @@ def no_access(request: HttpRequest) -> HttpResponse:
 
     **Optional arguments:**
 
-    None.
+    ``cache_control``
+        Caching directives for the response, as accepted by
+        ``serve()``.
+
+    ``compress``
+        Whether to serve a compressed policy when the client accepts
+        one, as accepted by ``serve()``.
+
+    ``compact``
+        Whether to serve the policy without indentation or line
+        breaks, as accepted by ``serve()``.
+
+    """
+    return metapolicy(
+        request,
+        permitted=policies.SITE_CONTROL_NONE,
+        cache_control=cache_control,
+        compress=compress,
+        compact=compact,
+    )
+
+
+def _host_policy(
+    request: HttpRequest, registry: hosts.HostPolicyRegistry
+) -> policies.Policy:
+    """
+    Returns the policy ``registry`` holds for the host of ``request``,
+    raising ``Http404`` if there is none.
+
+    """
+    policy = registry.lookup(request.get_host())
+    if policy is None:
+        raise Http404("No cross-domain policy for this host.")
+    return policy
+
+
+@policy_exempt
+def serve_by_host(
+    request: HttpRequest,
+    registry: hosts.HostPolicyRegistry,
+    cache_control: Optional[Dict[str, Any]] = None,
+    compress: Optional[bool] = None,
+    compact: Optional[bool] = None,
+) -> HttpResponse:
+    """
+    Serves the policy registered for the host of the request, for
+    sites which serve different policies on different hosts.
+
+    **Required arguments:**
+
+    ``registry``
+        A ``flashpolicies.hosts.HostPolicyRegistry`` mapping hosts to
+        their policies. If it has no policy (and no default) for the
+        host, a 404 is returned.
+
+    **Optional arguments:**
+
+    ``cache_control``
+        Caching directives for the response, as accepted by
+        ``serve()``.
+
+    ``compress``
+        Whether to serve a compressed policy when the client accepts
+        one, as accepted by ``serve()``.
+
+    ``compact``
+        Whether to serve the policy without indentation or line
+        breaks, as accepted by ``serve()``.
+
+    """
+    return serve(
+        request, _host_policy(request, registry), cache_control, compress, compact
+    )
+
+
+def _stored_response(
+    request: HttpRequest,
+    lookup: Callable[[Optional[str]], Optional[Tuple[str, Any]]],
+    missing: str,
+    cache_control: Optional[Dict[str, Any]],
+    compress: Optional[bool],
+    last_modified: Optional[int] = None,
+) -> HttpResponse:
+    """
+    Builds the response for a policy which is already serialized, and
+    possibly compressed. ``lookup`` is called with a compression
+    encoding, or ``None`` for the uncompressed body, and returns the
+    digest of the uncompressed body and the body itself, or ``None`` if
+    the policy is not available in that encoding; if it is not
+    available at all, ``Http404`` is raised with the message
+    ``missing``.
+
+    """
+    if compress is None:
+        compress = getattr(settings, "FLASHPOLICIES_COMPRESS", False)
+    encoding = _negotiate_encoding(request) if compress else None
+    stored = None
+    if encoding is not None:
+        stored = lookup(encoding)
+    if stored is None:
+        # Either compression is not wanted, or the policy is not
+        # available compressed with the client's preferred encoding.
+        encoding = None
+        stored = lookup(None)
+    if stored is None:
+        raise Http404(missing)
+    digest, body = stored
+    etag = quote_etag(digest)
+    if encoding is not None:
+        etag = quote_etag("{}-{}".format(digest, encoding))
+    response = HttpResponse(
+        body, content_type="text/x-cross-domain-policy; charset=utf-8"
+    )
+    if compress:
+        patch_vary_headers(response, ("Accept-Encoding",))
+    if encoding is not None:
+        response["Content-Encoding"] = encoding
+    response["ETag"] = etag
+    if last_modified is not None:
+        response["Last-Modified"] = http_date(last_modified)
+    _patch_caching_headers(response, cache_control)
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified, response=response
+    )
+    backend = metrics.get_backend()
+    if backend is not None:
+        metrics.record_response(backend, request, digest, response)
+    return response
+
+
+def _shared_response(
+    request: HttpRequest,
+    store: shared.SharedPolicyStore,
+    name: str,
+    cache_control: Optional[Dict[str, Any]],
+    compress: Optional[bool],
+    compact: bool,
+) -> HttpResponse:
+    """
+    Builds the response for the policy ``name`` in ``store``. This is
+    shared by ``serve_shared()`` and ``aserve_shared()``.
+
+    """
+    return _stored_response(
+        request,
+        lambda encoding: store.get(name, compact, encoding),
+        "No shared policy named '{}'.".format(name),
+        cache_control,
+        compress,
+    )
+
+
+@policy_exempt
+def serve_shared(
+    request: HttpRequest,
+    store: shared.SharedPolicyStore,
+    name: str,
+    cache_control: Optional[Dict[str, Any]] = None,
+    compress: Optional[bool] = None,
+    compact: bool = False,
+) -> HttpResponse:
+    """
+    Serves the policy named ``name`` from a
+    ``flashpolicies.shared.SharedPolicyStore``, so that every worker
+    process serves the one copy of it the store maps into memory, and
+    picks up new versions published to the store.
+
+    **Required arguments:**
+
+    ``store``
+        The ``flashpolicies.shared.SharedPolicyStore`` to serve from.
+
+    ``name``
+        The name the policy was published under. If the store has no
+        policy of that name, a 404 is returned.
+
+    **Optional arguments:**
+
+    ``cache_control``, ``compress``, ``compact``
+        As accepted by ``serve()``. A compressed copy is only served
+        if the policy was published compressed.
+
+    """
+    return _shared_response(request, store, name, cache_control, compress, compact)
+
+
+#
+# Asynchronous versions of the views above, for use under ASGI. These
+# produce exactly the same responses as their synchronous
+# counterparts, and since serving a policy does no I/O, they never
+# block the event loop on anything but (cached) serialization.
+#
+
+
+@policy_exempt
+async def aserve(
+    request: HttpRequest,
+    policy: policies.Policy,
+    cache_control: Optional[Dict[str, Any]] = None,
+    compress: Optional[bool] = None,
+    compact: Optional[bool] = None,
+) -> HttpResponse:
+    """
+    Asynchronous version of ``serve()``, accepting the same arguments.
+
+    """
+    return _policy_response(request, policy, cache_control, compress, compact)
+
+
+@policy_exempt
+async def aallow_domains(
+    request: HttpRequest,
+    domains: Iterable[str],
+    cache_control: Optional[Dict[str, Any]] = None,
+    compress: Optional[bool] = None,
+    compact: Optional[bool] = None,
+) -> HttpResponse:
+    """
+    Asynchronous version of ``allow_domains()``, accepting the same
+    arguments.
+
+    """
+    return await aserve(
+        request, _build_policy(tuple(domains)), cache_control, compress, compact
+    )
+
+
+@policy_exempt
+async def ametapolicy(
+    request: HttpRequest,
+    permitted: str,
+    domains: Optional[Iterable[str]] = None,
+    cache_control: Optional[Dict[str, Any]] = None,
+    compress: Optional[bool] = None,
+    compact: Optional[bool] = None,
+) -> HttpResponse:
+    """
+    Asynchronous version of ``metapolicy()``, accepting the same
+    arguments.
+
+    """
+    if domains is None:
+        domains = []
+    return await aserve(
+        request,
+        _build_policy(tuple(domains), permitted),
+        cache_control,
+        compress,
+        compact,
+    )
+
+
+@policy_exempt
+async def ano_access(
+    request: HttpRequest,
+    cache_control: Optional[Dict[str, Any]] = None,
+    compress: Optional[bool] = None,
+    compact: Optional[bool] = None,
+) -> HttpResponse:
+    """
+    Asynchronous version of ``no_access()``, accepting the same
+    arguments.
+
+    """
+    return await ametapolicy(
+        request,
+        permitted=policies.SITE_CONTROL_NONE,
+        cache_control=cache_control,
+        compress=compress,
+        compact=compact,
+    )
+
+
+@policy_exempt
+async def aserve_by_host(
+    request: HttpRequest,
+    registry: hosts.HostPolicyRegistry,
+    cache_control: Optional[Dict[str, Any]] = None,
+    compress: Optional[bool] = None,
+    compact: Optional[bool] = None,
+) -> HttpResponse:
+    """
+    Asynchronous version of ``serve_by_host()``, accepting the same
+    arguments.
+
+    """
+    return await aserve(
+        request, _host_policy(request, registry), cache_control, compress, compact
+    )
+
+
+@policy_exempt
+async def aserve_shared(
+    request: HttpRequest,
+    store: shared.SharedPolicyStore,
+    name: str,
+    cache_control: Optional[Dict[str, Any]] = None,
+    compress: Optional[bool] = None,
+    compact: bool = False,
+) -> HttpResponse:
+    """
+    Asynchronous version of ``serve_shared()``, accepting the same
+    arguments.
 
     """
-    return metapolicy(request, permitted=policies.SITE_CONTROL_NONE)
+    return _shared_response(request, store, name, cache_control, compress, compact)
@@ -0,0 +1,47 @@
+"""
+URLs used by the test suite to exercise enforcing policies on
+requests.
+
+"""
+
+from django.http import HttpResponse
+from django.urls import path
+
+from flashpolicies import policies, views
+from flashpolicies.decorators import enforce_policy
+from flashpolicies.middleware import policy_exempt
+
+
+def make_enforced_policy():
+    policy = policies.Policy("media.example.com")
+    policy.allow_domain("*.example.org", secure=False)
+    policy.allow_headers("media.example.com", ["X-Custom-*"])
+    return policy
+
+
+def data(request):
+    return HttpResponse("data")
+
+
+@policy_exempt
+def exempt(request):
+    return HttpResponse("exempt")
+
+
+@enforce_policy(policies.Policy("api.example.com"))
+def decorated(request):
+    return HttpResponse("decorated")
+
+
+@enforce_policy(policies.Policy("api.example.com"))
+async def adecorated(request):
+    return HttpResponse("async decorated")
+
+
+urlpatterns = [
+    path("data", data),
+    path("exempt", exempt),
+    path("decorated", decorated),
+    path("async/decorated", adecorated),
+    path("crossdomain.xml", views.allow_domains, {"domains": ["api.example.com"]}),
+]
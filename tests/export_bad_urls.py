@@ -0,0 +1,12 @@
+"""
+A URLconf serving a policy from a path which cannot be exported to a
+file, used by the test suite.
+
+"""
+
+from django.urls import path
+
+from flashpolicies import views
+
+
+urlpatterns = [path("", views.no_access)]
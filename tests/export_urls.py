@@ -0,0 +1,41 @@
+"""
+URLs used by the test suite to exercise finding and exporting the
+policies served by a URLconf.
+
+"""
+
+from django.urls import include, path, re_path
+from django.views.decorators.cache import cache_control
+
+from flashpolicies import policies, views
+
+from .urls import host_registry
+
+
+nested = [
+    path("crossdomain.xml", views.allow_domains),
+    path("<str:name>.xml", views.no_access),
+]
+
+urlpatterns = [
+    path(
+        "crossdomain.xml",
+        views.metapolicy,
+        {"permitted": policies.SITE_CONTROL_ALL, "domains": ["media.example.com"]},
+    ),
+    re_path(
+        r"^crossdomain\.xml$",
+        views.no_access,
+    ),
+    re_path(
+        r"^policies/compact\.xml$",
+        cache_control(max_age=60)(views.serve),
+        {
+            "policy": policies.Policy("api.example.com"),
+            "compact": True,
+            "compress": True,
+        },
+    ),
+    path("media/", include(nested), {"domains": ["media.example.com"]}),
+    path("by-host.xml", views.serve_by_host, {"registry": host_registry}),
+]
@@ -0,0 +1,34 @@
+"""
+URLs used by the test suite to exercise preloading the policies
+served by a URLconf.
+
+"""
+
+from django.urls import path
+
+from flashpolicies import policies, views
+
+
+# Served from a path with a captured argument, so not found by
+# find_policies().
+PER_SITE_POLICY = policies.Policy("site.example.com")
+
+
+urlpatterns = [
+    path("default.xml", views.serve, {"policy": policies.Policy("media.example.com")}),
+    path(
+        "compressed.xml",
+        views.serve,
+        {
+            "policy": policies.Policy("api.example.com"),
+            "compact": True,
+            "compress": True,
+        },
+    ),
+    path(
+        "uncompressed.xml",
+        views.serve,
+        {"policy": policies.Policy("www.example.com"), "compress": False},
+    ),
+    path("<slug:site>/crossdomain.xml", views.serve, {"policy": PER_SITE_POLICY}),
+]
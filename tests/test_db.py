@@ -0,0 +1,412 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import DatabaseError, transaction
+from django.test import RequestFactory, TestCase
+
+from flashpolicies import policies
+from flashpolicies.db import cache as policy_cache
+from flashpolicies.db.models import (
+    AllowedDomain,
+    AllowedHeaders,
+    AllowedIdentity,
+    StoredPolicy,
+)
+from flashpolicies.db.views import serve_stored
+
+
+class StoredPolicyTestCase(TestCase):
+    """
+    Base class for tests of stored policies, which clears the policy
+    caches between tests.
+
+    """
+
+    fingerprint = "01:23:45:67:89:ab:cd:ef:01:23:45:67:89:ab:cd:ef:01:23:45:67"
+
+    def setUp(self):
+        cache.clear()
+        policy_cache._local.clear()
+
+    def create_policy(self, name="main"):
+        with self.captureOnCommitCallbacks(execute=True):
+            stored = StoredPolicy.objects.create(
+                name=name, site_control=policies.SITE_CONTROL_ALL
+            )
+            AllowedDomain.objects.create(
+                policy=stored, domain="media.example.com", to_ports="80, 8000-9000"
+            )
+            AllowedDomain.objects.create(
+                policy=stored, domain="api.example.com", secure=False
+            )
+            AllowedHeaders.objects.create(
+                policy=stored, domain="media.example.com", headers="SomeHeader,Other"
+            )
+            AllowedIdentity.objects.create(policy=stored, fingerprint=self.fingerprint)
+        return stored
+
+
+class StoredPolicyModelTests(StoredPolicyTestCase):
+    """
+    Tests the models which store policies.
+
+    """
+
+    def test_to_policy(self):
+        """
+        Tests that a stored policy builds the equivalent Policy.
+
+        """
+        expected = policies.Policy()
+        expected.allow_domain("media.example.com", to_ports=["80", "8000-9000"])
+        expected.allow_domain("api.example.com", secure=False)
+        expected.allow_headers("media.example.com", ["SomeHeader", "Other"])
+        expected.allow_identity(self.fingerprint)
+        expected.metapolicy(policies.SITE_CONTROL_ALL)
+        self.assertEqual(
+            self.create_policy().to_policy().serialize(), expected.serialize()
+        )
+
+    def test_str(self):
+        """
+        Tests the string representations of the models.
+
+        """
+        stored = self.create_policy()
+        self.assertEqual(str(stored), "main")
+        self.assertEqual(str(stored.domains.first()), "media.example.com")
+        self.assertEqual(str(stored.header_domains.first()), "media.example.com")
+        self.assertEqual(str(stored.identities.first()), self.fingerprint)
+
+
+class StoredPolicyCacheTests(StoredPolicyTestCase):
+    """
+    Tests the cache of stored policies.
+
+    """
+
+    def test_cached(self):
+        """
+        Tests that once cached, a policy is served without querying
+        the database, even by another process.
+
+        """
+        stored = self.create_policy()
+        with self.assertNumQueries(0):
+            cached = policy_cache.get_policy("main")
+        self.assertEqual(cached.bodies[None], stored.to_policy().serialize())
+        policy_cache._local.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(policy_cache.get_policy("main"), cached)
+
+    def test_cold_cache(self):
+        """
+        Tests that a policy missing from the cache is loaded from the
+        database and cached.
+
+        """
+        stored = self.create_policy()
+        cache.clear()
+        policy_cache._local.clear()
+        with self.assertNumQueries(4):
+            cached = policy_cache.get_policy("main")
+        self.assertEqual(cached.bodies[None], stored.to_policy().serialize())
+        with self.assertNumQueries(0):
+            policy_cache.get_policy("main")
+
+    def test_evicted_policy(self):
+        """
+        Tests that a policy whose version is cached, but whose content
+        has been evicted, is regenerated.
+
+        """
+        self.create_policy()
+        policy_cache._local.clear()
+        cache.delete(
+            policy_cache._policy_key("main", *cache.get("flashpolicies:version:main"))
+        )
+        self.assertIsNotNone(policy_cache.get_policy("main"))
+
+    def test_missing(self):
+        """
+        Tests that requesting a nonexistent policy queries the database
+        only once.
+
+        """
+        with self.assertNumQueries(1):
+            self.assertIsNone(policy_cache.get_policy("missing"))
+        with self.assertNumQueries(0):
+            self.assertIsNone(policy_cache.get_policy("missing"))
+
+    def test_invalidation(self):
+        """
+        Tests that changing any part of a stored policy regenerates the
+        cached copy.
+
+        """
+        stored = self.create_policy()
+
+        def make_compact():
+            stored.compact = True
+            stored.save()
+
+        changes = [
+            lambda: AllowedDomain.objects.create(
+                policy=stored, domain="www.example.com"
+            ),
+            lambda: stored.header_domains.first().delete(),
+            lambda: stored.identities.first().delete(),
+            make_compact,
+        ]
+        for change in changes:
+            before = policy_cache.get_policy("main").bodies[None]
+            with self.captureOnCommitCallbacks(execute=True):
+                change()
+            with self.assertNumQueries(0):
+                after = policy_cache.get_policy("main").bodies[None]
+            self.assertNotEqual(before, after)
+            self.assertEqual(after, stored.to_policy().serialize())
+
+    def test_old_versions_removed(self):
+        """
+        Tests that replacing a cached policy removes the old version.
+
+        """
+        stored = self.create_policy()
+        old_version = cache.get(policy_cache._version_key("main"))
+        with self.captureOnCommitCallbacks(execute=True):
+            AllowedDomain.objects.create(policy=stored, domain="www.example.com")
+        self.assertIsNone(cache.get(policy_cache._policy_key("main", *old_version)))
+
+    def test_delete(self):
+        """
+        Tests that deleting a stored policy removes it from the cache.
+
+        """
+        stored = self.create_policy()
+        with self.captureOnCommitCallbacks(execute=True):
+            stored.delete()
+        with self.assertNumQueries(0):
+            self.assertIsNone(policy_cache.get_policy("main"))
+
+    def test_rename(self):
+        """
+        Tests that renaming a stored policy updates both names.
+
+        """
+        stored = self.create_policy()
+        policy_cache.get_policy("main")
+        stored.name = "renamed"
+        with self.captureOnCommitCallbacks(execute=True):
+            stored.save()
+        with self.assertNumQueries(0):
+            self.assertIsNone(policy_cache.get_policy("main"))
+            self.assertIsNotNone(policy_cache.get_policy("renamed"))
+
+    def test_refreshed_once(self):
+        """
+        Tests that a policy is regenerated only once per transaction,
+        however many of its rules change.
+
+        """
+        stored = self.create_policy()
+        with mock.patch.object(
+            policy_cache, "refresh", wraps=policy_cache.refresh
+        ) as refresh:
+            with self.captureOnCommitCallbacks(execute=True):
+                for number in range(20):
+                    AllowedDomain.objects.create(
+                        policy=stored, domain="{}.example.com".format(number)
+                    )
+                stored.identities.all().delete()
+            refresh.assert_called_once_with("main")
+            self.assertEqual(
+                policy_cache.get_policy("main").bodies[None],
+                stored.to_policy().serialize(),
+            )
+            refresh.reset_mock()
+            with self.captureOnCommitCallbacks(execute=True):
+                stored.delete()
+            refresh.assert_called_once_with("main")
+            self.create_policy("other")
+            refresh.reset_mock()
+            with self.captureOnCommitCallbacks(execute=True):
+                StoredPolicy.objects.filter(name="other").delete()
+            refresh.assert_called_once_with("other")
+
+    def test_refresh_rolled_back(self):
+        """
+        Tests that changes made after a rolled-back savepoint still
+        regenerate the policy.
+
+        """
+        stored = self.create_policy()
+        with mock.patch.object(policy_cache, "refresh") as refresh:
+            with self.captureOnCommitCallbacks(execute=True):
+                try:
+                    with transaction.atomic():
+                        AllowedDomain.objects.create(
+                            policy=stored, domain="www.example.com"
+                        )
+                        raise DatabaseError
+                except DatabaseError:
+                    pass
+                stored.identities.all().delete()
+        refresh.assert_called_once_with("main")
+
+    def test_stampede_serves_stale(self):
+        """
+        Tests that while another process regenerates a policy, the
+        version this process already has is served.
+
+        """
+        self.create_policy()
+        stale = policy_cache.get_policy("main")
+        cache.delete(policy_cache._version_key("main"))
+        cache.add(policy_cache._lock_key("main"), 1)
+        with self.assertNumQueries(0):
+            self.assertIs(policy_cache.get_policy("main"), stale)
+
+    def test_stampede_waits(self):
+        """
+        Tests that while another process regenerates a policy, a
+        process without any version waits for the new one.
+
+        """
+        self.create_policy()
+        version = cache.get(policy_cache._version_key("main"))
+        cache.delete(policy_cache._version_key("main"))
+        policy_cache._local.clear()
+        cache.add(policy_cache._lock_key("main"), 1)
+
+        def regenerated(seconds):
+            cache.set(policy_cache._version_key("main"), version)
+
+        with mock.patch("time.sleep", regenerated), self.assertNumQueries(0):
+            self.assertIsNotNone(policy_cache.get_policy("main"))
+
+    def test_stampede_gives_up(self):
+        """
+        Tests that if regeneration by another process takes too long,
+        the policy is loaded anyway.
+
+        """
+        self.create_policy()
+        cache.clear()
+        policy_cache._local.clear()
+        cache.add(policy_cache._lock_key("main"), 1)
+        with mock.patch.object(policy_cache, "LOCK_WAIT", 0.1):
+            self.assertIsNotNone(policy_cache.get_policy("main"))
+            self.assertIsNotNone(policy_cache.get_policy("main", compact=True))
+        # The process holding the lock may be storing a newer version.
+        self.assertIsNone(cache.get(policy_cache._version_key("main")))
+        StoredPolicy.objects.filter(name="main").delete()
+        with mock.patch.object(policy_cache, "LOCK_WAIT", 0.1):
+            self.assertIsNone(policy_cache.get_policy("main"))
+
+    def test_bodies(self):
+        """
+        Tests that the cache holds each policy serialized and
+        compressed, rather than the policy itself.
+
+        """
+        stored = self.create_policy()
+        version = cache.get(policy_cache._version_key("main"))
+        cached = cache.get(policy_cache._policy_key("main", *version))
+        self.assertIsInstance(cached, policy_cache.CachedPolicy)
+        policy = stored.to_policy()
+        self.assertEqual(cached.digest, policy.digest())
+        self.assertEqual(cached.bodies[None], policy.serialize())
+        for encoding in policies.COMPRESSORS:
+            self.assertEqual(cached.bodies[encoding], policy.compress(encoding))
+
+    def test_compact(self):
+        """
+        Tests that the form of a policy other than its default is
+        cached once requested.
+
+        """
+        policy = self.create_policy().to_policy()
+        with self.assertNumQueries(4):
+            cached = policy_cache.get_policy("main", compact=True)
+        self.assertEqual(cached.bodies[None], policy.serialize(True))
+        with self.assertNumQueries(0):
+            self.assertEqual(policy_cache.get_policy("main", compact=True), cached)
+            self.assertEqual(
+                policy_cache.get_policy("main").bodies[None], policy.serialize(False)
+            )
+        # A cold cache also gets the default form.
+        cache.clear()
+        policy_cache._local.clear()
+        policy_cache.get_policy("main", compact=True)
+        with self.assertNumQueries(0):
+            self.assertIsNotNone(policy_cache.get_policy("main"))
+
+    def test_refresh_waits(self):
+        """
+        Tests that a refresh waits for any refresh already in progress,
+        and reads the database only once it has finished, so that the
+        last refresh always stores the latest version.
+
+        """
+        self.create_policy()
+        cache.add(policy_cache._lock_key("main"), 1)
+        events = []
+        load_policy = policy_cache.load_policy
+
+        def finished(seconds):
+            events.append("waited")
+            cache.delete(policy_cache._lock_key("main"))
+
+        def load(name):
+            events.append("loaded")
+            return load_policy(name)
+
+        with mock.patch("time.sleep", finished), mock.patch.object(
+            policy_cache, "load_policy", load
+        ):
+            self.assertIsNotNone(policy_cache.refresh("main"))
+        self.assertEqual(events, ["waited", "loaded"])
+        self.assertIsNone(cache.get(policy_cache._lock_key("main")))
+
+
+class ServeStoredTests(StoredPolicyTestCase):
+    """
+    Tests the view which serves stored policies.
+
+    """
+
+    def test_serve_stored(self):
+        """
+        Tests that a stored policy is served from the cache, and that a
+        nonexistent one gets a 404.
+
+        """
+        stored = self.create_policy()
+        with self.assertNumQueries(0):
+            response = self.client.get("/crossdomain-stored.xml")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, stored.to_policy().serialize())
+        self.assertEqual(response["ETag"], '"{}"'.format(stored.to_policy().digest()))
+        self.assertTrue(response.has_header("Last-Modified"))
+        self.assertEqual(
+            self.client.get(
+                "/crossdomain-stored.xml", HTTP_IF_NONE_MATCH=response["ETag"]
+            ).status_code,
+            304,
+        )
+        self.assertEqual(
+            self.client.get("/crossdomain-stored-missing.xml").status_code, 404
+        )
+
+    def test_serve_stored_compressed(self):
+        """
+        Tests that a stored policy is served compressed from the cache.
+
+        """
+        stored = self.create_policy()
+        request = RequestFactory().get("/crossdomain.xml", HTTP_ACCEPT_ENCODING="gzip")
+        with self.assertNumQueries(0):
+            response = serve_stored(request, "main", compress=True)
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(response.content, stored.to_policy().compress("gzip"))
@@ -0,0 +1,215 @@
+import io
+import json
+import os
+import tempfile
+from unittest import mock
+
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase, override_settings
+
+from flashpolicies import policies, views
+from flashpolicies.discovery import find_policies
+
+
+@override_settings(ROOT_URLCONF="tests.export_urls")
+class FindPoliciesTests(SimpleTestCase):
+    """
+    Tests finding the policies served by a URLconf.
+
+    """
+
+    def test_find_policies(self):
+        """
+        Tests that each static path routed to a policy view is found,
+        with the policy it serves.
+
+        """
+        found = find_policies()
+        self.assertEqual(
+            [routed.path for routed in found],
+            ["crossdomain.xml", "policies/compact.xml", "media/crossdomain.xml"],
+        )
+        metapolicy = policies.Policy("media.example.com")
+        metapolicy.metapolicy(policies.SITE_CONTROL_ALL)
+        self.assertEqual(found[0].policy.serialize(), metapolicy.serialize())
+        self.assertEqual(
+            found[1].policy.serialize(), policies.Policy("api.example.com").serialize()
+        )
+        self.assertIs(found[1].compact, True)
+        self.assertIs(found[1].compress, True)
+        self.assertIsNone(found[2].compact)
+        self.assertIsNone(found[2].compress)
+        self.assertEqual(
+            found[2].policy.serialize(),
+            policies.Policy("media.example.com").serialize(),
+        )
+
+    @override_settings(ROOT_URLCONF="tests.urls")
+    def test_same_as_served(self):
+        """
+        Tests that the policies found are those the views serve.
+
+        """
+        for routed in find_policies():
+            response = self.client.get("/" + routed.path)
+            self.assertEqual(
+                response.content, routed.policy.serialize(routed.compact), routed.path
+            )
+
+    def test_builders(self):
+        """
+        Tests that every view in ``flashpolicies.views`` which serves a
+        fixed policy can be exported.
+
+        """
+        from flashpolicies.discovery import BUILDERS
+
+        for name in dir(views):
+            view = getattr(views, name)
+            if callable(view) and getattr(view, "__module__", "") == views.__name__:
+                if not name.startswith("_") and not name.endswith(
+                    ("by_host", "shared")
+                ):
+                    self.assertIn(view, BUILDERS, name)
+
+
+class ExportPoliciesCommandTests(SimpleTestCase):
+    """
+    Tests the management command which exports policies to files.
+
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def export(self, *args, **kwargs):
+        stdout = io.StringIO()
+        call_command(
+            "exportpolicies",
+            self.directory.name,
+            *args,
+            urlconf="tests.export_urls",
+            stdout=stdout,
+            **kwargs,
+        )
+        return stdout.getvalue()
+
+    def read(self, name):
+        with open(os.path.join(self.directory.name, name), "rb") as f:
+            return f.read()
+
+    def manifest(self):
+        return json.loads(self.read("manifest.json").decode("utf-8"))
+
+    def test_export(self):
+        """
+        Tests that each policy is written to its path, and recorded in
+        the manifest.
+
+        """
+        output = self.export()
+        self.assertIn("Exported 3 files (3 changed)", output)
+        for routed in find_policies("tests.export_urls"):
+            self.assertEqual(
+                self.read(routed.path), routed.policy.serialize(routed.compact)
+            )
+        self.assertEqual(
+            sorted(self.manifest()),
+            ["crossdomain.xml", "media/crossdomain.xml", "policies/compact.xml"],
+        )
+        self.assertEqual(
+            self.manifest()["crossdomain.xml"],
+            find_policies("tests.export_urls")[0].policy.digest(),
+        )
+        self.assertFalse(
+            [
+                name
+                for name in os.listdir(self.directory.name)
+                if name.startswith(".tmp-")
+            ]
+        )
+        mode = os.stat(os.path.join(self.directory.name, "crossdomain.xml")).st_mode
+        self.assertTrue(mode & 0o044)
+
+    def test_compress(self):
+        """
+        Tests that compressed copies are written for each supported
+        encoding.
+
+        """
+        self.export("--compress")
+        routed = find_policies("tests.export_urls")[0]
+        self.assertEqual(
+            self.read("crossdomain.xml.gz"), routed.policy.compress("gzip")
+        )
+        self.assertEqual(self.read("crossdomain.xml.br"), routed.policy.compress("br"))
+        self.assertIn("crossdomain.xml.br", self.manifest())
+
+    def test_incremental(self):
+        """
+        Tests that unchanged files are not rewritten, and that files no
+        longer exported are removed.
+
+        """
+        self.export("--compress")
+        path = os.path.join(self.directory.name, "crossdomain.xml")
+        os.utime(path, (0, 0))
+        with open(os.path.join(self.directory.name, "policies", "compact.xml"), "wb"):
+            pass
+        os.unlink(os.path.join(self.directory.name, "media", "crossdomain.xml.br"))
+        output = self.export("--compress", verbosity=2)
+        self.assertIn("(2 changed)", output)
+        self.assertIn("Wrote policies/compact.xml", output)
+        self.assertIn("Wrote media/crossdomain.xml.br", output)
+        self.assertEqual(os.stat(path).st_mtime, 0)
+        output = self.export(verbosity=2)
+        self.assertIn("Removed crossdomain.xml.gz", output)
+        self.assertNotIn("crossdomain.xml.gz", self.manifest())
+        self.assertFalse(
+            os.path.exists(os.path.join(self.directory.name, "crossdomain.xml.gz"))
+        )
+        os.unlink(os.path.join(self.directory.name, "crossdomain.xml"))
+        with open(os.path.join(self.directory.name, "manifest.json"), "w") as f:
+            json.dump({"crossdomain.xml": "", "old.xml": ""}, f)
+        self.assertIn("(1 changed)", self.export())
+
+    def test_failed_write(self):
+        """
+        Tests that a failed write leaves the previous file in place,
+        and no temporary file behind.
+
+        """
+        self.export()
+        before = self.read("crossdomain.xml")
+        os.unlink(os.path.join(self.directory.name, "manifest.json"))
+        with open(os.path.join(self.directory.name, "crossdomain.xml"), "wb"):
+            pass
+        with mock.patch("os.replace", side_effect=OSError):
+            with self.assertRaises(OSError):
+                self.export()
+        self.assertEqual(self.read("crossdomain.xml"), b"")
+        self.assertEqual(os.listdir(self.directory.name).count("manifest.json"), 0)
+        self.assertFalse(
+            [
+                name
+                for name in os.listdir(self.directory.name)
+                if name.startswith(".tmp-")
+            ]
+        )
+        self.export()
+        self.assertEqual(self.read("crossdomain.xml"), before)
+
+    def test_bad_path(self):
+        """
+        Tests that a policy whose path cannot be written as a file is
+        an error.
+
+        """
+        with self.assertRaises(CommandError):
+            call_command(
+                "exportpolicies",
+                self.directory.name,
+                urlconf="tests.export_bad_urls",
+                stdout=io.StringIO(),
+            )
@@ -0,0 +1,63 @@
+import os
+import tempfile
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from flashpolicies.files import write_atomic
+
+
+class WriteAtomicTests(SimpleTestCase):
+    """
+    Tests writing files atomically.
+
+    """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def test_write(self):
+        """
+        Tests that the chunks are written in order, creating the
+        directory, with permissions following the umask.
+
+        """
+        path = os.path.join(self.directory, "nested", "policy.xml")
+        umask = os.umask(0o027)
+        try:
+            write_atomic(path, b"<cross-domain-policy>", b"</cross-domain-policy>")
+        finally:
+            os.umask(umask)
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), b"<cross-domain-policy></cross-domain-policy>")
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o640)
+
+    def test_relative_path(self):
+        """
+        Tests that a path in the current directory can be written.
+
+        """
+        cwd = os.getcwd()
+        os.chdir(self.directory)
+        try:
+            write_atomic("policy.xml", b"policy")
+        finally:
+            os.chdir(cwd)
+        self.assertEqual(os.listdir(self.directory), ["policy.xml"])
+
+    def test_failed_write(self):
+        """
+        Tests that a failed write leaves the old file in place, and no
+        temporary file behind.
+
+        """
+        path = os.path.join(self.directory, "policy.xml")
+        write_atomic(path, b"old")
+        with mock.patch("os.replace", side_effect=OSError):
+            with self.assertRaises(OSError):
+                write_atomic(path, b"new")
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), b"old")
+        self.assertEqual(os.listdir(self.directory), ["policy.xml"])
@@ -0,0 +1,70 @@
+from django.test import SimpleTestCase
+
+from flashpolicies import hosts, policies
+
+
+class HostPolicyRegistryTests(SimpleTestCase):
+    """
+    Tests the registry of per-host policies.
+
+    """
+
+    def setUp(self):
+        self.exact = policies.Policy("media.example.com")
+        self.wildcard = policies.Policy("api.example.com")
+        self.nested = policies.Policy("static.example.com")
+        self.registry = hosts.HostPolicyRegistry(
+            {
+                "Example.com": self.exact,
+                "*.example.com": self.wildcard,
+                "*.eu.example.com": self.nested,
+            }
+        )
+
+    def test_exact(self):
+        """
+        Tests that exactly-registered hosts are found, ignoring case,
+        port and a trailing dot.
+
+        """
+        for host in ("example.com", "EXAMPLE.com:8000", "example.com."):
+            self.assertIs(self.registry.lookup(host), self.exact)
+
+    def test_wildcard(self):
+        """
+        Tests that wildcard suffixes match subdomains, preferring the
+        longest matching suffix.
+
+        """
+        self.assertIs(self.registry.lookup("www.example.com"), self.wildcard)
+        self.assertIs(self.registry.lookup("a.b.example.com:443"), self.wildcard)
+        self.assertIs(self.registry.lookup("www.eu.example.com"), self.nested)
+        self.assertIs(self.registry.lookup("eu.example.com"), self.wildcard)
+
+    def test_no_match(self):
+        """
+        Tests that unregistered hosts get the default policy, if any.
+
+        """
+        for host in ("example.org", "notexample.com", "[::1]:8000", "localhost"):
+            self.assertIsNone(self.registry.lookup(host))
+        default = policies.Policy()
+        registry = hosts.HostPolicyRegistry(default=default)
+        self.assertIs(registry.lookup("www.example.com"), default)
+
+    def test_ipv6(self):
+        """
+        Tests that IPv6 literal hosts can be registered and found.
+
+        """
+        self.registry.register("[::1]", self.exact)
+        self.assertIs(self.registry.lookup("[::1]:8000"), self.exact)
+
+    def test_preserialized(self):
+        """
+        Tests that policies are serialized when registered.
+
+        """
+        policy = policies.Policy("media.example.com")
+        hosts.HostPolicyRegistry({"example.com": policy}, default=policy)
+        self.assertIn("serialize:False", policy._cache)
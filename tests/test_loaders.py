@@ -0,0 +1,294 @@
+import json
+import os
+import tempfile
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from flashpolicies import loaders, policies
+
+
+FINGERPRINT = "01:23:45:67:89:ab:cd:ef:01:23:45:67:89:ab:cd:ef:01:23:45:67"
+
+JSON_POLICY = {
+    "site_control": "all",
+    "domains": [
+        "media.example.com",
+        {"domain": "api.example.com", "to_ports": ["80", "8000-9000"]},
+        {"domain": "*.example.org", "secure": False},
+    ],
+    "headers": [{"domain": "media.example.com", "headers": ["SomeHeader"]}],
+    "identities": [FINGERPRINT, {"fingerprint": FINGERPRINT}],
+}
+
+TOML_POLICY = """
+site_control = "all"
+domains = [
+    "media.example.com",
+    {domain = "api.example.com", to_ports = ["80", "8000-9000"]},
+    {domain = "*.example.org", secure = false},
+]
+headers = [{domain = "media.example.com", headers = ["SomeHeader"]}]
+identities = ["%s"]
+""" % (FINGERPRINT)
+
+YAML_POLICY = """
+site_control: all
+domains:
+  - media.example.com
+  - domain: api.example.com
+    to_ports: ["80", "8000-9000"]
+  - domain: "*.example.org"
+    secure: false
+headers:
+  - domain: media.example.com
+    headers: [SomeHeader]
+identities:
+  - "%s"
+""" % (FINGERPRINT)
+
+
+def make_expected_policy():
+    policy = policies.Policy("media.example.com")
+    policy.allow_domain("api.example.com", to_ports=["80", "8000-9000"])
+    policy.allow_domain("*.example.org", secure=False)
+    policy.allow_headers("media.example.com", ["SomeHeader"])
+    policy.allow_identity(FINGERPRINT)
+    policy.metapolicy(policies.SITE_CONTROL_ALL)
+    return policy
+
+
+class LoaderTestCase(SimpleTestCase):
+    """
+    Base class for tests of loading policy files, which provides a
+    temporary directory to write them to.
+
+    """
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.directory = temp_dir.name
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+        return path
+
+
+class LoadTests(LoaderTestCase):
+    """
+    Tests loading policies from each supported format.
+
+    """
+
+    def test_formats(self):
+        """
+        Tests that each structured format builds the same policy.
+
+        """
+        expected = make_expected_policy().serialize()
+        for name, content in (
+            ("policy.json", json.dumps(JSON_POLICY)),
+            ("policy.toml", TOML_POLICY),
+            ("policy.yaml", YAML_POLICY),
+            ("policy.YML", YAML_POLICY),
+        ):
+            with self.subTest(name=name):
+                self.assertEqual(
+                    loaders.load(self.write(name, content)).serialize(), expected
+                )
+
+    def test_text(self):
+        """
+        Tests that plain-text files are read as a list of domains.
+
+        """
+        path = self.write(
+            "partners.txt",
+            "# Partners\nmedia.example.com\n\n  api.example.com  # API\n",
+        )
+        self.assertEqual(
+            loaders.load(path).serialize(),
+            policies.Policy("media.example.com", "api.example.com").serialize(),
+        )
+        self.assertEqual(
+            loaders.load(self.write("policy.conf", "media.example.com")).serialize(),
+            policies.Policy("media.example.com").serialize(),
+        )
+
+    def test_explicit_format(self):
+        """
+        Tests that the format can be given explicitly.
+
+        """
+        path = self.write("policy", json.dumps({"domains": ["media.example.com"]}))
+        self.assertEqual(
+            loaders.load(path, format="json").serialize(),
+            policies.Policy("media.example.com").serialize(),
+        )
+
+    def test_compact(self):
+        """
+        Tests that policy files can choose compact serialization.
+
+        """
+        path = self.write("policy.json", json.dumps({"compact": True}))
+        self.assertTrue(loaders.load(path).compact)
+
+    def test_no_access(self):
+        """
+        Tests that a policy file may forbid all access, but not while
+        also allowing some.
+
+        """
+        path = self.write("policy.json", json.dumps({"site_control": "none"}))
+        self.assertEqual(loaders.load(path).site_control, policies.SITE_CONTROL_NONE)
+        path = self.write(
+            "policy.json",
+            json.dumps({"site_control": "none", "domains": ["media.example.com"]}),
+        )
+        with self.assertRaisesMessage(TypeError, policies.BAD_POLICY):
+            loaders.load(path)
+
+    def test_invalid(self):
+        """
+        Tests that malformed policy files raise ``TypeError``.
+
+        """
+        for config in (
+            [],
+            {"domain": ["media.example.com"]},
+            {"domains": [1]},
+            {"domains": [{"to_ports": ["80"]}]},
+            {"headers": ["media.example.com"]},
+            {"identities": [{"domain": "media.example.com"}]},
+            {"site_control": "sometimes"},
+        ):
+            with self.subTest(config=config):
+                with self.assertRaises(TypeError):
+                    loaders.parse(json.dumps(config).encode("utf-8"), "json")
+        with self.assertRaises(TypeError):
+            loaders.parse(b"", "ini")
+
+    def test_invalid_values(self):
+        """
+        Tests that values of the wrong type, which would otherwise be
+        misread, and unknown rule keys raise ``TypeError``.
+
+        """
+        for config in (
+            {"domains": [{"domain": "media.example.com", "to_ports": "843"}]},
+            {"domains": [{"domain": "media.example.com", "to_ports": 843}]},
+            {"domains": [{"domain": "media.example.com", "to_ports": [843]}]},
+            {"domains": [{"domain": "media.example.com", "secure": "false"}]},
+            {"domains": [{"domain": "media.example.com", "to-ports": ["843"]}]},
+            {"headers": [{"domain": "media.example.com", "headers": "X-Foo"}]},
+            {
+                "headers": [
+                    {"domain": "media.example.com", "headers": ["X-Foo"], "secure": 0}
+                ]
+            },
+            {"identities": [{"fingerprint": FINGERPRINT, "secure": True}]},
+            {"domains": "media.example.com"},
+            {"compact": "false"},
+        ):
+            with self.subTest(config=config):
+                with self.assertRaisesMessage(TypeError, "Invalid"):
+                    loaders.parse(json.dumps(config).encode("utf-8"), "json")
+
+
+class LoaderCacheTests(LoaderTestCase):
+    """
+    Tests the on-disk cache of loaded policies.
+
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.cache_dir = os.path.join(self.directory, "cache")
+        self.path = self.write("policy.json", json.dumps(JSON_POLICY))
+
+    def cache_files(self):
+        return sorted(os.listdir(self.cache_dir))
+
+    def test_cached(self):
+        """
+        Tests that a cached policy is loaded without parsing the file,
+        already serialized.
+
+        """
+        policy = loaders.load(self.path, cache_dir=self.cache_dir)
+        self.assertEqual(len(self.cache_files()), 1)
+        with mock.patch.object(loaders, "parse") as parse, mock.patch.object(
+            policies.Policy, "_iter_xml"
+        ) as iter_xml:
+            cached = loaders.load(self.path, cache_dir=self.cache_dir)
+            self.assertEqual(cached.serialize(), policy.serialize())
+            self.assertEqual(cached.digest(), policy.digest())
+        parse.assert_not_called()
+        iter_xml.assert_not_called()
+
+    def test_changed_file(self):
+        """
+        Tests that changing the file invalidates the cached policy.
+
+        """
+        loaders.load(self.path, cache_dir=self.cache_dir)
+        self.write("policy.json", json.dumps({"domains": ["media.example.com"]}))
+        self.assertEqual(
+            loaders.load(self.path, cache_dir=self.cache_dir).serialize(),
+            policies.Policy("media.example.com").serialize(),
+        )
+        self.assertEqual(len(self.cache_files()), 2)
+
+    @override_settings(FLASHPOLICIES_LOADER_CACHE_DIR=None)
+    def test_setting(self):
+        """
+        Tests that the cache directory can be set in settings, and
+        that there is no cache by default.
+
+        """
+        loaders.load(self.path)
+        self.assertFalse(os.path.exists(self.cache_dir))
+        with self.settings(FLASHPOLICIES_LOADER_CACHE_DIR=self.cache_dir):
+            loaders.load(self.path)
+        self.assertEqual(len(self.cache_files()), 1)
+        with mock.patch.object(loaders, "settings", configured=False):
+            loaders.load(self.path)
+
+    def test_damaged_cache(self):
+        """
+        Tests that a damaged or foreign cache file is replaced.
+
+        """
+        loaders.load(self.path, cache_dir=self.cache_dir)
+        (name,) = self.cache_files()
+        for content in (b"damaged", b"\x80\x04N."):
+            with open(os.path.join(self.cache_dir, name), "wb") as f:
+                f.write(content)
+            self.assertEqual(
+                loaders.load(self.path, cache_dir=self.cache_dir).serialize(),
+                make_expected_policy().serialize(),
+            )
+            self.assertIsInstance(
+                loaders._read_cached(os.path.join(self.cache_dir, name)),
+                policies.Policy,
+            )
+
+    def test_unwritable_cache(self):
+        """
+        Tests that failing to write the cache does not prevent loading.
+
+        """
+        with open(self.cache_dir, "w"):
+            pass
+        self.assertEqual(
+            loaders.load(self.path, cache_dir=self.cache_dir).serialize(),
+            make_expected_policy().serialize(),
+        )
+        os.unlink(self.cache_dir)
+        with mock.patch("os.replace", side_effect=OSError):
+            loaders.load(self.path, cache_dir=self.cache_dir)
+        self.assertEqual(self.cache_files(), [])
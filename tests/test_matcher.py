@@ -0,0 +1,158 @@
+from django.test import SimpleTestCase
+
+from flashpolicies import matcher, policies
+
+
+class MatcherTests(SimpleTestCase):
+    """
+    Tests evaluating requests against policies.
+
+    """
+
+    def test_exact_domains(self):
+        """
+        Tests that exact domains match only themselves, ignoring case
+        and trailing dots.
+
+        """
+        policy = policies.Policy("media.example.com", "192.0.2.1")
+        self.assertTrue(policy.allows("media.example.com"))
+        self.assertTrue(policy.allows("Media.Example.COM."))
+        self.assertTrue(policy.allows("192.0.2.1"))
+        for domain in (
+            "example.com",
+            "api.example.com",
+            "www.media.example.com",
+            "media.example.org",
+            "192.0.2.10",
+            "",
+        ):
+            with self.subTest(domain=domain):
+                self.assertFalse(policy.allows(domain))
+
+    def test_wildcard_domains(self):
+        """
+        Tests that wildcards match the domain and all of its
+        subdomains.
+
+        """
+        policy = policies.Policy("*.example.com")
+        for domain in ("example.com", "media.example.com", "a.b.example.com"):
+            with self.subTest(domain=domain):
+                self.assertTrue(policy.allows(domain))
+        for domain in ("example.org", "badexample.com", "com"):
+            with self.subTest(domain=domain):
+                self.assertFalse(policy.allows(domain))
+        policy = policies.Policy("*")
+        self.assertTrue(policy.allows("anything.example.org"))
+
+    def test_ports(self):
+        """
+        Tests that ports are checked against the rules' ``to_ports``.
+
+        """
+        policy = policies.Policy()
+        policy.allow_domain("media.example.com", to_ports=["80", "8000-9000", "x"])
+        policy.allow_domain("*.example.com", to_ports=["443"])
+        policy.allow_domain("api.example.com")
+        policy.allow_domain("*.example.org", to_ports=["*"])
+        self.assertTrue(policy.allows("media.example.com"))
+        for port in (80, 443, 8000, 8500, 9000):
+            with self.subTest(port=port):
+                self.assertTrue(policy.allows("media.example.com", port))
+        for port in (0, 79, 81, 7999, 9001):
+            with self.subTest(port=port):
+                self.assertFalse(policy.allows("media.example.com", port))
+        self.assertTrue(policy.allows("api.example.com", 443))
+        self.assertFalse(policy.allows("api.example.com", 80))
+        self.assertTrue(policy.allows("www.example.org", 12345))
+
+    def test_port_ranges(self):
+        """
+        Tests that port ranges are merged into disjoint, sorted ranges.
+
+        """
+        self.assertEqual(
+            matcher.port_ranges(("9000-9100", "80", "81-90", "8000-9050", "bad")),
+            ((80, 8000), (90, 9100)),
+        )
+        self.assertFalse(matcher.port_allowed(None, 80))
+        self.assertFalse(matcher.port_allowed(("bad",), 80))
+
+    def test_secure(self):
+        """
+        Tests that content not served via HTTPS is allowed only by
+        rules with ``secure=False``.
+
+        """
+        policy = policies.Policy("media.example.com")
+        policy.allow_domain("*.example.org", secure=False)
+        self.assertTrue(policy.allows("media.example.com"))
+        self.assertFalse(policy.allows("media.example.com", secure=False))
+        self.assertTrue(policy.allows("media.example.org", secure=False))
+        policy.allow_domain("*.example.com", secure=False)
+        self.assertTrue(policy.allows("media.example.com", secure=False))
+
+    def test_headers(self):
+        """
+        Tests that headers are checked against the rules of every
+        matching domain, ignoring case.
+
+        """
+        policy = policies.Policy()
+        policy.allow_headers("media.example.com", ["SOAPAction"])
+        policy.allow_headers("*.example.com", ["X-Custom-*"], secure=False)
+        policy.allow_headers("*.example.org", ["*"])
+        self.assertTrue(policy.allows_headers("media.example.com", ["soapaction"]))
+        self.assertTrue(
+            policy.allows_headers("media.example.com", ["SOAPAction", "X-Custom-A"])
+        )
+        self.assertFalse(
+            policy.allows_headers("media.example.com", ["SOAPAction", "X-Other"])
+        )
+        self.assertFalse(policy.allows_headers("api.example.com", ["SOAPAction"]))
+        self.assertTrue(
+            policy.allows_headers("api.example.com", ["X-Custom-A"], secure=False)
+        )
+        self.assertFalse(
+            policy.allows_headers("media.example.com", ["SOAPAction"], secure=False)
+        )
+        self.assertTrue(policy.allows_headers("www.example.org", ["Anything"]))
+        self.assertFalse(policy.allows_headers("example.net", ["Anything"]))
+
+    def test_dictionary_rules(self):
+        """
+        Tests that rules assigned by hand as dictionaries are matched
+        like rule objects.
+
+        """
+        policy = policies.Policy()
+        policy.domains["media.example.com"] = {"to_ports": ["80"], "secure": False}
+        policy.header_domains["media.example.com"] = {
+            "headers": ["SOAPAction"],
+            "secure": True,
+        }
+        policy.invalidate()
+        self.assertTrue(policy.allows("media.example.com", 80, secure=False))
+        self.assertFalse(policy.allows("media.example.com", 81))
+        self.assertTrue(policy.allows_headers("media.example.com", ["soapaction"]))
+        self.assertFalse(
+            policy.allows_headers("media.example.com", ["SOAPAction"], secure=False)
+        )
+
+    def test_cached(self):
+        """
+        Tests that the compiled matcher is cached until the policy
+        changes.
+
+        """
+        policy = policies.Policy("media.example.com")
+        compiled = policy.matcher()
+        self.assertIs(policy.matcher(), compiled)
+        self.assertFalse(policy.allows("api.example.com"))
+        policy.allow_domain("api.example.com")
+        self.assertIsNot(policy.matcher(), compiled)
+        self.assertTrue(policy.allows("api.example.com"))
+        frozen = policy.freeze()
+        self.assertTrue(frozen.allows("api.example.com"))
+        self.assertIs(frozen.matcher(), frozen.matcher())
@@ -0,0 +1,219 @@
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from django.urls import resolve
+
+from flashpolicies import metrics, policies, views
+
+from .urls import host_registry, make_test_policy
+
+
+PROMETHEUS = "flashpolicies.metrics.PrometheusBackend"
+STATSD = "flashpolicies.metrics.StatsdBackend"
+
+
+class MetricsTests(SimpleTestCase):
+    """
+    Tests instrumentation of policy serving.
+
+    """
+
+    def serve(self, policy, **kwargs):
+        request = RequestFactory().get("/crossdomain.xml", **kwargs)
+        return views.serve(request, policy, compress=True)
+
+    def test_disabled(self):
+        """
+        Tests that there is no backend unless one is configured.
+
+        """
+        self.assertIsNone(metrics.get_backend())
+        self.assertEqual(
+            self.serve(policies.Policy("media.example.com")).status_code, 200
+        )
+
+    @override_settings(FLASHPOLICIES_METRICS=PROMETHEUS)
+    def test_backend_setting(self):
+        """
+        Tests that one backend is shared, until the setting changes.
+
+        """
+        backend = metrics.get_backend()
+        self.assertIsInstance(backend, metrics.PrometheusBackend)
+        self.assertIs(metrics.get_backend(), backend)
+        with self.settings(FLASHPOLICIES_METRICS=STATSD):
+            self.assertIsInstance(metrics.get_backend(), metrics.StatsdBackend)
+        self.assertIsNot(metrics.get_backend(), backend)
+
+    @override_settings(FLASHPOLICIES_METRICS=PROMETHEUS)
+    def test_serving(self):
+        """
+        Tests that serving records counts, bytes, cache hits and
+        misses, and serialization times.
+
+        """
+        backend = metrics.get_backend()
+        policy = policies.Policy("media.example.com")
+        first = self.serve(policy)
+        second = self.serve(policy)
+        encoded = self.serve(policy, HTTP_ACCEPT_ENCODING="gzip")
+        not_modified = self.serve(policy, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(not_modified.status_code, 304)
+        # Requests not routed through the URLconf have no route.
+        labels = (("policy", policy.digest()[:12]), ("route", ""))
+        self.assertEqual(
+            backend.counters,
+            {
+                (
+                    "flashpolicies_served_total",
+                    labels + (("status", "200"),),
+                ): 3,
+                (
+                    "flashpolicies_served_total",
+                    labels + (("status", "304"),),
+                ): 1,
+                ("flashpolicies_bytes_sent_total", labels): len(first.content)
+                + len(second.content)
+                + len(encoded.content),
+                ("flashpolicies_cache_misses_total", labels): 2,
+                ("flashpolicies_cache_hits_total", labels): 2,
+            },
+        )
+        counts, total = backend.histograms[("flashpolicies_serialize_seconds", labels)]
+        self.assertEqual(sum(counts), 2)
+        self.assertGreater(total, 0)
+
+    @override_settings(FLASHPOLICIES_METRICS=PROMETHEUS)
+    def test_labels(self):
+        """
+        Tests that metrics are labelled by URL pattern rather than by
+        path, and by policy, including for policies chosen by host.
+
+        """
+        backend = metrics.get_backend()
+        for site in ("a", "b", "c"):
+            self.client.get("/sites/{}/crossdomain.xml".format(site))
+        policy = make_test_policy()
+        labels = (
+            ("policy", policy.digest()[:12]),
+            ("route", resolve("/sites/a/crossdomain.xml").route),
+        )
+        self.assertEqual(
+            backend.counters[
+                ("flashpolicies_served_total", labels + (("status", "200"),))
+            ],
+            3,
+        )
+        with self.settings(ALLOWED_HOSTS=["*"]):
+            for host in ("media.example.com", "www.example.org"):
+                self.client.get("/crossdomain-by-host.xml", HTTP_HOST=host)
+        for host in ("media.example.com", "www.example.org"):
+            labels = (
+                ("policy", host_registry.lookup(host).digest()[:12]),
+                ("route", "crossdomain-by-host.xml"),
+            )
+            self.assertEqual(
+                backend.counters[
+                    ("flashpolicies_served_total", labels + (("status", "200"),))
+                ],
+                1,
+            )
+
+    def test_record_body(self):
+        """
+        Tests that cache hits and misses are reported by serialization
+        itself, whatever else the policy has cached.
+
+        """
+        backend = metrics.StatsdBackend()
+        request = RequestFactory().get("/crossdomain.xml")
+        policy = policies.Policy("media.example.com")
+        policy.matcher()
+        self.assertEqual(
+            metrics.record_body(backend, request, policy, "gzip", False),
+            policy.compress("gzip"),
+        )
+        policy.invalidate()
+        policy.serialize()
+        metrics.record_body(backend, request, policy, None, False)
+        tags = "|#policy:{},route:".format(policy.digest()[:12])
+        lines = backend.flush()
+        self.assertIn("flashpolicies_cache_misses_total:1|c" + tags, lines)
+        self.assertIn("flashpolicies_cache_hits_total:1|c" + tags, lines)
+
+    def test_prometheus_render(self):
+        """
+        Tests the Prometheus text exposition format.
+
+        """
+        backend = metrics.PrometheusBackend(buckets=(0.5, 0.1))
+        backend.increment("requests_total", labels=(("path", '/a"b\\c\n'),))
+        backend.increment("requests_total", 2.5)
+        backend.observe("latency_seconds", 0.05, (("path", "/a"),))
+        backend.observe("latency_seconds", 0.2, (("path", "/a"),))
+        backend.observe("latency_seconds", 1, (("path", "/a"),))
+        self.assertEqual(
+            backend.render(),
+            "# TYPE requests_total counter\n"
+            "requests_total 2.5\n"
+            'requests_total{path="/a\\"b\\\\c\\n"} 1\n'
+            "# TYPE latency_seconds histogram\n"
+            'latency_seconds_bucket{path="/a",le="0.1"} 1\n'
+            'latency_seconds_bucket{path="/a",le="0.5"} 2\n'
+            'latency_seconds_bucket{path="/a",le="+Inf"} 3\n'
+            'latency_seconds_sum{path="/a"} 1.25\n'
+            'latency_seconds_count{path="/a"} 3\n',
+        )
+
+    def test_statsd_flush(self):
+        """
+        Tests the statsd line protocol, and that flushing resets the
+        metrics.
+
+        """
+        backend = metrics.StatsdBackend()
+        backend.increment("served", labels=(("policy", "/a"),))
+        backend.increment("served", labels=(("policy", "/a"),))
+        backend.increment("bytes", 10)
+        backend.observe("serialize", 0.25, (("policy", "/a"),))
+        backend.observe("serialize", 0.5, (("policy", "/a"),))
+        self.assertEqual(
+            backend.flush(),
+            [
+                "bytes:10|c",
+                "served:2|c|#policy:/a",
+                "serialize:250.0|ms|#policy:/a",
+                "serialize:500.0|ms|#policy:/a",
+            ],
+        )
+        self.assertEqual(backend.flush(), [])
+
+    def test_base_backend(self):
+        """
+        Tests that the base backend must be subclassed.
+
+        """
+        backend = metrics.MetricsBackend()
+        with self.assertRaises(NotImplementedError):
+            backend.increment("served")
+        with self.assertRaises(NotImplementedError):
+            backend.observe("serialize", 1)
+
+    def test_prometheus_view(self):
+        """
+        Tests that metrics are served only from the Prometheus backend.
+
+        """
+        self.assertEqual(self.client.get("/metrics").status_code, 404)
+        with self.settings(FLASHPOLICIES_METRICS=STATSD):
+            self.assertEqual(self.client.get("/metrics").status_code, 404)
+        with self.settings(FLASHPOLICIES_METRICS=PROMETHEUS):
+            self.client.get("/crossdomain-serve.xml")
+            response = self.client.get("/metrics")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response["Content-Type"], metrics.PROMETHEUS_CONTENT_TYPE)
+            self.assertIn(
+                'flashpolicies_served_total{{policy="{}",'
+                'route="crossdomain-serve.xml",status="200"}} 1\n'.format(
+                    make_test_policy().digest()[:12]
+                ).encode(),
+                response.content,
+            )
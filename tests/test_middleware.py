@@ -0,0 +1,156 @@
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from flashpolicies import middleware
+
+from .enforce_urls import make_enforced_policy
+
+
+MIDDLEWARE = ["flashpolicies.middleware.PolicyMiddleware"]
+
+
+@override_settings(
+    ROOT_URLCONF="tests.enforce_urls",
+    MIDDLEWARE=MIDDLEWARE,
+    FLASHPOLICIES_ENFORCE="tests.test_middleware.ENFORCED_POLICY",
+)
+class PolicyEnforcementTests(SimpleTestCase):
+    """
+    Tests enforcing policies on requests.
+
+    """
+
+    def assertAllowed(self, path, allowed=True, secure=False, **headers):
+        extra = {"HTTP_" + name.upper(): value for name, value in headers.items()}
+        response = self.client.get(path, secure=secure, **extra)
+        self.assertEqual(response.status_code, 200 if allowed else 403)
+
+    def test_same_site(self):
+        """
+        Tests that requests from content on the same host, or not
+        saying where they come from, are not checked.
+
+        """
+        self.assertAllowed("/data")
+        self.assertAllowed("/data", origin="http://testserver")
+        self.assertAllowed("/data", referer="https://TestServer/page", x_other="value")
+
+    def test_allowed_domains(self):
+        """
+        Tests that requests from other hosts are checked against the
+        policy.
+
+        """
+        self.assertAllowed("/data", origin="https://media.example.com")
+        self.assertAllowed("/data", referer="https://media.example.com:8443/a.swf")
+        # Rules requiring HTTPS only apply to requests made over HTTPS.
+        self.assertAllowed("/data", origin="http://media.example.com")
+        self.assertAllowed("/data", origin="http://www.example.org")
+        self.assertAllowed("/data", False, origin="https://api.example.com")
+        for origin in ("null", "http://[::1"):
+            with self.subTest(origin=origin):
+                self.assertAllowed("/data", False, origin=origin)
+
+    def test_secure(self):
+        """
+        Tests that requests made over HTTPS from content served over
+        HTTP are refused, unless the rule allowing them is not secure.
+
+        """
+        self.assertAllowed("/data", secure=True, origin="https://media.example.com")
+        self.assertAllowed(
+            "/data", False, secure=True, origin="http://media.example.com"
+        )
+        self.assertAllowed("/data", secure=True, origin="http://www.example.org")
+        self.assertAllowed(
+            "/decorated", False, secure=True, origin="http://api.example.com"
+        )
+
+    def test_headers(self):
+        """
+        Tests that non-standard headers must be allowed by the policy.
+
+        """
+        self.assertAllowed(
+            "/data",
+            origin="https://media.example.com",
+            accept_language="en",
+            sec_fetch_mode="cors",
+            x_flash_version="32,0,0,465",
+            x_custom_value="1",
+        )
+        self.assertAllowed(
+            "/data", False, origin="https://media.example.com", x_other="1"
+        )
+        self.assertAllowed("/data", False, origin="http://www.example.org", x_other="1")
+
+    def test_ignored_headers(self):
+        """
+        Tests that headers sent by browsers, proxies, CDNs and tracing
+        systems, and those named in the setting
+        ``FLASHPOLICIES_IGNORED_HEADERS``, need not be allowed.
+
+        """
+        self.assertAllowed(
+            "/data",
+            origin="https://media.example.com",
+            priority="u=1, i",
+            x_requested_with="XMLHttpRequest",
+            traceparent="00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01",
+            tracestate="vendor=value",
+            cf_connecting_ip="192.0.2.1",
+            cf_ray="1234",
+            x_amzn_trace_id="Root=1-67891233-abcdef012345678912345678",
+            true_client_ip="192.0.2.1",
+            x_forwarded_for="192.0.2.1",
+        )
+        headers = {"origin": "https://media.example.com", "x_mine": "1"}
+        self.assertAllowed("/data", False, **headers)
+        with self.settings(FLASHPOLICIES_IGNORED_HEADERS=["X-Mine", "X-Vendor-*"]):
+            self.assertAllowed("/data", x_vendor_id="1", **headers)
+            self.assertAllowed("/data", False, x_other="1", **headers)
+        self.assertAllowed("/data", False, **headers)
+
+    def test_exempt(self):
+        """
+        Tests that exempt views, including policy files, are not checked.
+
+        """
+        self.assertAllowed("/exempt", origin="https://api.example.com")
+        self.assertAllowed("/crossdomain.xml", origin="https://api.example.com")
+
+    def test_decorator(self):
+        """
+        Tests that decorated views enforce their own policy instead.
+
+        """
+        for path in ("/decorated", "/async/decorated"):
+            with self.subTest(path=path):
+                self.assertAllowed(path, origin="https://api.example.com")
+                self.assertAllowed(path, False, origin="https://media.example.com")
+                self.assertAllowed(path)
+
+    @override_settings(FLASHPOLICIES_ENFORCE=None)
+    def test_not_configured(self):
+        """
+        Tests that the middleware is unused without a policy, and that
+        the setting may be a policy rather than a dotted path.
+
+        """
+        with self.assertRaises(MiddlewareNotUsed):
+            middleware.PolicyMiddleware(lambda request: HttpResponse())
+        self.assertAllowed("/data", origin="https://api.example.com")
+        with self.settings(FLASHPOLICIES_ENFORCE=make_enforced_policy()):
+            instance = middleware.PolicyMiddleware(lambda request: HttpResponse())
+            request = RequestFactory().get("/data", HTTP_ORIGIN="https://x.example.net")
+            self.assertEqual(instance(request).status_code, 200)
+            self.assertEqual(
+                instance.process_view(
+                    request, lambda request: None, (), {}
+                ).status_code,
+                403,
+            )
+
+
+ENFORCED_POLICY = make_enforced_policy()
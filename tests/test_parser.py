@@ -0,0 +1,187 @@
+import io
+
+from django.test import SimpleTestCase
+
+from flashpolicies import parser, policies
+
+
+FINGERPRINT = "01:23:45:67:89:ab:cd:ef:01:23:45:67:89:ab:cd:ef:01:23:45:67"
+
+
+def make_full_policy():
+    policy = policies.Policy("media.example.com", "*.example.org")
+    policy.allow_domain("api.example.com", to_ports=["80", "8000-9000"], secure=False)
+    policy.allow_headers("media.example.com", ["SomeHeader", "OtherHeader"])
+    policy.allow_headers("api.example.com", ["SomeHeader"], secure=False)
+    policy.allow_identity(FINGERPRINT)
+    policy.metapolicy(policies.SITE_CONTROL_BY_CONTENT_TYPE)
+    return policy
+
+
+def make_no_access_policy():
+    policy = policies.Policy()
+    policy.metapolicy(policies.SITE_CONTROL_NONE)
+    return policy
+
+
+class ParserTests(SimpleTestCase):
+    """
+    Tests parsing policy files.
+
+    """
+
+    def test_round_trip(self):
+        """
+        Tests that parsing a serialized policy and serializing the
+        result reproduces it exactly.
+
+        """
+        for policy in (
+            make_full_policy(),
+            policies.Policy(),
+            policies.Policy("media.example.com"),
+            make_no_access_policy(),
+        ):
+            for compact in (False, True):
+                serialized = policy.serialize(compact=compact)
+                with self.subTest(serialized=serialized):
+                    parsed = parser.parse(serialized)
+                    self.assertEqual(parsed.compact, compact)
+                    self.assertEqual(parsed.serialize(), serialized)
+                    self.assertEqual(
+                        parser.parse(io.BytesIO(serialized)).serialize(), serialized
+                    )
+
+    def test_string(self):
+        """
+        Tests that policies can be parsed from strings.
+
+        """
+        policy = make_full_policy()
+        self.assertEqual(parser.parse(str(policy)).serialize(), policy.serialize())
+
+    def test_explicit_compact(self):
+        """
+        Tests that the ``compact`` attribute of the parsed policy can
+        be given explicitly.
+
+        """
+        serialized = make_full_policy().serialize()
+        self.assertTrue(parser.parse(serialized, compact=True).compact)
+
+    def test_legacy_file(self):
+        """
+        Tests that hand-written policy files are understood, with
+        unsupported elements ignored.
+
+        """
+        parsed = parser.parse(b"""<?xml version="1.0"?>
+            <!-- A legacy policy. -->
+            <cross-domain-policy>
+              <site-control permitted-cross-domain-policies="master-only"/>
+              <allow-access-from domain="media.example.com" secure="true"/>
+              <allow-access-from domain="api.example.com" to-ports="*"/>
+              <allow-http-request-headers-from domain="*" headers="X-Test"/>
+              <allow-access-from-identity>
+                <signatory>
+                  <certificate fingerprint="%s"/>
+                </signatory>
+              </allow-access-from-identity>
+              <unknown-element><allow-access-from domain="nested.example.com"/>
+              </unknown-element>
+            </cross-domain-policy>
+            """ % FINGERPRINT.encode("ascii"))
+        self.assertEqual(parsed.site_control, policies.SITE_CONTROL_MASTER_ONLY)
+        self.assertEqual(
+            parsed.domains,
+            {
+                "media.example.com": policies.domain_rule(),
+                "api.example.com": policies.domain_rule(["*"]),
+            },
+        )
+        self.assertEqual(parsed.header_domains, {"*": policies.header_rule(["X-Test"])})
+        self.assertEqual(parsed.identities, [FINGERPRINT])
+        self.assertFalse(parsed.compact)
+
+    def test_iterparse(self):
+        """
+        Tests that documents are parsed incrementally into events.
+
+        """
+        serialized = policies.Policy("media.example.com").serialize(compact=True)
+        events = list(parser.iterparse(io.BytesIO(serialized), chunk_size=7))
+        self.assertEqual(
+            events,
+            [
+                ("start", "cross-domain-policy", {}),
+                ("start", "allow-access-from", {"domain": "media.example.com"}),
+                ("end", "allow-access-from", {}),
+                ("end", "cross-domain-policy", {}),
+            ],
+        )
+
+    def test_entity_expansion(self):
+        """
+        Tests that documents declaring entities are refused.
+
+        """
+        for document in (
+            b"""<?xml version="1.0"?>
+            <!DOCTYPE cross-domain-policy [
+              <!ENTITY a "aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa">
+              <!ENTITY b "&a;&a;&a;&a;&a;&a;&a;&a;&a;&a;&a;&a;&a;&a;">
+            ]>
+            <cross-domain-policy><allow-access-from domain="&b;"/>
+            </cross-domain-policy>""",
+            b"""<?xml version="1.0"?>
+            <!DOCTYPE cross-domain-policy [
+              <!ENTITY passwd SYSTEM "file:///etc/passwd">
+            ]>
+            <cross-domain-policy><allow-access-from domain="&passwd;"/>
+            </cross-domain-policy>""",
+        ):
+            with self.assertRaisesMessage(TypeError, "internal DTD subsets"):
+                parser.parse(document)
+        with self.assertRaisesMessage(TypeError, "undefined entity"):
+            parser.parse(b'<cross-domain-policy><a b="&c;"/></cross-domain-policy>')
+
+    def test_deep_nesting(self):
+        """
+        Tests that deeply-nested documents are refused.
+
+        """
+        document = (
+            "<cross-domain-policy>"
+            + "<a>" * parser.MAX_DEPTH
+            + "</a>" * parser.MAX_DEPTH
+            + "</cross-domain-policy>"
+        )
+        with self.assertRaisesMessage(TypeError, "deeply nested"):
+            parser.parse(document)
+        document = "<cross-domain-policy>" + "<a/>" * 1000 + "</cross-domain-policy>"
+        self.assertEqual(parser.parse(document).domains, {})
+
+    def test_invalid(self):
+        """
+        Tests that invalid documents raise ``TypeError``.
+
+        """
+        for document in (
+            "",
+            "<cross-domain-policy>",
+            "<policy/>",
+            "<cross-domain-policy><allow-access-from/></cross-domain-policy>",
+            "<cross-domain-policy><allow-http-request-headers-from domain='a'/>"
+            "</cross-domain-policy>",
+            "<cross-domain-policy><site-control permitted-cross-domain-policies='x'/>"
+            "</cross-domain-policy>",
+            "<cross-domain-policy><allow-access-from-identity><signatory>"
+            "<certificate fingerprint='a' fingerprint-algorithm='md5'/>"
+            "</signatory></allow-access-from-identity></cross-domain-policy>",
+            "<cross-domain-policy>"
+            "<site-control permitted-cross-domain-policies='none'/>"
+            "<allow-access-from domain='a'/></cross-domain-policy>",
+        ):
+            with self.subTest(document=document):
+                with self.assertRaises(TypeError):
+                    parser.parse(document)
@@ -1,3 +1,14 @@
+import copy
+import gzip
+import hashlib
+import os
+import pickle
+import subprocess
+import sys
+import xml.dom.minidom
+from unittest import mock
+
+import brotli
 from django.test import SimpleTestCase
 
 from flashpolicies import policies
@@ -284,3 +295,860 @@ class PolicyGeneratorTests(SimpleTestCase):
         ]
         for domain in domains_in_xml:
             domains.remove(domain)
+
+    def test_serialize_cached(self):
+        """
+        Tests that serializing an unchanged policy reuses the cached
+        result.
+
+        """
+        policy = policies.Policy("media.example.com")
+        first = policy.serialize()
+        self.assertIs(first, policy.serialize())
+        self.assertIs(str(policy), str(policy))
+
+    def test_cache_invalidation(self):
+        """
+        Tests that each method which changes a policy discards the
+        cached serialization.
+
+        """
+        policy = policies.Policy()
+        mutations = [
+            lambda: policy.allow_domain("media.example.com"),
+            lambda: policy.allow_headers("media.example.com", ["SomeHeader"]),
+            lambda: policy.allow_identity(self.dummy_fingerprint),
+            lambda: policy.metapolicy(policies.SITE_CONTROL_ALL),
+        ]
+        for mutate in mutations:
+            before = policy.serialize()
+            before_str = str(policy)
+            mutate()
+            self.assertNotEqual(before, policy.serialize())
+            self.assertNotEqual(before_str, str(policy))
+
+    def test_manual_invalidation(self):
+        """
+        Tests that invalidate() discards the cached serialization after
+        the policy's attributes are changed directly.
+
+        """
+        policy = policies.Policy()
+        before = policy.serialize()
+        policy.domains["media.example.com"] = {"to_ports": None, "secure": True}
+        self.assertEqual(before, policy.serialize())
+        policy.invalidate()
+        self.assertIn(b"media.example.com", policy.serialize())
+
+    def test_serialize_matches_dom(self):
+        """
+        Tests that serialize() and str() produce exactly the same
+        output as pretty-printing the policy's DOM.
+
+        """
+        empty = policies.Policy()
+        forbidden = policies.Policy()
+        forbidden.metapolicy(policies.SITE_CONTROL_NONE)
+        full = policies.Policy("media.example.com", 'we"ird&<domain>')
+        full.allow_domain("api.example.com", to_ports=["80", "9000-9100"])
+        full.allow_domain("insecure.example.com", secure=False)
+        full.allow_headers("media.example.com", ["SomeHeader", "Other"])
+        full.allow_headers("api.example.com", ["SomeHeader"], secure=False)
+        full.allow_identity(self.dummy_fingerprint)
+        full.metapolicy(policies.SITE_CONTROL_ALL)
+        for policy in (empty, forbidden, full):
+            self.assertEqual(
+                policy.xml_dom.toprettyxml(encoding="utf-8"), policy.serialize()
+            )
+            self.assertEqual(policy.xml_dom.toprettyxml(), str(policy))
+
+    def test_serialize_manual_tinkering(self):
+        """
+        Tests that serializing a policy whose metapolicy forbids all
+        access, but which has been altered to allow access anyway,
+        fails.
+
+        """
+        policy = policies.Policy()
+        policy.metapolicy(policies.SITE_CONTROL_NONE)
+        policy.identities.append(self.dummy_fingerprint)
+        with self.assertRaises(TypeError):
+            policy.serialize()
+
+    def test_digest(self):
+        """
+        Tests that digest() returns a SHA-256 hash of the serialized
+        policy, which changes when the policy does.
+
+        """
+        policy = policies.Policy("media.example.com")
+        self.assertEqual(
+            hashlib.sha256(policy.serialize()).hexdigest(), policy.digest()
+        )
+        before = policy.digest()
+        policy.allow_domain("api.example.com")
+        self.assertNotEqual(before, policy.digest())
+
+    def test_compress(self):
+        """
+        Tests that compress() returns the serialized policy compressed
+        with each supported encoding, and caches the result.
+
+        """
+        policy = policies.Policy("media.example.com", "api.example.com")
+        decompressors = {"br": brotli.decompress, "gzip": gzip.decompress}
+        self.assertEqual(set(decompressors), set(policies.COMPRESSORS))
+        for encoding, decompress in decompressors.items():
+            compressed = policy.compress(encoding)
+            self.assertEqual(policy.serialize(), decompress(compressed))
+            self.assertIs(compressed, policy.compress(encoding))
+            policy.allow_domain("www.example.com")
+            self.assertIsNot(compressed, policy.compress(encoding))
+
+    def test_compress_deterministic(self):
+        """
+        Tests that compressing the same policy twice produces the same
+        bytes.
+
+        """
+        self.assertEqual(
+            policies.Policy("media.example.com").compress("gzip"),
+            policies.Policy("media.example.com").compress("gzip"),
+        )
+
+    def test_compress_bad_encoding(self):
+        """
+        Tests that compressing with an unsupported encoding fails.
+
+        """
+        with self.assertRaises(TypeError):
+            policies.Policy().compress("compress")
+
+    def test_compact(self):
+        """
+        Tests that compact serialization omits all indentation and line
+        breaks, but keeps the XML prolog and DOCTYPE.
+
+        """
+        policy = policies.Policy("media.example.com")
+        policy.allow_headers("media.example.com", ["SomeHeader"], secure=False)
+        policy.allow_identity(self.dummy_fingerprint)
+        policy.metapolicy(policies.SITE_CONTROL_ALL)
+        compact = policy.serialize(compact=True)
+        self.assertNotIn(b"\n", compact)
+        self.assertNotIn(b"\t", compact)
+        self.assertTrue(
+            compact.startswith(
+                b'<?xml version="1.0" encoding="utf-8"?>'
+                b"<!DOCTYPE cross-domain-policy SYSTEM "
+                b"'http://www.adobe.com/xml/dtds/cross-domain-policy.dtd'>"
+            )
+        )
+        self.assertLess(len(compact), len(policy.serialize()))
+        pretty = xml.dom.minidom.parseString(policy.serialize()).documentElement
+        self.assertEqual(
+            xml.dom.minidom.parseString(compact).documentElement.toxml(),
+            pretty.toxml().replace("\n", "").replace("\t", ""),
+        )
+        self.assertEqual(
+            b'<?xml version="1.0" encoding="utf-8"?><!DOCTYPE cross-domain-policy '
+            b"SYSTEM 'http://www.adobe.com/xml/dtds/cross-domain-policy.dtd'>"
+            b"<cross-domain-policy/>",
+            policies.Policy().serialize(compact=True),
+        )
+
+    def test_compact_default(self):
+        """
+        Tests that a policy created with compact=True serializes
+        compactly by default, but can still be pretty-printed.
+
+        """
+        policy = policies.Policy("media.example.com", compact=True)
+        self.assertNotIn(b"\n", policy.serialize())
+        self.assertNotIn("\n", str(policy))
+        self.assertNotIn(b"\n", gzip.decompress(policy.compress("gzip")))
+        self.assertEqual(
+            hashlib.sha256(policy.serialize()).hexdigest(), policy.digest()
+        )
+        self.assertIn(b"\n", policy.serialize(compact=False))
+
+    def test_allow_domains(self):
+        """
+        Tests that allowing domains in bulk is equivalent to allowing
+        them one at a time.
+
+        """
+        domains = ["media.example.com", "api.example.com", "media.example.com"]
+        bulk = policies.Policy()
+        bulk.allow_domains(iter(domains), to_ports=iter(["80", "8000-9000"]))
+        single = policies.Policy()
+        for domain in domains:
+            single.allow_domain(domain, to_ports=["80", "8000-9000"])
+        self.assertEqual(bulk.serialize(), single.serialize())
+        self.assertEqual(list(bulk.domains), ["media.example.com", "api.example.com"])
+        bulk.allow_domains(["static.example.com"], secure=False)
+        self.assertIn(b'domain="static.example.com" secure="false"', bulk.serialize())
+
+    def test_allow_headers_many(self):
+        """
+        Tests that allowing headers in bulk is equivalent to allowing
+        them one at a time, whether given as a mapping or as pairs.
+
+        """
+        rules = [
+            ("media.example.com", ["SomeHeader"]),
+            ("api.example.com", ["SomeHeader", "SomeOtherHeader"]),
+        ]
+        single = policies.Policy()
+        for domain, headers in rules:
+            single.allow_headers(domain, headers, secure=False)
+        for bulk_rules in (rules, dict(rules)):
+            bulk = policies.Policy()
+            bulk.allow_headers_many(bulk_rules, secure=False)
+            self.assertEqual(bulk.serialize(), single.serialize())
+
+    def test_allow_identities(self):
+        """
+        Tests that allowing identities in bulk is equivalent to
+        allowing them one at a time, and removes duplicates.
+
+        """
+        other_fingerprint = self.dummy_fingerprint.replace("01", "fe")
+        fingerprints = [self.dummy_fingerprint, other_fingerprint]
+        bulk = policies.Policy()
+        bulk.allow_identities(iter(fingerprints * 2))
+        single = policies.Policy()
+        for fingerprint in fingerprints * 2:
+            single.allow_identity(fingerprint)
+        self.assertEqual(bulk.identities, fingerprints)
+        self.assertEqual(bulk.serialize(), single.serialize())
+
+    def test_allow_identities_unchanged(self):
+        """
+        Tests that allowing only identities which are already allowed
+        leaves the cached serialization in place.
+
+        """
+        policy = policies.Policy()
+        policy.allow_identities([self.dummy_fingerprint])
+        serialized = policy.serialize()
+        policy.allow_identities([self.dummy_fingerprint])
+        self.assertIs(policy.serialize(), serialized)
+
+    def test_allow_identities_manual_tinkering(self):
+        """
+        Tests that duplicates are still removed after the list of
+        identities is changed directly.
+
+        """
+        other_fingerprint = self.dummy_fingerprint.replace("01", "fe")
+        policy = policies.Policy()
+        policy.allow_identity(self.dummy_fingerprint)
+        policy.identities = [other_fingerprint]
+        policy.allow_identities([self.dummy_fingerprint, other_fingerprint])
+        self.assertEqual(policy.identities, [other_fingerprint, self.dummy_fingerprint])
+        policy.metapolicy(policies.SITE_CONTROL_ALL)
+        policy.metapolicy(policies.SITE_CONTROL_NONE)
+        policy.metapolicy(policies.SITE_CONTROL_ALL)
+        policy.allow_identity(other_fingerprint)
+        self.assertEqual(policy.identities, [other_fingerprint])
+
+    def test_allow_identities_edited_in_place(self):
+        """
+        Tests that after the list of identities is edited in place and
+        ``invalidate()`` called, identities are checked against its new
+        contents.
+
+        """
+        policy = policies.Policy()
+        policy.allow_identities(["f1", "f2"])
+        policy.identities[0] = "g"
+        policy.invalidate()
+        policy.allow_identity("f1")
+        self.assertEqual(policy.identities, ["g", "f2", "f1"])
+        policy.allow_identity("g")
+        self.assertEqual(policy.identities, ["g", "f2", "f1"])
+        copy = policy.copy()
+        copy.identities.remove("f2")
+        copy.invalidate()
+        copy.allow_identity("f2")
+        policy.allow_identity("f2")
+        self.assertEqual(copy.identities, ["g", "f1", "f2"])
+        self.assertEqual(policy.identities, ["g", "f2", "f1"])
+
+    def test_bulk_metapolicy_none(self):
+        """
+        Tests that the bulk methods refuse to allow access when the
+        metapolicy forbids all access.
+
+        """
+        policy = policies.Policy()
+        policy.metapolicy(policies.SITE_CONTROL_NONE)
+        for method, argument in (
+            (policy.allow_domains, ["media.example.com"]),
+            (policy.allow_headers_many, {"media.example.com": ["SomeHeader"]}),
+            (policy.allow_identities, [self.dummy_fingerprint]),
+        ):
+            with self.assertRaises(TypeError):
+                method(argument)
+
+    def test_bulk_single_string(self):
+        """
+        Tests that passing a single string, rather than a list of
+        them, to the bulk methods raises ``TypeError``.
+
+        """
+        policy = policies.Policy()
+        with self.assertRaises(TypeError):
+            policy.allow_domains("media.example.com")
+        with self.assertRaises(TypeError):
+            policy.allow_headers_many("media.example.com")
+        with self.assertRaises(TypeError):
+            policy.allow_identities(self.dummy_fingerprint)
+        self.assertEqual(policy.domains, {})
+        self.assertEqual(policy.header_domains, {})
+
+    def test_bulk_failure(self):
+        """
+        Tests that a bulk method which fails partway through leaves the
+        policy, and its cached serialization, unchanged.
+
+        """
+
+        def failing(*items):
+            yield from items
+            raise ValueError
+
+        policy = policies.Policy("media.example.com")
+        policy.allow_headers("media.example.com", ["SomeHeader"])
+        policy.allow_identity(self.dummy_fingerprint)
+        serialized = policy.serialize()
+        with self.assertRaises(ValueError):
+            policy.allow_domains(failing("api.example.com"))
+        with self.assertRaises(TypeError):
+            policy.allow_headers_many([("api.example.com", ["SomeHeader"]), ("b", 5)])
+        with self.assertRaises(ValueError):
+            policy.allow_identities(failing(self.dummy_fingerprint.replace("01", "fe")))
+        self.assertEqual(list(policy.domains), ["media.example.com"])
+        self.assertEqual(list(policy.header_domains), ["media.example.com"])
+        self.assertEqual(policy.identities, [self.dummy_fingerprint])
+        self.assertIs(policy.serialize(), serialized)
+
+    def test_bulk_invalidates_once(self):
+        """
+        Tests that each bulk method invalidates cached serializations
+        only once.
+
+        """
+        policy = policies.Policy()
+        with mock.patch.object(policy, "_changed") as invalidate:
+            policy.allow_domains(["media.example.com", "api.example.com"])
+            policy.allow_headers_many({"media.example.com": ["SomeHeader"]})
+            policy.allow_identities(
+                [self.dummy_fingerprint, self.dummy_fingerprint.replace("01", "fe")]
+            )
+        self.assertEqual(invalidate.call_count, 3)
+
+    def test_rules_shared(self):
+        """
+        Tests that domains with the same options share one rule, with
+        its ports or headers stored as a tuple.
+
+        """
+        policy = policies.Policy()
+        policy.allow_domains(["media.example.com", "api.example.com"], ["80"])
+        policy.allow_domain("static.example.com", to_ports=iter(["80"]))
+        policy.allow_headers("media.example.com", ["SomeHeader"])
+        policy.allow_headers_many({"api.example.com": ("SomeHeader",)})
+        self.assertEqual(len({id(rule) for rule in policy.domains.values()}), 1)
+        self.assertEqual(policy.domains["media.example.com"].to_ports, ("80",))
+        self.assertIs(
+            policy.header_domains["media.example.com"],
+            policy.header_domains["api.example.com"],
+        )
+        self.assertIsNot(
+            policy.domains["media.example.com"], policies.domain_rule(["80"], False)
+        )
+
+    def test_rules_as_dicts(self):
+        """
+        Tests that rules can still be read as dictionaries.
+
+        """
+        policy = policies.Policy("media.example.com")
+        policy.allow_headers("media.example.com", ["SomeHeader"], secure=False)
+        rule = policy.domains["media.example.com"]
+        self.assertEqual(rule, {"to_ports": None, "secure": True})
+        self.assertEqual(rule["secure"], True)
+        self.assertEqual(len(rule), 2)
+        self.assertEqual(dict(rule), {"to_ports": None, "secure": True})
+        self.assertEqual(
+            dict(policy.header_domains["media.example.com"]),
+            {"headers": ("SomeHeader",), "secure": False},
+        )
+        with self.assertRaises(KeyError):
+            rule["headers"]
+        # Lists, as earlier versions stored, compare equal to tuples.
+        self.assertEqual(
+            policies.domain_rule(["80"]), {"to_ports": ["80"], "secure": True}
+        )
+        self.assertEqual(
+            {"headers": ["SomeHeader"], "secure": False},
+            policy.header_domains["media.example.com"],
+        )
+        self.assertNotEqual(policies.domain_rule(["80"]), {"to_ports": ["80"]})
+        self.assertNotEqual(
+            policies.domain_rule(["80"]), {"to_ports": ["80"], "headers": True}
+        )
+        self.assertNotEqual(
+            policies.domain_rule(["80"]), {"to_ports": ["81"], "secure": True}
+        )
+        self.assertNotEqual(policies.domain_rule(), policies.header_rule([]))
+        self.assertNotEqual(policies.domain_rule(), None)
+        self.assertEqual(
+            repr(policy.header_domains["media.example.com"]),
+            "HeaderRule(headers=('SomeHeader',), secure=False)",
+        )
+
+    def test_rules_immutable(self):
+        """
+        Tests that rules, which may be shared, cannot be changed.
+
+        """
+        rule = policies.domain_rule()
+        with self.assertRaises(AttributeError):
+            rule.secure = False
+        with self.assertRaises(TypeError):
+            rule["secure"] = False
+        self.assertTrue(rule.secure)
+
+    def test_rules_pickle(self):
+        """
+        Tests that policies with rules can be pickled.
+
+        """
+        policy = policies.Policy()
+        policy.allow_domain("media.example.com", to_ports=["80"], secure=False)
+        policy.allow_headers("media.example.com", ["SomeHeader"])
+        unpickled = pickle.loads(pickle.dumps(policy))
+        self.assertEqual(unpickled.domains, policy.domains)
+        self.assertEqual(unpickled.header_domains, policy.header_domains)
+        self.assertEqual(unpickled.serialize(), policy.serialize())
+
+    def test_minidom_lazy(self):
+        """
+        Tests that the DOM implementation is imported only when
+        ``xml_dom`` is used, and not to serialize a policy.
+
+        """
+        script = (
+            "import sys\n"
+            "from flashpolicies import policies\n"
+            "policy = policies.Policy('media.example.com')\n"
+            "policy.serialize()\n"
+            "policy.digest()\n"
+            "print('xml.dom.minidom' in sys.modules)\n"
+            "policy.xml_dom\n"
+            "print('xml.dom.minidom' in sys.modules)\n"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", script],
+            capture_output=True,
+            check=True,
+            env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)),
+            text=True,
+        )
+        self.assertEqual(result.stdout.split(), ["False", "True"])
+
+    def test_minidom_attribute(self):
+        """
+        Tests that the module attribute ``minidom`` is still available.
+
+        """
+        self.assertIsInstance(policies.minidom, xml.dom.minidom.DOMImplementation)
+        with self.assertRaises(AttributeError):
+            policies.nonexistent
+
+
+class PolicyCompositionTests(SimpleTestCase):
+    """
+    Tests copying, combining and comparing policies.
+
+    """
+
+    dummy_fingerprint = "01:23:45:67:89:ab:cd:ef:01:23:45:67:89:ab:cd:ef:01:23:45:67"
+    other_fingerprint = "fe:23:45:67:89:ab:cd:ef:fe:23:45:67:89:ab:cd:ef:fe:23:45:67"
+
+    def make_policy(self, *domains):
+        policy = policies.Policy(*domains)
+        policy.allow_headers(domains[0], ["SomeHeader"])
+        policy.allow_identity(self.dummy_fingerprint)
+        return policy
+
+    def test_copy(self):
+        """
+        Tests that a copy is independent of the original, however
+        either is changed.
+
+        """
+        original = self.make_policy("media.example.com")
+        serialized = original.serialize()
+        clone = copy.copy(original)
+        self.assertIs(clone.serialize(), serialized)
+        clone.allow_domain("api.example.com")
+        clone.allow_identity(self.other_fingerprint)
+        self.assertEqual(original.serialize(), serialized)
+        self.assertEqual(list(original.domains), ["media.example.com"])
+        self.assertEqual(original.identities, [self.dummy_fingerprint])
+        self.assertEqual(
+            clone.identities, [self.dummy_fingerprint, self.other_fingerprint]
+        )
+
+        clone = original.copy()
+        original.header_domains["api.example.com"] = policies.header_rule(["Other"])
+        original.identities.append(self.other_fingerprint)
+        self.assertEqual(list(clone.header_domains), ["media.example.com"])
+        self.assertEqual(clone.identities, [self.dummy_fingerprint])
+        clone.allow_identities([self.dummy_fingerprint, self.other_fingerprint])
+        self.assertEqual(
+            clone.identities, [self.dummy_fingerprint, self.other_fingerprint]
+        )
+
+    def test_copy_replaced_attributes(self):
+        """
+        Tests that replacing the rules of a copy does not affect the
+        original.
+
+        """
+        original = self.make_policy("media.example.com")
+        clone = original.copy()
+        clone.domains = {}
+        clone.header_domains = {}
+        clone.identities = []
+        clone.invalidate()
+        self.assertEqual(len(original.domains), 1)
+        self.assertEqual(len(original.header_domains), 1)
+        self.assertEqual(len(original.identities), 1)
+        self.assertNotEqual(clone.serialize(), original.serialize())
+
+    def test_copy_metapolicy_none(self):
+        """
+        Tests that forbidding all access in a copy does not affect the
+        original.
+
+        """
+        original = self.make_policy("media.example.com")
+        clone = original.copy()
+        clone.metapolicy(policies.SITE_CONTROL_NONE)
+        clone.metapolicy(policies.SITE_CONTROL_ALL)
+        clone.allow_domain("api.example.com")
+        self.assertEqual(list(clone.domains), ["api.example.com"])
+        self.assertEqual(list(original.domains), ["media.example.com"])
+
+    def test_merge(self):
+        """
+        Tests that merging policies allows what either allows, with
+        the second policy's options taking precedence.
+
+        """
+        base = self.make_policy("media.example.com", "api.example.com")
+        base.metapolicy(policies.SITE_CONTROL_MASTER_ONLY)
+        tenant = policies.Policy("tenant.example.com")
+        tenant.allow_domain("api.example.com", secure=False)
+        tenant.allow_identities([self.dummy_fingerprint, self.other_fingerprint])
+        tenant.metapolicy(policies.SITE_CONTROL_ALL)
+        merged = base | tenant
+        self.assertEqual(
+            list(merged.domains),
+            ["media.example.com", "api.example.com", "tenant.example.com"],
+        )
+        self.assertFalse(merged.domains["api.example.com"].secure)
+        self.assertEqual(list(merged.header_domains), ["media.example.com"])
+        self.assertEqual(
+            merged.identities, [self.dummy_fingerprint, self.other_fingerprint]
+        )
+        self.assertEqual(merged.site_control, policies.SITE_CONTROL_ALL)
+        self.assertTrue(base.domains["api.example.com"].secure)
+        self.assertEqual((policies.Policy() | base).serialize(), base.serialize())
+        self.assertEqual((base | policies.Policy()).serialize(), base.serialize())
+
+    def test_merge_metapolicy_none(self):
+        """
+        Tests that merging access into a policy forbidding all access
+        raises ``TypeError``.
+
+        """
+        forbidding = policies.Policy()
+        forbidding.metapolicy(policies.SITE_CONTROL_NONE)
+        with self.assertRaises(TypeError):
+            forbidding | policies.Policy("media.example.com")
+        self.assertEqual(
+            (self.make_policy("media.example.com") | forbidding).serialize(),
+            forbidding.serialize(),
+        )
+
+    def test_intersection(self):
+        """
+        Tests that intersecting policies allows only what both allow.
+
+        """
+        first = self.make_policy("media.example.com", "api.example.com")
+        second = policies.Policy("api.example.com", "static.example.com")
+        second.allow_identity(self.dummy_fingerprint)
+        intersection = first & second
+        self.assertEqual(list(intersection.domains), ["api.example.com"])
+        self.assertEqual(intersection.header_domains, {})
+        self.assertEqual(intersection.identities, [self.dummy_fingerprint])
+        self.assertEqual(len(first.domains), 2)
+
+    def test_intersection_narrows(self):
+        """
+        Tests that where two policies have different options for a
+        domain, their intersection allows only what both allow.
+
+        """
+        first = policies.Policy()
+        first.allow_domain("a.example.com", to_ports=["80", "8000-9000"])
+        first.allow_domain("b.example.com", to_ports=["80"], secure=False)
+        first.allow_domain("c.example.com", to_ports=["*"], secure=False)
+        first.allow_domain("d.example.com", to_ports=["80"])
+        first.allow_domain("e.example.com", to_ports=["*"])
+        first.allow_domain("f.example.com", to_ports=["80"], secure=False)
+        first.allow_headers("a.example.com", ["X-*", "SOAPAction"], secure=False)
+        first.allow_headers("b.example.com", ["*"])
+        first.allow_headers("c.example.com", ["X-Foo"])
+        second = policies.Policy()
+        second.allow_domain("a.example.com", to_ports=["443", "8500-10000"])
+        second.allow_domain("b.example.com", to_ports=["443"])
+        second.allow_domain("c.example.com", to_ports=["0-65535"], secure=False)
+        second.allow_domain("d.example.com")
+        second.allow_domain("e.example.com", to_ports=["80", "1000-2000"])
+        second.allow_domain("f.example.com", to_ports=["80"])
+        second.allow_headers("a.example.com", ["x-foo*", "soapaction", "Other"])
+        second.allow_headers("b.example.com", ["SOAPAction", "X-*"], secure=False)
+        second.allow_headers("c.example.com", ["X-Bar"])
+        intersection = first & second
+        self.assertEqual(
+            intersection.domains,
+            {
+                "a.example.com": policies.domain_rule(["8500-9000"]),
+                "c.example.com": policies.domain_rule(["*"], secure=False),
+                "d.example.com": policies.domain_rule(),
+                "e.example.com": policies.domain_rule(["80", "1000-2000"]),
+                "f.example.com": policies.domain_rule(["80"]),
+            },
+        )
+        self.assertEqual(
+            intersection.header_domains,
+            {
+                "a.example.com": policies.header_rule(["x-foo*", "SOAPAction"]),
+                "b.example.com": policies.header_rule(["SOAPAction", "X-*"]),
+            },
+        )
+        self.assertFalse(intersection.allows("b.example.com", port=80))
+        self.assertFalse(intersection.allows("a.example.com", port=80, secure=False))
+        self.assertTrue(intersection.allows("a.example.com", port=8500))
+        self.assertEqual((second & first).domains, intersection.domains)
+        self.assertTrue(intersection.allows_headers("a.example.com", ["soapaction"]))
+
+    def test_subtraction(self):
+        """
+        Tests that subtracting a policy removes what it allows.
+
+        """
+        first = self.make_policy("media.example.com", "api.example.com")
+        second = policies.Policy("api.example.com")
+        second.allow_identity(self.dummy_fingerprint)
+        difference = first - second
+        self.assertEqual(list(difference.domains), ["media.example.com"])
+        self.assertEqual(list(difference.header_domains), ["media.example.com"])
+        self.assertEqual(difference.identities, [])
+        self.assertIn(b"api.example.com", first.serialize())
+        self.assertNotIn(b"api.example.com", difference.serialize())
+
+    def test_operators_other_types(self):
+        """
+        Tests that policies can only be combined with policies.
+
+        """
+        policy = policies.Policy()
+        for operation in (
+            lambda: policy | {},
+            lambda: policy & {},
+            lambda: policy - {},
+        ):
+            with self.assertRaises(TypeError):
+                operation()
+
+    def test_diff(self):
+        """
+        Tests that diffing two policies reports each change.
+
+        """
+        old = self.make_policy("media.example.com", "api.example.com")
+        new = old.copy()
+        self.assertFalse(old.diff(new))
+        self.assertFalse(
+            old.diff(self.make_policy("media.example.com", "api.example.com"))
+        )
+        new.allow_domain("api.example.com", secure=False)
+        new.allow_domain("static.example.com")
+        del new.domains["media.example.com"]
+        new.allow_headers("media.example.com", ["OtherHeader"])
+        new.identities = [self.other_fingerprint]
+        new.metapolicy(policies.SITE_CONTROL_ALL)
+        new.compact = True
+        diff = old.diff(new)
+        self.assertTrue(diff)
+        self.assertEqual(diff.site_control, (None, policies.SITE_CONTROL_ALL))
+        self.assertEqual(diff.compact, (False, True))
+        self.assertEqual(list(diff.added_domains), ["static.example.com"])
+        self.assertEqual(list(diff.removed_domains), ["media.example.com"])
+        self.assertEqual(
+            diff.changed_domains,
+            {
+                "api.example.com": (
+                    policies.domain_rule(),
+                    policies.domain_rule(secure=False),
+                )
+            },
+        )
+        self.assertEqual(diff.added_header_domains, {})
+        self.assertEqual(diff.removed_header_domains, {})
+        self.assertEqual(
+            list(diff.changed_header_domains["media.example.com"][1]["headers"]),
+            ["OtherHeader"],
+        )
+        self.assertEqual(diff.added_identities, [self.other_fingerprint])
+        self.assertEqual(diff.removed_identities, [self.dummy_fingerprint])
+        reverse = new.diff(old)
+        self.assertEqual(reverse.added_domains, diff.removed_domains)
+        self.assertEqual(list(reverse.added_header_domains), [])
+
+
+class FrozenPolicyTests(SimpleTestCase):
+    """
+    Tests frozen policies.
+
+    """
+
+    def make_policy(self):
+        policy = policies.Policy("media.example.com")
+        policy.allow_headers("media.example.com", ["SomeHeader"])
+        policy.allow_identity(
+            "01:23:45:67:89:ab:cd:ef:01:23:45:67:89:ab:cd:ef:01:23:45:67"
+        )
+        return policy
+
+    def test_precomputed(self):
+        """
+        Tests that a frozen policy is serialized, compressed and hashed
+        when frozen, identically to the original.
+
+        """
+        policy = self.make_policy()
+        frozen = policy.freeze()
+        self.assertIsInstance(frozen, policies.Policy)
+        expected = {
+            encoding: policy.compress(encoding) for encoding in policies.COMPRESSORS
+        }
+        expected.update(serialized=policy.serialize(), digest=policy.digest())
+        with mock.patch.object(policies.Policy, "_iter_xml") as iter_xml:
+            self.assertEqual(frozen.serialize(), expected["serialized"])
+            self.assertEqual(frozen.digest(), expected["digest"])
+            for encoding in policies.COMPRESSORS:
+                self.assertEqual(frozen.compress(encoding), expected[encoding])
+        iter_xml.assert_not_called()
+        self.assertEqual(frozen.serialize(compact=True), policy.serialize(compact=True))
+        self.assertIs(frozen.freeze(), frozen)
+
+    def test_immutable(self):
+        """
+        Tests that a frozen policy cannot be changed.
+
+        """
+        frozen = self.make_policy().freeze()
+        serialized = frozen.serialize()
+        for change in (
+            lambda: frozen.allow_domain("api.example.com"),
+            lambda: frozen.allow_domains(["api.example.com"]),
+            lambda: frozen.allow_headers("api.example.com", ["SomeHeader"]),
+            lambda: frozen.allow_headers_many({"api.example.com": ["SomeHeader"]}),
+            lambda: frozen.allow_identity("fe"),
+            lambda: frozen.allow_identities(["fe"]),
+            lambda: frozen.metapolicy(policies.SITE_CONTROL_ALL),
+            lambda: frozen.invalidate(),
+            lambda: frozen.domains.update({"api.example.com": None}),
+            lambda: frozen.header_domains.clear(),
+            lambda: frozen.identities.append("fe"),
+        ):
+            with self.assertRaises((TypeError, AttributeError)):
+                change()
+        for name in ("compact", "site_control", "domains", "identities"):
+            with self.assertRaises(AttributeError):
+                setattr(frozen, name, None)
+        self.assertEqual(frozen.serialize(), serialized)
+        self.assertEqual(list(frozen.header_domains), ["media.example.com"])
+        self.assertEqual(len(frozen.identities), 1)
+
+    def test_independent(self):
+        """
+        Tests that changing the original policy after freezing it does
+        not change the frozen policy.
+
+        """
+        policy = self.make_policy()
+        frozen = policy.freeze()
+        policy.allow_domain("api.example.com")
+        policy.domains["static.example.com"] = policies.domain_rule()
+        self.assertEqual(list(frozen.domains), ["media.example.com"])
+        self.assertNotEqual(frozen, policy.freeze())
+
+    def test_copy(self):
+        """
+        Tests that copying a frozen policy gives a mutable policy.
+
+        """
+        frozen = self.make_policy().freeze()
+        for thawed in (frozen.copy(), copy.copy(frozen)):
+            self.assertIs(type(thawed), policies.Policy)
+            self.assertEqual(thawed.serialize(), frozen.serialize())
+            thawed.allow_domain("api.example.com")
+            self.assertEqual(list(frozen.domains), ["media.example.com"])
+        merged = frozen | policies.Policy("api.example.com")
+        self.assertIs(type(merged), policies.Policy)
+        self.assertEqual(len(merged.domains), 2)
+
+    def test_hashable(self):
+        """
+        Tests that frozen policies are hashable, and equal when their
+        contents are.
+
+        """
+        first = self.make_policy().freeze()
+        second = self.make_policy().freeze()
+        self.assertEqual(first, second)
+        self.assertEqual(hash(first), hash(second))
+        self.assertEqual(len({first, second}), 1)
+        self.assertNotEqual(first, policies.Policy("media.example.com").freeze())
+        self.assertNotEqual(first, self.make_policy())
+
+    def test_pickle(self):
+        """
+        Tests that frozen policies can be pickled.
+
+        """
+        frozen = self.make_policy().freeze()
+        unpickled = pickle.loads(pickle.dumps(frozen))
+        self.assertEqual(unpickled, frozen)
+        self.assertEqual(unpickled.compress("gzip"), frozen.compress("gzip"))
+
+    def test_invalid(self):
+        """
+        Tests that an invalid policy cannot be frozen.
+
+        """
+        policy = policies.Policy("media.example.com")
+        policy.site_control = policies.SITE_CONTROL_NONE
+        with self.assertRaisesMessage(TypeError, policies.BAD_POLICY):
+            policy.freeze()
@@ -0,0 +1,90 @@
+from unittest import mock
+
+from django.apps import apps
+from django.test import SimpleTestCase, override_settings
+
+from flashpolicies import policies
+from flashpolicies.discovery import find_policies, preload
+
+from .preload_urls import PER_SITE_POLICY
+
+
+@override_settings(ROOT_URLCONF="tests.preload_urls")
+class PreloadTests(SimpleTestCase):
+    """
+    Tests preloading the policies served by a URLconf.
+
+    """
+
+    def setUp(self):
+        self.found = {routed.path: routed for routed in find_policies()}
+        for routed in self.found.values():
+            routed.policy.invalidate()
+        PER_SITE_POLICY.invalidate()
+
+    def assertCompressed(self, path, compact, compressed=True):
+        cache = self.found[path].policy._cache
+        for encoding in policies.COMPRESSORS:
+            key = "compress:{}:{}".format(encoding, compact)
+            if compressed:
+                self.assertIn(key, cache, path)
+            else:
+                self.assertNotIn(key, cache, path)
+
+    def test_preload(self):
+        """
+        Tests that preloading serializes each policy in the form it is
+        served, and compresses those served compressed.
+
+        """
+        self.assertEqual(preload(), 4)
+        for path, compact in (
+            ("default.xml", False),
+            ("compressed.xml", True),
+            ("uncompressed.xml", False),
+        ):
+            cache = self.found[path].policy._cache
+            self.assertIn("serialize:{}".format(compact), cache)
+            self.assertIn("validators:{}".format(compact), cache)
+        self.assertCompressed("default.xml", False, False)
+        self.assertCompressed("compressed.xml", True)
+        self.assertCompressed("uncompressed.xml", False, False)
+
+    def test_preload_captured(self):
+        """
+        Tests that preloading includes the policies of patterns which
+        capture arguments, which cannot be exported.
+
+        """
+        self.assertNotIn(
+            PER_SITE_POLICY, [routed.policy for routed in self.found.values()]
+        )
+        preload()
+        self.assertIn("serialize:False", PER_SITE_POLICY._cache)
+        self.assertIn("validators:False", PER_SITE_POLICY._cache)
+
+    @override_settings(FLASHPOLICIES_COMPRESS=True)
+    def test_preload_compress_setting(self):
+        """
+        Tests that the setting ``FLASHPOLICIES_COMPRESS`` applies to
+        policies whose view is not passed ``compress``.
+
+        """
+        preload()
+        self.assertCompressed("default.xml", False)
+        self.assertCompressed("compressed.xml", True)
+        self.assertCompressed("uncompressed.xml", False, False)
+
+    def test_ready(self):
+        """
+        Tests that policies are preloaded at startup only if the
+        setting ``FLASHPOLICIES_PRELOAD`` is enabled.
+
+        """
+        config = apps.get_app_config("flashpolicies")
+        with mock.patch("flashpolicies.discovery.preload") as mock_preload:
+            config.ready()
+            mock_preload.assert_not_called()
+            with self.settings(FLASHPOLICIES_PRELOAD=True):
+                config.ready()
+            mock_preload.assert_called_once_with()
@@ -0,0 +1,445 @@
+import asyncio
+import io
+import os
+import signal
+import socket
+import sys
+import tempfile
+import time
+from unittest import mock
+
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase
+
+from flashpolicies import policies, server
+
+
+def make_socket_policy():
+    policy = policies.Policy()
+    policy.allow_domain("media.example.com", to_ports=["80", "8000-9000"])
+    return policy
+
+
+test_policy = make_socket_policy()
+
+
+class PolicyServerTests(SimpleTestCase):
+    """
+    Tests the socket policy server.
+
+    """
+
+    async def start_server(self, **kwargs):
+        policy_server = server.PolicyServer(
+            make_socket_policy(), host="127.0.0.1", port=0, **kwargs
+        )
+        await policy_server.start()
+        port = policy_server.server.sockets[0].getsockname()[1]
+        return policy_server, port
+
+    async def request(self, port, data=server.POLICY_FILE_REQUEST):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(data)
+        try:
+            response = await reader.read()
+        except ConnectionResetError:
+            # The server may close the connection before reading what
+            # was sent.
+            response = b""
+        writer.close()
+        return response
+
+    async def test_policy_request(self):
+        """
+        Tests that a policy request is answered with the serialized
+        policy, terminated by a NUL byte.
+
+        """
+        policy_server, port = await self.start_server()
+        try:
+            response = await self.request(port)
+        finally:
+            policy_server.close()
+        self.assertEqual(response, make_socket_policy().serialize() + b"\0")
+        self.assertEqual(policy_server.connections, 0)
+
+    async def test_set_policy(self):
+        """
+        Tests that changing the policy affects later connections.
+
+        """
+        policy_server, port = await self.start_server()
+        new_policy = policies.Policy("api.example.com")
+        policy_server.set_policy(new_policy)
+        try:
+            response = await self.request(port)
+        finally:
+            policy_server.close()
+        self.assertEqual(response, new_policy.serialize() + b"\0")
+
+    async def test_bad_request(self):
+        """
+        Tests that anything other than a policy request gets no
+        response.
+
+        """
+        policy_server, port = await self.start_server()
+        try:
+            self.assertEqual(await self.request(port, b"GET / HTTP/1.0\0"), b"")
+            self.assertEqual(await self.request(port, b"x" * 1024), b"")
+        finally:
+            policy_server.close()
+
+    async def test_timeout(self):
+        """
+        Tests that a client which never sends a complete request is
+        disconnected.
+
+        """
+        policy_server, port = await self.start_server(timeout=0.05)
+        try:
+            self.assertEqual(await self.request(port, b"<policy-file"), b"")
+        finally:
+            policy_server.close()
+
+    async def test_max_connections(self):
+        """
+        Tests that connections beyond the limit are closed immediately.
+
+        """
+        policy_server, port = await self.start_server(max_connections=1)
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            while not policy_server.connections:
+                await asyncio.sleep(0.01)
+            self.assertEqual(await self.request(port), b"")
+            writer.write(server.POLICY_FILE_REQUEST)
+            self.assertTrue((await reader.read()).endswith(b"\0"))
+            writer.close()
+        finally:
+            policy_server.close()
+
+    def test_close_unstarted(self):
+        """
+        Tests that closing a server which was never started is
+        harmless.
+
+        """
+        server.PolicyServer(make_socket_policy()).close()
+
+    async def test_serve_forever(self):
+        """
+        Tests serving on an already-bound socket until cancelled.
+
+        """
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+        policy_server = server.PolicyServer(make_socket_policy())
+        task = asyncio.ensure_future(policy_server.serve_forever(sock))
+        while policy_server.server is None:
+            await asyncio.sleep(0.01)
+        response = await self.request(port)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        self.assertEqual(response, make_socket_policy().serialize() + b"\0")
+
+
+class RunPolicyServerCommandTests(SimpleTestCase):
+    """
+    Tests the runpolicyserver management command.
+
+    """
+
+    def test_runs_server(self):
+        """
+        Tests that the command runs a server for the named policy.
+
+        """
+        for path in (
+            "tests.test_server.test_policy",
+            "tests.test_server.make_socket_policy",
+        ):
+            with mock.patch("asyncio.run") as run:
+                call_command(
+                    "runpolicyserver", path, "--port", "8430", stdout=mock.Mock()
+                )
+            coroutine = run.call_args[0][0]
+            policy_server = coroutine.cr_frame.f_locals["self"]
+            coroutine.close()
+            self.assertEqual(policy_server.port, 8430)
+            self.assertEqual(policy_server.response, test_policy.serialize() + b"\0")
+
+    def test_keyboard_interrupt(self):
+        """
+        Tests that the command exits quietly when interrupted.
+
+        """
+
+        def interrupt(coroutine):
+            coroutine.close()
+            raise KeyboardInterrupt
+
+        with mock.patch("asyncio.run", interrupt):
+            call_command(
+                "runpolicyserver", "tests.test_server.test_policy", stdout=mock.Mock()
+            )
+
+    def test_prefork(self):
+        """
+        Tests that the command runs a multi-process server when asked
+        for more than one worker.
+
+        """
+        stdout = io.StringIO()
+        with mock.patch.object(server.PreforkPolicyServer, "run", autospec=True) as run:
+            call_command(
+                "runpolicyserver",
+                "tests.test_server.test_policy",
+                "--workers",
+                "3",
+                "--verbosity",
+                "2",
+                stdout=stdout,
+            )
+        prefork, report = run.call_args[0]
+        self.assertEqual(prefork.workers, 3)
+        self.assertEqual(prefork.policy_loader().serialize(), test_policy.serialize())
+        report([1, 2, 0])
+        self.assertIn("Connections per worker: 1, 2, 0", stdout.getvalue())
+
+    def test_prefork_reload(self):
+        """
+        Tests that the workers' policy loader re-imports the module
+        defining the policy, so that reloading picks up changes to it.
+
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            module_path = os.path.join(directory, "reloaded_policy.py")
+            source = (
+                "from flashpolicies.policies import Policy\npolicy = Policy({!r})\n"
+            )
+            with open(module_path, "w") as f:
+                f.write(source.format("media.example.com"))
+            with mock.patch("sys.path", [directory] + sys.path), mock.patch(
+                "sys.dont_write_bytecode", True
+            ), mock.patch.dict("sys.modules"):
+                with mock.patch.object(
+                    server.PreforkPolicyServer, "run", autospec=True
+                ) as run:
+                    call_command(
+                        "runpolicyserver",
+                        "reloaded_policy.policy",
+                        "--workers",
+                        "2",
+                        stdout=mock.Mock(),
+                    )
+                prefork = run.call_args[0][0]
+                self.assertEqual(
+                    prefork.policy_loader().serialize(),
+                    policies.Policy("media.example.com").serialize(),
+                )
+                with open(module_path, "w") as f:
+                    f.write(source.format("api.example.com"))
+                self.assertEqual(
+                    prefork.policy_loader().serialize(),
+                    policies.Policy("api.example.com").serialize(),
+                )
+
+    def test_bad_policy(self):
+        """
+        Tests that the command fails for a path which doesn't name a
+        policy.
+
+        """
+        for path in ("tests.test_server.nonexistent", "tests.test_server.server"):
+            with self.assertRaises(CommandError):
+                call_command("runpolicyserver", path, stdout=mock.Mock())
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def fetch_policy(port, attempts=200):
+    """
+    Synchronously requests a socket policy, retrying while the server
+    starts up.
+
+    """
+    for _ in range(attempts):
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=5) as sock:
+                sock.sendall(server.POLICY_FILE_REQUEST)
+                response = b""
+                while not response.endswith(b"\0"):
+                    chunk = sock.recv(4096)
+                    if not chunk:
+                        break
+                    response += chunk
+                if response:
+                    return response
+        except ConnectionError:
+            pass
+        time.sleep(0.02)
+    raise AssertionError("No policy served on port {}.".format(port))
+
+
+class PreforkPolicyServerTests(SimpleTestCase):
+    """
+    Tests the multi-process socket policy server.
+
+    """
+
+    def test_prefork(self):
+        """
+        Tests that workers serve the policy, reload it when asked, can
+        be restarted if they die, and shut down when stopped.
+
+        """
+        port = free_port()
+        with tempfile.NamedTemporaryFile("w+") as domain_file:
+            domain_file.write("media.example.com")
+            domain_file.flush()
+
+            def load():
+                with open(domain_file.name) as f:
+                    return policies.Policy(f.read())
+
+            prefork = server.PreforkPolicyServer(
+                load, workers=2, host="127.0.0.1", port=port, report_interval=0.01
+            )
+            prefork.start()
+            try:
+                self.assertEqual(
+                    fetch_policy(port),
+                    policies.Policy("media.example.com").serialize() + b"\0",
+                )
+                with open(domain_file.name, "w") as f:
+                    f.write("api.example.com")
+                prefork.reload()
+                deadline = time.monotonic() + 5
+                while time.monotonic() < deadline:
+                    if all(b"api.example.com" in fetch_policy(port) for _ in range(10)):
+                        break
+                else:
+                    self.fail("Workers did not reload the policy.")
+                dead = prefork.processes[0]
+                os.kill(dead.pid, signal.SIGKILL)
+                dead.join()
+                prefork.respawn()
+                self.assertIsNot(prefork.processes[0], dead)
+                self.assertTrue(prefork.processes[1].is_alive())
+                self.assertIn(b"api.example.com", fetch_policy(port))
+                self.assertEqual(len(prefork.connection_counts()), 2)
+            finally:
+                prefork.stop()
+        self.assertFalse(any(process.is_alive() for process in prefork.processes))
+
+    def test_stop_while_loading(self):
+        """
+        Tests that workers sent SIGTERM while still loading the policy
+        stop once they have loaded it, rather than running the
+        parent's handler.
+
+        """
+
+        def load():
+            time.sleep(0.5)
+            return make_socket_policy()
+
+        prefork = server.PreforkPolicyServer(
+            load, workers=1, host="127.0.0.1", port=free_port()
+        )
+        # As installed by run().
+        previous = signal.signal(signal.SIGTERM, lambda signum, frame: None)
+        try:
+            prefork.start()
+        finally:
+            signal.signal(signal.SIGTERM, previous)
+        process = prefork.processes[0]
+        try:
+            time.sleep(0.1)
+            process.terminate()
+            process.join(5)
+            self.assertFalse(process.is_alive())
+            self.assertEqual(process.exitcode, 0)
+        finally:
+            process.kill()
+
+    def test_run(self):
+        """
+        Tests that run() starts the workers, reports their connection
+        counts, reloads them on SIGHUP and stops them on SIGTERM.
+
+        """
+        prefork = server.PreforkPolicyServer(
+            make_socket_policy, workers=2, report_interval=0.01
+        )
+        reports = []
+
+        def report(counts):
+            reports.append(counts)
+            if len(reports) == 1:
+                os.kill(os.getpid(), signal.SIGHUP)
+            elif len(reports) == 2:
+                os.kill(os.getpid(), signal.SIGTERM)
+
+        previous = signal.getsignal(signal.SIGTERM)
+        with mock.patch.multiple(
+            prefork, start=mock.DEFAULT, stop=mock.DEFAULT, reload=mock.DEFAULT
+        ) as mocks:
+            prefork.run(report)
+        mocks["start"].assert_called_once_with()
+        mocks["reload"].assert_called_once_with()
+        mocks["stop"].assert_called_once_with()
+        self.assertEqual(reports[:2], [[0, 0], [0, 0]])
+        self.assertIs(signal.getsignal(signal.SIGTERM), previous)
+
+    def test_reload_skips_dead_workers(self):
+        """
+        Tests that reloading ignores workers which are not running.
+
+        """
+        prefork = server.PreforkPolicyServer(make_socket_policy, workers=1)
+        prefork.processes = [mock.Mock(is_alive=mock.Mock(return_value=False))]
+        prefork.reload()
+
+
+class RunWorkerTests(SimpleTestCase):
+    """
+    Tests the loop run by each prefork worker.
+
+    """
+
+    async def test_graceful_shutdown(self):
+        """
+        Tests that a stopped worker stops accepting connections but
+        waits for those in progress.
+
+        """
+        policy_server = server.PolicyServer(
+            make_socket_policy(), host="127.0.0.1", port=0, timeout=5
+        )
+        stopping = asyncio.Event()
+        reports = []
+        task = asyncio.ensure_future(
+            server.run_worker(policy_server, None, stopping, reports.append, 0.01)
+        )
+        while policy_server.server is None:
+            await asyncio.sleep(0.01)
+        port = policy_server.server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        while 1 not in reports:
+            await asyncio.sleep(0.01)
+        stopping.set()
+        await asyncio.sleep(0.05)
+        self.assertFalse(task.done())
+        writer.write(server.POLICY_FILE_REQUEST)
+        self.assertTrue((await reader.read()).endswith(b"\0"))
+        writer.close()
+        await task
+        self.assertEqual(reports[-1], 0)
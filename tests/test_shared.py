@@ -0,0 +1,208 @@
+import os
+import tempfile
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.http import Http404
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from flashpolicies import metrics, policies, shared, views
+
+
+class SharedPolicyStoreTests(SimpleTestCase):
+    """
+    Tests storing serialized policies in a shared, memory-mapped file.
+
+    """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.path = os.path.join(self.directory, "policies.store")
+        self.store = shared.SharedPolicyStore(self.path, check_interval=0)
+        self.policy = policies.Policy("media.example.com")
+
+    def test_get(self):
+        """
+        Tests that published policies can be read back, in each form.
+
+        """
+        self.store.publish({"main": self.policy}, compress=True)
+        for compact in (False, True):
+            stored = self.store.get("main", compact)
+            self.assertIsInstance(stored.body, memoryview)
+            self.assertEqual(stored.body, self.policy.serialize(compact))
+            self.assertEqual(stored.digest, self.policy.digest(compact))
+            for encoding in policies.COMPRESSORS:
+                stored = self.store.get("main", compact, encoding)
+                self.assertEqual(stored.body, self.policy.compress(encoding, compact))
+                self.assertEqual(stored.digest, self.policy.digest(compact))
+        self.assertIsNone(self.store.get("other"))
+
+    def test_uncompressed(self):
+        """
+        Tests that compressed forms are only stored on request.
+
+        """
+        self.store.publish({"main": self.policy})
+        self.assertIsNotNone(self.store.get("main"))
+        self.assertIsNone(self.store.get("main", encoding="gzip"))
+
+    def test_shared_bodies(self):
+        """
+        Tests that identical bodies are stored only once.
+
+        """
+        self.store.publish({"main": self.policy, "copy": self.policy.copy()})
+        self.assertEqual(self.store.names(), ["copy", "main"])
+        self.assertEqual(len(self.store._current().bodies), 2)
+        self.assertEqual(self.store.get("copy"), self.store.get("main"))
+
+    def test_updates(self):
+        """
+        Tests that readers pick up newly-published policies, checking
+        no more often than their ``check_interval``.
+
+        """
+        reader = shared.SharedPolicyStore(self.path, check_interval=3600)
+        self.assertIsNone(reader.get("main"))
+        self.assertEqual(reader.names(), [])
+        self.store.publish({"main": self.policy})
+        self.assertIsNone(reader.get("main"))
+        old = self.store.get("main").body
+        other = policies.Policy("api.example.com")
+        self.store.publish({"main": other})
+        self.assertEqual(self.store.get("main").body, other.serialize())
+        # Views of the previous version remain valid.
+        self.assertEqual(old, self.policy.serialize())
+        reader.checked = float("-inf")
+        self.assertEqual(reader.get("main").body, other.serialize())
+        os.unlink(self.path)
+        self.assertIsNone(self.store.get("main"))
+
+    def test_permissions(self):
+        """
+        Tests that the file is readable by other users, as the umask
+        allows.
+
+        """
+        umask = os.umask(0o022)
+        try:
+            self.store.publish({"main": self.policy})
+        finally:
+            os.umask(umask)
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o644)
+
+    def test_failed_publish(self):
+        """
+        Tests that a failed publish leaves the store unchanged.
+
+        """
+        self.store.publish({"main": self.policy})
+        with mock.patch("os.replace", side_effect=OSError):
+            with self.assertRaises(OSError):
+                self.store.publish({"other": self.policy})
+        self.assertEqual(os.listdir(self.directory), ["policies.store"])
+        self.assertEqual(self.store.names(), ["main"])
+
+    def test_not_a_store(self):
+        """
+        Tests that files which are not stores are refused.
+
+        """
+        for content in (b"", b"not a policy store"):
+            with self.subTest(content=content):
+                with open(self.path, "wb") as f:
+                    f.write(content)
+                with self.assertRaises(TypeError):
+                    self.store.get("main")
+
+
+class SharedViewTests(SimpleTestCase):
+    """
+    Tests serving policies from a shared store.
+
+    """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "policies.store")
+        self.store = shared.SharedPolicyStore(path)
+        self.policy = policies.Policy("media.example.com")
+        self.store.publish({"main": self.policy}, compress=True)
+
+    def get(self, view=views.serve_shared, name="main", **kwargs):
+        request = RequestFactory().get("/crossdomain.xml", HTTP_ACCEPT_ENCODING="gzip")
+        return view(request, self.store, name, **kwargs)
+
+    def test_serve(self):
+        """
+        Tests that stored policies are served, like those served from
+        ``Policy`` objects.
+
+        """
+        for view in (views.serve_shared, async_to_sync(views.aserve_shared)):
+            with self.subTest(view=view):
+                response = self.get(view, cache_control={"max_age": 60})
+                self.assertEqual(response.content, self.policy.serialize())
+                self.assertEqual(
+                    response["Content-Type"],
+                    "text/x-cross-domain-policy; charset=utf-8",
+                )
+                self.assertEqual(response["ETag"], '"{}"'.format(self.policy.digest()))
+                self.assertIn("max-age=60", response["Cache-Control"])
+
+    def test_compressed(self):
+        """
+        Tests that compressed copies are served when published.
+
+        """
+        response = self.get(compress=True, compact=True)
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(response.content, self.policy.compress("gzip", True))
+        self.assertEqual(response["ETag"], '"{}-gzip"'.format(self.policy.digest(True)))
+        self.store.publish({"main": self.policy})
+        self.store.checked = float("-inf")
+        response = self.get(compress=True)
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertEqual(response.content, self.policy.serialize())
+        self.assertEqual(response["Vary"], "Accept-Encoding")
+
+    def test_conditional(self):
+        """
+        Tests that conditional requests are answered with a 304.
+
+        """
+        request = RequestFactory().get(
+            "/crossdomain.xml", HTTP_IF_NONE_MATCH='"{}"'.format(self.policy.digest())
+        )
+        response = views.serve_shared(request, self.store, "main")
+        self.assertEqual(response.status_code, 304)
+
+    def test_missing(self):
+        """
+        Tests that a name not in the store is a 404.
+
+        """
+        with self.assertRaises(Http404):
+            self.get(name="other")
+
+    @override_settings(FLASHPOLICIES_METRICS="flashpolicies.metrics.StatsdBackend")
+    def test_metrics(self):
+        """
+        Tests that serving from the store is recorded in metrics.
+
+        """
+        response = self.get()
+        tags = "|#policy:{},route:".format(response["ETag"].strip('"')[:12])
+        self.assertEqual(
+            metrics.get_backend().flush(),
+            [
+                "flashpolicies_bytes_sent_total:{}|c{}".format(
+                    len(response.content), tags
+                ),
+                "flashpolicies_served_total:1|c{},status:200".format(tags),
+            ],
+        )
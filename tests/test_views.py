@@ -1,8 +1,13 @@
+import gzip
+import hashlib
 import xml.dom.minidom
 
-from django.test import SimpleTestCase
+import brotli
+from asgiref.sync import sync_to_async
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from django.urls import resolve
 
-from flashpolicies import policies
+from flashpolicies import policies, views
 
 
 class PolicyViewTests(SimpleTestCase):
@@ -120,3 +125,236 @@ class PolicyViewTests(SimpleTestCase):
             ),
             policies.SITE_CONTROL_ALL,
         )
+
+    def test_validators(self):
+        """
+        Tests that policy responses carry an ETag derived from the
+        serialized policy, and a Last-Modified header.
+
+        """
+        response = self.client.get("/crossdomain-serve.xml")
+        self.assertEqual(
+            response["ETag"],
+            '"{}"'.format(hashlib.sha256(response.content).hexdigest()),
+        )
+        self.assertIn("Last-Modified", response)
+
+    def test_if_none_match(self):
+        """
+        Tests that a request with a matching If-None-Match header gets
+        a 304 response with no body, and that a non-matching one gets
+        the full policy.
+
+        """
+        for url in (
+            "/crossdomain-serve.xml",
+            "/crossdomain-allow-domains.xml",
+            "/crossdomain-no-access.xml",
+            "/crossdomain-metapolicy.xml",
+        ):
+            etag = self.client.get(url)["ETag"]
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.content, b"")
+            self.assertEqual(response["ETag"], etag)
+            response = self.client.get(url, HTTP_IF_NONE_MATCH='"stale"')
+            self.assertEqual(response.status_code, 200)
+
+    def test_if_modified_since(self):
+        """
+        Tests that a request with an If-Modified-Since header no older
+        than the policy gets a 304 response.
+
+        """
+        last_modified = self.client.get("/crossdomain-serve.xml")["Last-Modified"]
+        response = self.client.get(
+            "/crossdomain-serve.xml", HTTP_IF_MODIFIED_SINCE=last_modified
+        )
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(
+            "/crossdomain-serve.xml",
+            HTTP_IF_MODIFIED_SINCE="Mon, 01 Jan 2001 00:00:00 GMT",
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_helper_policy_reused(self):
+        """
+        Tests that the helper views build each distinct policy only
+        once.
+
+        """
+        first = views._build_policy(("media.example.com",))
+        self.assertIs(first, views._build_policy(("media.example.com",)))
+        self.assertIsNot(
+            first,
+            views._build_policy(("media.example.com",), policies.SITE_CONTROL_ALL),
+        )
+
+    def test_no_caching_headers_by_default(self):
+        """
+        Tests that no caching headers are sent unless configured.
+
+        """
+        response = self.client.get("/crossdomain-serve.xml")
+        for header in ("Cache-Control", "Expires", "Surrogate-Control"):
+            self.assertNotIn(header, response)
+
+    def test_cache_control_argument(self):
+        """
+        Tests that caching directives passed to a view are sent, and
+        are preserved on 304 responses.
+
+        """
+        response = self.client.get("/crossdomain-cached.xml")
+        self.assertEqual(
+            set(response["Cache-Control"].split(", ")),
+            {
+                "public",
+                "max-age=3600",
+                "s-maxage=86400",
+                "stale-while-revalidate=60",
+                "immutable",
+            },
+        )
+        self.assertEqual(response["Surrogate-Control"], "max-age=86400")
+        self.assertIn("Expires", response)
+        response = self.client.get(
+            "/crossdomain-cached.xml", HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertIn("max-age=3600", response["Cache-Control"])
+
+    @override_settings(FLASHPOLICIES_CACHE_CONTROL={"max_age": 600})
+    def test_cache_control_setting(self):
+        """
+        Tests that the FLASHPOLICIES_CACHE_CONTROL setting provides
+        default caching directives.
+
+        """
+        for url in ("/crossdomain-serve.xml", "/crossdomain-no-access.xml"):
+            response = self.client.get(url)
+            self.assertEqual(
+                set(response["Cache-Control"].split(", ")), {"public", "max-age=600"}
+            )
+            self.assertIn("Expires", response)
+            self.assertNotIn("Surrogate-Control", response)
+
+    def test_compressed(self):
+        """
+        Tests that a compressed policy is served to clients which
+        accept one, preferring Brotli, with appropriate headers.
+
+        """
+        uncompressed = self.client.get("/crossdomain-serve.xml")
+        for accept, encoding, decompress in (
+            ("gzip, deflate", "gzip", gzip.decompress),
+            ("gzip;q=0.5, br", "br", brotli.decompress),
+            ("br;q=0, *", "gzip", gzip.decompress),
+        ):
+            response = self.client.get(
+                "/crossdomain-compressed.xml", HTTP_ACCEPT_ENCODING=accept
+            )
+            self.assertEqual(response["Content-Encoding"], encoding)
+            self.assertEqual(response["Vary"], "Accept-Encoding")
+            self.assertEqual(decompress(response.content), uncompressed.content)
+            self.assertNotEqual(response["ETag"], uncompressed["ETag"])
+            response = self.client.get(
+                "/crossdomain-compressed.xml",
+                HTTP_ACCEPT_ENCODING=accept,
+                HTTP_IF_NONE_MATCH=response["ETag"],
+            )
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response["Vary"], "Accept-Encoding")
+
+    def test_compressed_not_accepted(self):
+        """
+        Tests that the uncompressed policy is served to clients which
+        don't accept any available compression encoding.
+
+        """
+        for accept in ("", "identity", "gzip;q=0, br;q=bogus,, deflate"):
+            response = self.client.get(
+                "/crossdomain-compressed.xml", HTTP_ACCEPT_ENCODING=accept
+            )
+            self.assertNotIn("Content-Encoding", response)
+            self.assertEqual(response["Vary"], "Accept-Encoding")
+            xml.dom.minidom.parseString(response.content)
+
+    @override_settings(FLASHPOLICIES_COMPRESS=True)
+    def test_compress_setting(self):
+        """
+        Tests that the FLASHPOLICIES_COMPRESS setting enables
+        compression by default.
+
+        """
+        response = self.client.get(
+            "/crossdomain-no-access.xml", HTTP_ACCEPT_ENCODING="gzip"
+        )
+        self.assertEqual(response["Content-Encoding"], "gzip")
+
+    def test_not_compressed_by_default(self):
+        """
+        Tests that policies are not compressed unless requested.
+
+        """
+        response = self.client.get(
+            "/crossdomain-serve.xml", HTTP_ACCEPT_ENCODING="gzip"
+        )
+        self.assertNotIn("Content-Encoding", response)
+        self.assertNotIn("Vary", response)
+
+    def test_compact(self):
+        """
+        Tests that a view can serve a policy in compact form, with an
+        ETag matching the compact serialization.
+
+        """
+        response = self.client.get("/crossdomain-compact.xml")
+        self.assertNotIn(b"\n", response.content)
+        self.assertEqual(
+            response["ETag"],
+            '"{}"'.format(hashlib.sha256(response.content).hexdigest()),
+        )
+        policy = xml.dom.minidom.parseString(response.content)
+        self.assertEqual(len(policy.getElementsByTagName("allow-access-from")), 1)
+
+    async def test_async_views(self):
+        """
+        Tests that the asynchronous views serve the same responses as
+        their synchronous counterparts.
+
+        """
+        for name in (
+            "crossdomain-serve.xml",
+            "crossdomain-allow-domains.xml",
+            "crossdomain-no-access.xml",
+            "crossdomain-metapolicy.xml",
+        ):
+            sync_response = await sync_to_async(self.client.get)("/" + name)
+            response = await self.async_client.get("/async/" + name)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.content, sync_response.content)
+            self.assertEqual(response["ETag"], sync_response["ETag"])
+            self.assertEqual(response["Content-Type"], sync_response["Content-Type"])
+            match = resolve("/async/" + name)
+            request = RequestFactory().get(
+                "/async/" + name, HTTP_IF_NONE_MATCH=response["ETag"]
+            )
+            response = await match.func(request, *match.args, **match.kwargs)
+            self.assertEqual(response.status_code, 304)
+
+    @override_settings(ALLOWED_HOSTS=["*"])
+    def test_serve_by_host(self):
+        """
+        Tests that the per-host view serves the policy registered for
+        the request's host, or a 404 if there is none.
+
+        """
+        for url in ("/crossdomain-by-host.xml", "/async/crossdomain-by-host.xml"):
+            response = self.client.get(url, HTTP_HOST="media.example.com")
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(b'domain="api.example.com"', response.content)
+            response = self.client.get(url, HTTP_HOST="www.example.org:8000")
+            self.assertIn(b'domain="static.example.org"', response.content)
+            response = self.client.get(url, HTTP_HOST="example.net")
+            self.assertEqual(response.status_code, 404)
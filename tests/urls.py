@@ -5,9 +5,10 @@ situation.
 
 """
 
-from django.urls import path
+from django.urls import path, re_path
 
-from flashpolicies import policies, views
+from flashpolicies import hosts, metrics, policies, views
+from flashpolicies.db.views import serve_stored
 
 
 def make_test_policy():
@@ -17,8 +18,20 @@ def make_test_policy():
     return policy
 
 
+host_registry = hosts.HostPolicyRegistry(
+    {
+        "media.example.com": policies.Policy("api.example.com"),
+        "*.example.org": policies.Policy("static.example.org"),
+    }
+)
+
+
 urlpatterns = [
+    path("metrics", metrics.prometheus_metrics),
     path("crossdomain-serve.xml", views.serve, {"policy": make_test_policy()}),
+    re_path(
+        r"^sites/[-\w]+/crossdomain.xml$", views.serve, {"policy": make_test_policy()}
+    ),
     path(
         "crossdomain-allow-domains.xml",
         views.allow_domains,
@@ -30,6 +43,53 @@ urlpatterns = [
         {"domains": ["media.example.com", "api.example.com"]},
     ),
     path("crossdomain-no-access.xml", views.no_access),
+    path("async/crossdomain-serve.xml", views.aserve, {"policy": make_test_policy()}),
+    path(
+        "async/crossdomain-allow-domains.xml",
+        views.aallow_domains,
+        {"domains": ["media.example.com", "api.example.com"]},
+    ),
+    path("async/crossdomain-no-access.xml", views.ano_access),
+    path(
+        "async/crossdomain-metapolicy.xml",
+        views.ametapolicy,
+        {"permitted": policies.SITE_CONTROL_ALL},
+    ),
+    path(
+        "crossdomain-cached.xml",
+        views.allow_domains,
+        {
+            "domains": ["media.example.com"],
+            "cache_control": {
+                "max_age": 3600,
+                "s_maxage": 86400,
+                "stale_while_revalidate": 60,
+                "immutable": True,
+            },
+        },
+    ),
+    path(
+        "crossdomain-compressed.xml",
+        views.serve,
+        {"policy": make_test_policy(), "compress": True},
+    ),
+    path(
+        "crossdomain-compact.xml",
+        views.allow_domains,
+        {"domains": ["media.example.com"], "compact": True},
+    ),
+    path(
+        "crossdomain-by-host.xml",
+        views.serve_by_host,
+        {"registry": host_registry},
+    ),
+    path(
+        "async/crossdomain-by-host.xml",
+        views.aserve_by_host,
+        {"registry": host_registry},
+    ),
+    path("crossdomain-stored.xml", serve_stored, {"name": "main"}),
+    path("crossdomain-stored-missing.xml", serve_stored, {"name": "missing"}),
     path(
         "crossdomain-metapolicy.xml",
         views.metapolicy,